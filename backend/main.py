@@ -1,13 +1,20 @@
 from flask import Flask
 from flask_cors import CORS
+import sys
 import logging
 from logging.handlers import RotatingFileHandler
 from routes.config import config_bp
 from routes.status import status_bp
 from routes.ringer import ringer_bp
 from routes.busy import busy_bp
+from routes.call import call_bp
+from routes.metrics import metrics_bp
 
-def create_app():
+# Rotated log for the development server. Rotation isn't safe with several
+# processes writing the file, so serve.py logs to stderr instead.
+LOG_FILE = '../flask.log'
+
+def create_app(log_file=LOG_FILE):
   app = Flask(__name__)
   cors = CORS(app, origins="*")
 
@@ -15,9 +22,14 @@ def create_app():
   app.register_blueprint(status_bp, url_prefix='/api')
   app.register_blueprint(ringer_bp, url_prefix='/api')
   app.register_blueprint(busy_bp, url_prefix='/api')
+  app.register_blueprint(call_bp, url_prefix='/api')
+  app.register_blueprint(metrics_bp, url_prefix='/api')
 
-  # Create a rotating file handler
-  log_handler = RotatingFileHandler('../flask.log', maxBytes=100000, backupCount=3)
+  # Create a rotating file handler, or log to stderr
+  if log_file:
+    log_handler = RotatingFileHandler(log_file, maxBytes=100000, backupCount=3)
+  else:
+    log_handler = logging.StreamHandler(sys.stderr)
   log_handler.setLevel(logging.INFO)
   formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
   log_handler.setFormatter(formatter)
@@ -1,9 +1,22 @@
 from multiprocessing import resource_tracker
 from multiprocessing.shared_memory import SharedMemory
-import struct
+import os
+import sys
+import threading
 
-SHARED_MEMORY_SIZE = 5
-SHARED_MEMORY_NAME = "ringring"
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from common import shm_layout, shm_notify, mailbox
+
+SHARED_MEMORY_NAME = shm_layout.SHARED_MEMORY_NAME
+SHARED_MEMORY_PATH = f"/dev/shm/{SHARED_MEMORY_NAME}"
+
+# Seconds a request waits for the device to apply a command by default
+ACK_TIMEOUT = 2
+
+# Longest a request may wait for the device, in seconds
+MAX_WAIT = 30
+
+INVALID_WAIT = f"wait must be a number of seconds from 0 to {MAX_WAIT}"
 
 def patched_register(name, rtype):
     if rtype == 'shared_memory':
@@ -14,70 +27,167 @@ def patched_register(name, rtype):
 original_register = resource_tracker.register
 resource_tracker.register = patched_register
 
-def read_shared_memory():
-    """Read booleans from shared memory."""
+class Segment:
+    """Long-lived mapping of the status segment, one per process.
+
+    The device recreates the segment when it restarts, which leaves the old
+    mapping pointing at an orphaned copy, so every access compares the
+    inode behind the name with the one that was mapped and remaps on a
+    mismatch. Decoded status is cached per seqlock sequence. Reads are
+    short copies, so they are done under one lock with the remap.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.shm = None
+        self.inode = None
+        self.cache = (None, None)
+
+    def close(self):
+        if self.shm is not None:
+            self.shm.close()
+        self.shm = None
+        self.inode = None
+        self.cache = (None, None)
+
+    def _buffer(self):
+        """Return the mapped buffer, remapping if the segment was recreated. Holds lock."""
+        try:
+            inode = os.stat(SHARED_MEMORY_PATH).st_ino
+        except FileNotFoundError:
+            self.close()
+            raise
+
+        if self.shm is None or inode != self.inode:
+            self.close()
+            self.shm = SharedMemory(name=SHARED_MEMORY_NAME, create=False)
+            self.inode = inode
+
+        return self.shm.buf
+
+    def read(self):
+        """Return ((inode, sequence), status), decoding only when the sequence moved.
+
+        The whole read holds the lock, so another request can't remap and
+        close the mapping while this one is still copying out of it.
+        """
+        with self.lock:
+            buf = self._buffer()
+            shm_layout.check(buf)
+
+            sequence = shm_layout.read_sequence(buf)
+            cached_sequence, status = self.cache
+            if cached_sequence != sequence:
+                sequence, status = shm_layout.read(buf)
+                self.cache = (sequence, status)
+            return (self.inode, sequence), status
+
+segment = Segment()
+
+def read_status():
+    """Read the device status and its version from shared memory."""
     try:
-        # Connect to the shared memory block
-        shm = SharedMemory(name=SHARED_MEMORY_NAME, create=False)
-
-        # Read the two booleans (assuming they are stored as two bytes)
-        data = bytes(shm.buf[:SHARED_MEMORY_SIZE])  # Copy data from the buffer
-        registered_with_sip, on_the_hook, call_active, ringing, busy = struct.unpack("?" * SHARED_MEMORY_SIZE, data)
-        shm.close()
-
-        return {
-            "registeredWithSIP": registered_with_sip,
-            "onTheHook": on_the_hook,
-            "callActive": call_active,
-            "ringing": ringing,
-            "busy": busy
-        }
+        return segment.read()
     except FileNotFoundError:
-        return {"error": "Shared memory not found. Is the application running?"}
+        return None, {"error": "Shared memory not found. Is the application running?"}
     except Exception as e:
-        return {"error": str(e)}
-    finally:
-        # Ensure the shared memory is properly closed
-        if 'shm' in locals():
-            shm.close()
+        return None, {"error": str(e)}
 
+def read_shared_memory():
+    """Read the device status from shared memory."""
+    return read_status()[1]
 
-def set_busy_state(active):
-    """Set the busy state in shared memory."""
+def get_wait(args):
+    """The ?wait= seconds from request args, or None if it isn't valid."""
+    value = args.get("wait")
+    if value is None:
+        return ACK_TIMEOUT
     try:
-        shm = SharedMemory(name=SHARED_MEMORY_NAME, create=False)
-        shm.buf[SHARED_MEMORY_SIZE - 1:SHARED_MEMORY_SIZE] = struct.pack("?", active)
-        print(f"Ringer state set to: {'active' if active else 'inactive'}")
-    except FileNotFoundError:
-        raise ValueError("Shared memory not found. Ensure it is created first.")
-    finally:
-        if 'shm' in locals():
-            shm.close()
+        wait = float(value)
+    except ValueError:
+        return None
+    # Also rules out nan
+    return wait if 0 <= wait <= MAX_WAIT else None
 
-def get_busy_state():
-    """Get the current ringer state from shared memory."""
-    return read_shared_memory()["busy"]
+def send_command(command_type, value=None, wait=ACK_TIMEOUT):
+    """Send a command to the device through the mailbox.
 
-def set_ringer_state(active):
-    """Set the ringer state (start/stop) in shared memory."""
+    With wait set, return only once the device has applied it.
+    """
     try:
-        shm = SharedMemory(name="ringring", create=False)
-        shm.buf[SHARED_MEMORY_SIZE - 2:SHARED_MEMORY_SIZE - 1] = struct.pack("?", active)
-        print(f"Ringer state set to: {'active' if active else 'inactive'}")
-    except FileNotFoundError:
-        raise ValueError("Shared memory not found. Ensure it is created first.")
-    finally:
-        if 'shm' in locals():
-            shm.close()
+        mailbox.send(command_type, value, wait=wait)
+    except mailbox.MailboxError as e:
+        raise ValueError(str(e))
+
+def set_busy_state(active, wait=ACK_TIMEOUT):
+    """Ask the device to set the busy state."""
+    send_command(mailbox.BUSY, active, wait)
+    print(f"Busy state set to: {'active' if active else 'inactive'}")
+
+def get_busy_state():
+    """Get the current busy state from shared memory."""
+    status = read_shared_memory()
+    if "error" in status:
+        raise ValueError(status["error"])
+    return status["busy"]
+
+def set_ringer_state(active, wait=ACK_TIMEOUT):
+    """Ask the device to start or stop the ringer."""
+    send_command(mailbox.RING, active, wait)
+    print(f"Ringer state set to: {'active' if active else 'inactive'}")
 
 def get_ringer_state():
     """Get the current ringer state from shared memory."""
-    try:
-        shm = SharedMemory(name="ringring", create=False)
-        state = struct.unpack("?", bytes(shm.buf[SHARED_MEMORY_SIZE - 2:SHARED_MEMORY_SIZE - 1]))[0]
-        return state
-    except FileNotFoundError:
-        raise ValueError("Shared memory not found. Ensure it is created first.")
-    finally:
-        if 'shm' in locals():
-            shm.close()
\ No newline at end of file
+    status = read_shared_memory()
+    if "error" in status:
+        raise ValueError(status["error"])
+    return status["ringing"]
+
+def dial(number, wait=ACK_TIMEOUT):
+    """Ask the device to place a call."""
+    send_command(mailbox.DIAL, number, wait)
+
+def hang_up(wait=ACK_TIMEOUT):
+    """Ask the device to end the current call."""
+    send_command(mailbox.HANGUP, None, wait)
+
+class ChangeWatcher:
+    """Tracks the newest shared memory sequence announced to this process.
+
+    One listener thread per process; any number of request threads can
+    block in wait_for_change() without touching the segment.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.sequence = None
+        self.listener = shm_notify.Listener(shm_notify.BACKEND)
+        threading.Thread(target=self.listen, daemon=True).start()
+
+    def listen(self):
+        while True:
+            sequence = self.listener.wait()
+            with self.condition:
+                self.sequence = sequence
+                self.condition.notify_all()
+
+    def wait_for_change(self, since, timeout=None):
+        """Block until a sequence other than since is announced.
+
+        Returns the new sequence, or None if the timeout expires first.
+        """
+        with self.condition:
+            if self.condition.wait_for(lambda: self.sequence is not None and self.sequence != since, timeout):
+                return self.sequence
+            return None
+
+_watcher = None
+_watcher_lock = threading.Lock()
+
+def get_change_watcher():
+    """Start the watcher on first use, so each worker process gets its own."""
+    global _watcher
+    with _watcher_lock:
+        if _watcher is None:
+            _watcher = ChangeWatcher()
+        return _watcher
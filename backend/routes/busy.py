@@ -1,5 +1,5 @@
-from flask import Blueprint, jsonify
-from ._shared import get_busy_state, set_busy_state
+from flask import Blueprint, jsonify, request
+from ._shared import get_busy_state, set_busy_state, get_wait, INVALID_WAIT
 
 # Create a Blueprint for status routes
 busy_bp = Blueprint("busy", __name__)
@@ -7,8 +7,11 @@ busy_bp = Blueprint("busy", __name__)
 @busy_bp.route("/busy/on", methods=["POST"])
 def on():
     """Turn busy on."""
+    wait = get_wait(request.args)
+    if wait is None:
+        return jsonify({"error": INVALID_WAIT}), 400
     try:
-        set_busy_state(True)
+        set_busy_state(True, wait=wait)
         return jsonify({"message": "Busy on"}), 200
     except ValueError as e:
         return jsonify({"error": str(e)}), 500
@@ -16,8 +19,11 @@ def on():
 @busy_bp.route("/busy/off", methods=["POST"])
 def off():
     """Turn busy off."""
+    wait = get_wait(request.args)
+    if wait is None:
+        return jsonify({"error": INVALID_WAIT}), 400
     try:
-        set_busy_state(False)
+        set_busy_state(False, wait=wait)
         return jsonify({"message": "Busy off"}), 200
     except ValueError as e:
         return jsonify({"error": str(e)}), 500
@@ -0,0 +1,30 @@
+from flask import Blueprint, jsonify, request
+from ._shared import dial, hang_up, get_wait, INVALID_WAIT
+
+# Create a Blueprint for call routes
+call_bp = Blueprint("call", __name__)
+
+@call_bp.route("/call/dial", methods=["POST"])
+def dial_number():
+    """Dial the number in the JSON body, e.g. {"number": "1234"}."""
+    wait = get_wait(request.args)
+    if wait is None:
+        return jsonify({"error": INVALID_WAIT}), 400
+    try:
+        number = (request.get_json(silent=True) or {}).get("number", "")
+        dial(number, wait=wait)
+        return jsonify({"message": f"Dialing {number}"}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 500
+
+@call_bp.route("/call/hangup", methods=["POST"])
+def hangup():
+    """Hang up the current call."""
+    wait = get_wait(request.args)
+    if wait is None:
+        return jsonify({"error": INVALID_WAIT}), 400
+    try:
+        hang_up(wait=wait)
+        return jsonify({"message": "Call ended"}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 500
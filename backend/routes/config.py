@@ -1,10 +1,16 @@
 import os
-import json
+import sys
 from flask import Blueprint, jsonify, request
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from common import config_store
+
 CONFIG_FILE_PATH = "../config.json"
 REQUIRED_KEYS = ["phoneNumber", "password", "sipIP"]
 
+# Default config if the file doesn't exist
+DEFAULT_CONFIG = {"phoneNumber": "", "password": "", "sipIP": ""}
+
 # Create a Blueprint for config routes
 config_bp = Blueprint("config", __name__)
 
@@ -13,21 +19,18 @@ def validate_config(config):
     return all(key in config for key in REQUIRED_KEYS)
 
 def load_config():
-    """Load the configuration from the JSON file."""
-    if os.path.exists(CONFIG_FILE_PATH):
-        with open(CONFIG_FILE_PATH, "r") as file:
-            config = json.load(file)
-            if validate_config(config):
-                return config
-            else:
-                return {"error": "Invalid configuration in file. Missing required keys."}
-    # Default config if file doesn't exist
-    return {"phoneNumber": "", "password": "", "sipIP": ""}
+    """Load the configuration, parsed only when the file changed."""
+    config = config_store.get_store(CONFIG_FILE_PATH).get()
+    if not config:
+        return dict(DEFAULT_CONFIG)
+    if validate_config(config):
+        return config
+    else:
+        return {"error": "Invalid configuration in file. Missing required keys."}
 
 def save_config(data):
-    """Save the configuration to the JSON file."""
-    with open(CONFIG_FILE_PATH, "w") as file:
-        json.dump(data, file, indent=4)
+    """Save the configuration atomically, keeping settings not in data."""
+    config_store.get_store(CONFIG_FILE_PATH).update(data)
 
 @config_bp.route("/config", methods=["GET", "POST"])
 def config():
@@ -0,0 +1,19 @@
+import json
+from flask import Blueprint, jsonify
+
+# Written every few seconds by the device's metrics thread
+METRICS_PATH = "../metrics.json"
+
+# Create a Blueprint for metrics routes
+metrics_bp = Blueprint("metrics", __name__)
+
+@metrics_bp.route("/metrics", methods=["GET"])
+def metrics():
+    """GET /api/metrics - Counters, gauges and latency histograms from the device."""
+    try:
+        with open(METRICS_PATH, "r") as file:
+            return jsonify(json.load(file))
+    except FileNotFoundError:
+        return jsonify({"error": "No metrics yet. Is the application running?"}), 500
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
@@ -1,5 +1,5 @@
-from flask import Blueprint, jsonify
-from ._shared import get_ringer_state, set_ringer_state
+from flask import Blueprint, jsonify, request
+from ._shared import get_ringer_state, set_ringer_state, get_wait, INVALID_WAIT
 
 # Create a Blueprint for status routes
 ringer_bp = Blueprint("ringer", __name__)
@@ -7,8 +7,11 @@ ringer_bp = Blueprint("ringer", __name__)
 @ringer_bp.route("/ringer/start", methods=["POST"])
 def start():
     """Start the ringer."""
+    wait = get_wait(request.args)
+    if wait is None:
+        return jsonify({"error": INVALID_WAIT}), 400
     try:
-        set_ringer_state(True)  # Set ringer to active
+        set_ringer_state(True, wait=wait)  # Set ringer to active
         return jsonify({"message": "Ringer started"}), 200
     except ValueError as e:
         return jsonify({"error": str(e)}), 500
@@ -16,8 +19,11 @@ def start():
 @ringer_bp.route("/ringer/stop", methods=["POST"])
 def stop():
     """Stop the ringer."""
+    wait = get_wait(request.args)
+    if wait is None:
+        return jsonify({"error": INVALID_WAIT}), 400
     try:
-        set_ringer_state(False)  # Set ringer to inactive
+        set_ringer_state(False, wait=wait)  # Set ringer to inactive
         return jsonify({"message": "Ringer stopped"}), 200
     except ValueError as e:
         return jsonify({"error": str(e)}), 500
@@ -1,13 +1,109 @@
-from flask import Blueprint, jsonify
-from ._shared import read_shared_memory
+import json
+import threading
+from flask import Blueprint, Response, current_app, jsonify, request
+from ._shared import read_status, get_change_watcher
+
+# Seconds between comment lines that keep idle streams (and proxies) alive
+HEARTBEAT_INTERVAL = 15
+
+# Longest a long-poll request may block, in seconds
+MAX_WAIT = 60
+
+# app.config key for the most streams one worker process keeps open. With
+# threaded workers every open stream holds a thread, so serve.py sets it
+# below the thread count to leave threads for other requests. Unset means
+# no limit.
+MAX_STREAMS = "MAX_STREAMS"
+
+# Streams over the limit get the current status and are told to reconnect
+# after this many milliseconds, so those clients fall back to polling
+FULL_RETRY = 5000
+
+_stream_slots = None
+_stream_slots_lock = threading.Lock()
+
+def stream_slots():
+    """This process's semaphore of open streams, or None without a limit."""
+    global _stream_slots
+    with _stream_slots_lock:
+        if _stream_slots is None:
+            limit = current_app.config.get(MAX_STREAMS)
+            _stream_slots = threading.BoundedSemaphore(limit) if limit else False
+        return _stream_slots or None
 
 # Create a Blueprint for status routes
 status_bp = Blueprint("status", __name__)
-    
+
+def status_version(version):
+    """Version string for a status, unique across device restarts."""
+    if version is None:
+        return "none"
+    inode, sequence = version
+    return f"{inode}-{sequence}"
+
 @status_bp.route("/status", methods=["GET"])
 def status():
-    """GET /api/status - Fetch status from shared memory."""
+    """GET /api/status - Fetch status from shared memory.
+
+    The response carries an ETag, so If-None-Match gets a 304 while nothing
+    changed. With ?since=<version>&wait=<seconds> the request blocks until
+    the status moves past that version or the wait runs out.
+    """
     try:
-        return jsonify(read_shared_memory())
+        since = request.args.get("since")
+        wait = min(request.args.get("wait", default=0, type=float), MAX_WAIT)
+
+        watcher = get_change_watcher() if since is not None and wait > 0 else None
+        seen = watcher.sequence if watcher else None
+        version, status = read_status()
+
+        if watcher and status_version(version) == since:
+            watcher.wait_for_change(seen, wait)
+            version, status = read_status()
+
+        response = jsonify(status)
+        if version is not None:
+            response.set_etag(status_version(version))
+            response.headers["X-Status-Version"] = status_version(version)
+        return response.make_conditional(request)
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": str(e)}), 500
+
+@status_bp.route("/status/stream", methods=["GET"])
+def status_stream():
+    """GET /api/status/stream - Push status changes as Server-Sent Events."""
+    last_event_id = request.headers.get("Last-Event-ID")
+    slots = stream_slots()
+
+    def events():
+        # Taken inside the generator, so the slot is only held once the
+        # stream runs and is always given back when the server closes it
+        if slots is not None and not slots.acquire(blocking=False):
+            version, status = read_status()
+            yield f"retry: {FULL_RETRY}\nid: {status_version(version)}\ndata: {json.dumps(status)}\n\n"
+            return
+
+        try:
+            # Every client waits on the one per-process watcher and status is
+            # decoded once per change, however many clients are connected
+            watcher = get_change_watcher()
+            sent = last_event_id
+
+            while True:
+                seen = watcher.sequence
+                version, status = read_status()
+                current = status_version(version)
+                if current != sent:
+                    yield f"id: {current}\ndata: {json.dumps(status)}\n\n"
+                    sent = current
+
+                if watcher.wait_for_change(seen, HEARTBEAT_INTERVAL) is None:
+                    yield ": heartbeat\n\n"
+        finally:
+            if slots is not None:
+                slots.release()
+
+    return Response(events(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
@@ -0,0 +1,104 @@
+"""Production entry point for the backend.
+
+    python serve.py --workers 2 --threads 8
+
+main.py runs Flask's development server with the debugger and reloader,
+which is only meant for working on the backend. This serves the same app
+with gunicorn: several worker processes, each with a pool of threads (or
+gevent greenlets with --worker-class gevent). Every worker maps the status
+segment and listens for change notifications on its own, so SSE streams and
+long-polls work whichever worker a client lands on.
+
+Without gunicorn installed it falls back to Werkzeug's threaded server with
+the debugger and reloader off.
+
+With gthread workers every open SSE stream holds a thread, so a worker
+keeps at most --max-streams open (threads - 2 by default) and the server as
+a whole workers x max-streams. A stream over the limit gets the current
+status and a "retry:" of 5 s, so that browser falls back to polling. A
+worker only notices a closed stream on its next write, so the slot is held
+for up to one heartbeat (15 s) after the client goes away. gevent workers
+have no limit.
+
+Workers log to stderr; gunicorn keeps their lines whole, which a shared
+rotating file would not.
+
+tests/http_benchmark.py compares the two modes. With device/shared_memory.py
+running, start one server at a time on the hardware being measured and
+run the same load against each:
+
+    python main.py
+    python serve.py --workers 2 --threads 8
+
+    python ../tests/http_benchmark.py --port 8080 --clients 16 --streams 8 --duration 15
+
+Record the numbers along with the board, the Python, Flask and gunicorn
+versions, and the exact command. Runs made on one machine don't carry
+over to the Pi. With --streams at or above workers x max-streams, the
+"streams turned away" count shows the cap at work.
+"""
+import argparse
+from main import create_app
+from routes.status import MAX_STREAMS
+
+DEFAULT_HOST = "0.0.0.0"
+DEFAULT_PORT = 8080
+DEFAULT_WORKERS = 2
+DEFAULT_THREADS = 8
+
+# Threads per worker kept free of SSE streams for ordinary requests
+RESERVED_THREADS = 2
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve the ringring backend")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="worker processes")
+    parser.add_argument("--threads", type=int, default=DEFAULT_THREADS, help="threads per worker")
+    parser.add_argument("--worker-class", default="gthread", choices=["gthread", "gevent"])
+    parser.add_argument("--max-streams", type=int, help=f"open SSE streams per worker, default threads - {RESERVED_THREADS} for gthread, unlimited for gevent")
+    return parser.parse_args()
+
+def max_streams(args):
+    if args.max_streams is not None:
+        return args.max_streams
+    if args.worker_class == "gevent":
+        # Greenlets are cheap, a stream doesn't tie up a thread
+        return None
+    return max(1, args.threads - RESERVED_THREADS)
+
+def serve_gunicorn(app, args):
+    from gunicorn.app.base import BaseApplication
+
+    class Server(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"{args.host}:{args.port}")
+            self.cfg.set("workers", args.workers)
+            self.cfg.set("threads", args.threads)
+            self.cfg.set("worker_class", args.worker_class)
+            # SSE streams stay open, the heartbeat keeps them alive
+            self.cfg.set("keepalive", 75)
+
+        def load(self):
+            return app
+
+    Server().run()
+
+def serve_werkzeug(app, args):
+    from werkzeug.serving import run_simple
+
+    print("gunicorn is not installed, serving with Werkzeug's threaded server")
+    run_simple(args.host, args.port, app, threaded=True, use_reloader=False, use_debugger=False)
+
+if __name__ == "__main__":
+    args = parse_args()
+    # Workers share stderr, gunicorn keeps their lines whole
+    app = create_app(log_file=None)
+    app.config[MAX_STREAMS] = max_streams(args)
+
+    try:
+        import gunicorn
+    except ImportError:
+        serve_werkzeug(app, args)
+    else:
+        serve_gunicorn(app, args)
@@ -0,0 +1,266 @@
+"""Cached, atomically written JSON config files.
+
+The backend, the SIP thread, the dialer and the Bluetooth setup service all
+keep settings in small JSON files. They go through one ConfigStore per file:
+
+    store = config_store.get_store("../config.json")
+    config = store.get()
+    store.update({"sipIP": "10.0.0.2"})
+    store.subscribe(lambda config: ...)
+
+get() parses the file only when its inode, size or mtime changed. update()
+merges into the file and replaces it with a fully written and fsynced temp
+file, so a crash leaves either the old or the new config, never a truncated
+one. Updates that arrive while another is being written are committed
+together in the next write. Subscribers are called with the new config
+after every change, whether it was written by this process or another one,
+which is noticed with inotify (or by polling stat where inotify is missing).
+"""
+import os
+import json
+import ctypes
+import select
+import struct
+import logging
+import tempfile
+import time
+import threading
+
+# How often to check the file when inotify is not available, in seconds
+WATCH_INTERVAL = 1
+
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+INOTIFY_EVENT = struct.Struct("iIII")
+
+class _Batch:
+    """Changes committed together by one write, and how the write went."""
+
+    def __init__(self):
+        self.changes = {}
+        self.done = False
+        self.config = None
+        self.error = None
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def atomic_write(path, config):
+    """Replace path with config as JSON, durably."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as file:
+            json.dump(config, file, indent=4)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+    # Make the rename itself durable
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+class Inotify:
+    """Minimal inotify binding through ctypes, watching one directory."""
+
+    def __init__(self, directory):
+        libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, f"inotify_add_watch failed for {directory}")
+
+    def wait(self, timeout=None):
+        """Block until something happens in the directory and return the file names."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+
+        names = []
+        while True:
+            try:
+                data = os.read(self.fd, 4096)
+            except BlockingIOError:
+                return names
+
+            offset = 0
+            while offset < len(data):
+                _, _, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                names.append(os.fsdecode(data[offset:offset + length].rstrip(b"\0")))
+                offset += length
+
+    def close(self):
+        os.close(self.fd)
+
+class ConfigStore:
+    def __init__(self, path, defaults=None):
+        self.path = path
+        self.defaults = dict(defaults or {})
+
+        self.lock = threading.Lock()
+        self.config = None
+        self.signature = None
+
+        # Group commit: updates land in the pending batch and whoever holds
+        # write_lock next writes all of them at once, then hands the result,
+        # success or failure, to everyone in the batch
+        self.write_lock = threading.Lock()
+        self.pending = _Batch()
+
+        self.subscribers = []
+        self.published = None
+        self.watcher = None
+
+    def _signature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def _load(self):
+        """Return the cached config, re-reading the file if it changed. Holds lock."""
+        signature = self._signature()
+        if self.config is None or signature != self.signature:
+            if signature is None:
+                config = {}
+            else:
+                with open(self.path, "r") as file:
+                    config = json.load(file)
+
+            self.config = {**self.defaults, **config}
+            self.signature = signature
+        return self.config
+
+    def get(self):
+        """Return a copy of the config, raising ValueError if the file is not valid JSON."""
+        with self.lock:
+            return dict(self._load())
+
+    def update(self, changes):
+        """Merge changes into the file, returning once they are on disk.
+
+        Raises the write's error if the batch the changes were in failed.
+        """
+        with self.lock:
+            batch = self.pending
+            batch.changes.update(changes)
+
+        with self.write_lock:
+            if batch.done:
+                # Written, or failed, by a write that started after we queued
+                if batch.error is not None:
+                    raise batch.error
+                return dict(batch.config)
+
+            with self.lock:
+                self.pending = _Batch()
+                try:
+                    config = dict(self._load())
+                except ValueError:
+                    logging.warning(f"{self.path} is not valid JSON, starting fresh")
+                    config = dict(self.defaults)
+                config.update(batch.changes)
+
+            try:
+                atomic_write(self.path, config)
+            except Exception as e:
+                batch.error = e
+                raise
+            finally:
+                batch.done = True
+
+            with self.lock:
+                self.config = config
+                self.signature = self._signature()
+            batch.config = config
+
+        self._publish(config)
+        return dict(config)
+
+    def subscribe(self, callback):
+        """Call callback(config) after every change to the file."""
+        with self.lock:
+            self.subscribers.append(callback)
+            if self.published is None:
+                try:
+                    self.published = dict(self._load())
+                except ValueError:
+                    self.published = {}
+            if self.watcher is None:
+                self.watcher = threading.Thread(target=self._watch, daemon=True)
+                self.watcher.start()
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            if callback in self.subscribers:
+                self.subscribers.remove(callback)
+
+    def _publish(self, config):
+        with self.lock:
+            if config == self.published:
+                return
+            self.published = dict(config)
+            subscribers = list(self.subscribers)
+
+        for callback in subscribers:
+            try:
+                callback(dict(config))
+            except Exception as e:
+                logging.error(f"Config subscriber for {self.path} failed: {e}")
+
+    def _changed(self):
+        try:
+            config = self.get()
+        except ValueError:
+            # Caught mid-write by a writer that does not replace atomically
+            return
+        self._publish(config)
+
+    def _watch(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        name = os.path.basename(self.path)
+
+        try:
+            inotify = Inotify(directory)
+        except (OSError, AttributeError) as e:
+            logging.debug(f"inotify unavailable ({e}), polling {self.path}")
+            while True:
+                time.sleep(WATCH_INTERVAL)
+                self._changed()
+
+        try:
+            while True:
+                if name in inotify.wait():
+                    self._changed()
+        finally:
+            inotify.close()
+
+def get_store(path, defaults=None):
+    """Return the process-wide store for path."""
+    key = os.path.abspath(path)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = ConfigStore(path, defaults)
+            _stores[key] = store
+        return store
@@ -0,0 +1,112 @@
+"""Command mailbox from the backend to the device.
+
+The device binds one Unix datagram socket and consumes commands from it in
+arrival order on a single thread. Each backend request sends a typed
+command from its own bound socket, so the device can acknowledge it once
+the command has taken effect, and the request can wait for that ack with a
+timeout.
+"""
+import os
+import json
+import select
+import socket
+import itertools
+import threading
+
+MAILBOX_DIR = "/tmp/ringring"
+MAILBOX_PATH = os.path.join(MAILBOX_DIR, "mailbox.sock")
+
+# Command types
+BUSY = "busy"
+RING = "ring"
+DIAL = "dial"
+HANGUP = "hangup"
+
+COMMANDS = (BUSY, RING, DIAL, HANGUP)
+
+MAX_MESSAGE = 4096
+
+_ids = itertools.count(1)
+
+class MailboxError(Exception):
+    pass
+
+class Mailbox:
+    """The device end: receives commands and acknowledges them."""
+
+    def __init__(self, path=MAILBOX_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            os.unlink(path)
+
+        self.path = path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(path)
+
+    def receive(self):
+        """Block for the next command, returning (command, reply address)."""
+        while True:
+            data, address = self.sock.recvfrom(MAX_MESSAGE)
+            try:
+                command = json.loads(data)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(command, dict) and command.get("type") in COMMANDS:
+                return command, address
+
+    def acknowledge(self, command, address, error=None):
+        if not address:
+            return
+        reply = {"id": command.get("id"), "ok": error is None}
+        if error is not None:
+            reply["error"] = error
+        try:
+            self.sock.sendto(json.dumps(reply).encode(), address)
+        except OSError:
+            # The sender gave up waiting and went away
+            pass
+
+    def close(self):
+        self.sock.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+def send(command_type, value=None, wait=None, path=MAILBOX_PATH):
+    """Send a command to the device.
+
+    With wait set, block up to that many seconds for the command to take
+    effect and raise MailboxError if it fails or no ack arrives in time. The
+    wait goes with the command, so the device knows how long to watch for
+    the effect before acknowledging.
+    """
+    command = {"id": f"{os.getpid()}-{next(_ids)}", "type": command_type, "value": value, "wait": wait or None}
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    reply_path = os.path.join(MAILBOX_DIR, f"reply-{command['id']}-{threading.get_ident()}.sock")
+    try:
+        if wait:
+            sock.bind(reply_path)
+
+        try:
+            sock.sendto(json.dumps(command).encode(), path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            raise MailboxError("Device is not running")
+
+        if not wait:
+            return None
+
+        while True:
+            readable, _, _ = select.select([sock], [], [], wait)
+            if not readable:
+                raise MailboxError(f"Device did not apply {command_type} within {wait} seconds")
+
+            reply = json.loads(sock.recv(MAX_MESSAGE))
+            if reply.get("id") != command["id"]:
+                continue
+            if not reply.get("ok"):
+                raise MailboxError(reply.get("error", f"Device rejected {command_type}"))
+            return reply
+    finally:
+        sock.close()
+        if wait and os.path.exists(reply_path):
+            os.unlink(reply_path)
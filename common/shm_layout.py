@@ -0,0 +1,168 @@
+"""Binary layout of the "ringring" shared-memory status segment.
+
+The device writes the segment and the backend reads it. Both sides go
+through this module so a field is added in one place: append it to FIELDS
+and bump SCHEMA_VERSION.
+
+The segment starts with a fixed header followed by the packed fields:
+
+    magic           4s  b"RRNG"
+    schema version  H   SCHEMA_VERSION
+    reserved        H
+    sequence        Q   seqlock counter, odd while a write is in progress
+    updated         d   time.monotonic() of the last write
+
+The writer bumps the sequence to odd, writes, then bumps it to even.
+Readers copy the fields and retry if the sequence was odd or moved while
+they copied, so neither side ever takes a lock. The seqlock only works with
+one writer, so writes go through a Writer, which holds an exclusive flock
+for as long as the process lives; the backend sends its changes to the
+device through the command mailbox instead.
+"""
+import os
+import time
+import fcntl
+import struct
+from collections import namedtuple
+
+SHARED_MEMORY_NAME = "ringring"
+
+MAGIC = b"RRNG"
+SCHEMA_VERSION = 2
+
+HEADER = struct.Struct("<4sHHQd")
+SEQUENCE = struct.Struct("<Q")
+SEQUENCE_OFFSET = 8
+UPDATED = struct.Struct("<d")
+UPDATED_OFFSET = 16
+
+READ_RETRIES = 100
+
+# Held by the one process allowed to write the segment
+WRITER_LOCK_PATH = "/tmp/ringring/writer.lock"
+
+Field = namedtuple("Field", ["name", "format", "default"])
+
+FIELDS = (
+    Field("registeredWithSIP", "?", False),
+    Field("onTheHook", "?", False),
+    Field("callActive", "?", False),
+    Field("ringing", "?", False),
+    Field("busy", "?", False),
+    Field("callPeer", "64s", ""),
+    Field("callStart", "d", 0.0),
+    Field("registrationExpiry", "d", 0.0),
+    Field("callsIn", "I", 0),
+    Field("callsOut", "I", 0),
+    Field("lastDialed", "32s", ""),
+    Field("callMos", "d", 0.0),
+    Field("callJitter", "d", 0.0),
+    Field("callLoss", "d", 0.0),
+    Field("callRtt", "d", 0.0),
+)
+
+BODY = struct.Struct("<" + "".join(field.format for field in FIELDS))
+SIZE = HEADER.size + BODY.size
+
+def _offsets():
+    offsets = {}
+    offset = HEADER.size
+    for field in FIELDS:
+        offsets[field.name] = (offset, struct.Struct("<" + field.format), field)
+        offset += struct.calcsize("<" + field.format)
+    return offsets
+
+OFFSETS = _offsets()
+
+class TornReadError(Exception):
+    pass
+
+def _encode(field, value):
+    if field.format.endswith("s"):
+        return (value or "").encode("utf-8")
+    return value
+
+def _decode(field, value):
+    if field.format.endswith("s"):
+        return value.rstrip(b"\0").decode("utf-8", errors="replace")
+    return value
+
+def defaults():
+    return {field.name: field.default for field in FIELDS}
+
+def _initialize(buf, values=None):
+    """Write a fresh header and every field."""
+    body = defaults()
+    body.update(values or {})
+    HEADER.pack_into(buf, 0, MAGIC, SCHEMA_VERSION, 0, 0, time.monotonic())
+    BODY.pack_into(buf, HEADER.size, *(_encode(field, body[field.name]) for field in FIELDS))
+
+def check(buf):
+    magic, schema, _, _, _ = HEADER.unpack_from(buf, 0)
+    if magic != MAGIC:
+        raise ValueError("Shared memory is not a ringring status segment")
+    if schema != SCHEMA_VERSION:
+        raise ValueError(f"Shared memory schema {schema} does not match {SCHEMA_VERSION}")
+
+def read_sequence(buf):
+    return SEQUENCE.unpack_from(buf, SEQUENCE_OFFSET)[0]
+
+def read(buf, retries=READ_RETRIES):
+    """Return (sequence, values) from a consistent copy of the fields."""
+    check(buf)
+    for _ in range(retries):
+        before = read_sequence(buf)
+        if before % 2 == 0:
+            body = bytes(buf[HEADER.size:SIZE])
+            if read_sequence(buf) == before:
+                values = BODY.unpack(body)
+                return before, {field.name: _decode(field, value) for field, value in zip(FIELDS, values)}
+
+        # A write is in progress, let the writer finish
+        time.sleep(0)
+
+    raise TornReadError("Shared memory kept changing while being read")
+
+def _write(buf, values):
+    """Write only the given fields, bracketed by the seqlock."""
+    # Pack everything first, so a bad name or value raises before the
+    # sequence goes odd rather than leaving readers locked out
+    packed = []
+    for name, value in values.items():
+        offset, packer, field = OFFSETS[name]
+        packed.append((offset, packer.pack(_encode(field, value))))
+
+    sequence = read_sequence(buf)
+    SEQUENCE.pack_into(buf, SEQUENCE_OFFSET, sequence + 1)
+
+    for offset, data in packed:
+        buf[offset:offset + len(data)] = data
+
+    UPDATED.pack_into(buf, UPDATED_OFFSET, time.monotonic())
+    SEQUENCE.pack_into(buf, SEQUENCE_OFFSET, sequence + 2)
+    return sequence + 2
+
+class Writer:
+    """The single writer of the segment.
+
+    Raises BlockingIOError if another process already holds the writer
+    lock. The lock is released when the process exits or close() is called.
+    """
+
+    def __init__(self, lock_path=WRITER_LOCK_PATH):
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        self.lock_file = open(lock_path, "a")
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.lock_file.close()
+            raise
+
+    def initialize(self, buf, values=None):
+        _initialize(buf, values)
+
+    def write(self, buf, values):
+        return _write(buf, values)
+
+    def close(self):
+        self.lock_file.close()
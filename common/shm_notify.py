@@ -0,0 +1,83 @@
+"""Change notifications for the "ringring" shared-memory segment.
+
+Every process that wants to hear about changes binds a Unix datagram socket
+named after its role and pid. Writers send the new seqlock sequence number
+to every socket of a role right after writing, so readers can block on
+their socket instead of polling the segment.
+"""
+import os
+import glob
+import select
+import socket
+import struct
+import threading
+
+NOTIFY_DIR = "/tmp/ringring"
+
+# Roles
+BACKEND = "backend"
+
+MESSAGE = struct.Struct("<Q")
+
+_sender = None
+_sender_lock = threading.Lock()
+
+class Listener:
+    """A bound socket receiving the sequence numbers sent to one role."""
+
+    def __init__(self, role):
+        os.makedirs(NOTIFY_DIR, exist_ok=True)
+        self.path = os.path.join(NOTIFY_DIR, f"{role}-{os.getpid()}.sock")
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.path)
+        self.sock.setblocking(False)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def wait(self, timeout=None):
+        """Block until notified and return the newest sequence, or None on timeout."""
+        readable, _, _ = select.select([self.sock], [], [], timeout)
+        if not readable:
+            return None
+
+        # Several writes may have queued up, only the newest matters
+        sequence = None
+        while True:
+            try:
+                data = self.sock.recv(MESSAGE.size)
+            except BlockingIOError:
+                return sequence
+            if len(data) == MESSAGE.size:
+                sequence = MESSAGE.unpack(data)[0]
+
+    def close(self):
+        self.sock.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+def notify(role, sequence):
+    """Send sequence to every listener of role, dropping stale sockets."""
+    global _sender
+
+    with _sender_lock:
+        if _sender is None:
+            _sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            _sender.setblocking(False)
+
+        message = MESSAGE.pack(sequence)
+        for path in glob.glob(os.path.join(NOTIFY_DIR, f"{role}-*.sock")):
+            try:
+                _sender.sendto(message, path)
+            except BlockingIOError:
+                # The listener already has wake-ups queued
+                pass
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Nobody is bound any more, the process went away
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,95 @@
+import time
+import threading
+from collections import OrderedDict
+import metrics
+
+# Status codes for turned away calls
+ACCEPT = None
+BUSY_HERE = 486
+DECLINE = 603
+
+# Incoming calls that may ring at once
+MAX_PENDING_CALLS = 2
+
+# INVITEs a single source may send: a sustained rate per second and a burst
+SOURCE_RATE = 0.5
+SOURCE_BURST = 3
+
+# Sources remembered by the rate limiter, least recently seen forgotten first
+MAX_SOURCES = 256
+
+class TokenBucket:
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+class AdmissionPolicy:
+    """Decides, before anything else happens, whether an INVITE may ring.
+
+    check() is cheap and allocates nothing per call beyond a bucket per
+    source, so a flood of INVITEs is turned away without starting the
+    ringer or taking up a pending slot.
+    """
+
+    def __init__(self, max_pending=MAX_PENDING_CALLS, rate=SOURCE_RATE, burst=SOURCE_BURST, max_sources=MAX_SOURCES):
+        self.max_pending = max_pending
+        self.rate = rate
+        self.burst = burst
+        self.max_sources = max_sources
+
+        self.lock = threading.Lock()
+        self.buckets = OrderedDict()
+
+        self.admitted = metrics.counter("admission.admitted")
+        self.rejected_rate = metrics.counter("admission.rejected_rate")
+        self.rejected_busy = metrics.counter("admission.rejected_busy")
+        self.rejected_full = metrics.counter("admission.rejected_full")
+
+    def _allow(self, source, now):
+        with self.lock:
+            bucket = self.buckets.get(source)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, self.burst, now)
+                self.buckets[source] = bucket
+                if len(self.buckets) > self.max_sources:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(source)
+            return bucket.take(now)
+
+    def check(self, source, busy, in_call, pending, now=None):
+        """Return ACCEPT, or the status code to reject the INVITE with."""
+        now = time.monotonic() if now is None else now
+
+        # Count every INVITE against its source, so a scanner stays
+        # throttled whatever state the phone is in
+        if not self._allow(source, now):
+            self.rejected_rate.inc()
+            return DECLINE
+
+        if busy or in_call:
+            self.rejected_busy.inc()
+            return BUSY_HERE
+
+        if pending >= self.max_pending:
+            self.rejected_full.inc()
+            return BUSY_HERE
+
+        self.admitted.inc()
+        return ACCEPT
+
+def source_host(address):
+    """Host part of an "ip:port" or "[ipv6]:port" source address."""
+    if address.startswith("["):
+        return address[1:].split("]", 1)[0]
+    return address.rsplit(":", 1)[0] if address.count(":") == 1 else address
@@ -0,0 +1,135 @@
+import os
+import re
+import sys
+import logging
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import config_store
+
+# Config key holding a regular expression matched against device names and
+# drivers, e.g. "USB Audio" or "hw:CARD=Device"
+AUDIO_DEVICE = "audioDevice"
+DEFAULT_PATTERN = "USB"
+
+# Where the last resolved device is kept between restarts
+CACHE_PATH = "../audio_device.json"
+
+# Sound device nodes appear and disappear here on hotplug
+SOUND_DIR = "/dev/snd"
+
+# Quiet time after the last hotplug event before re-scanning, in seconds
+HOTPLUG_SETTLE = 1
+
+def _matches(info, pattern):
+    return bool(re.search(pattern, info.name, re.IGNORECASE) or re.search(pattern, info.driver, re.IGNORECASE))
+
+def _usable(info):
+    return info.inputCount > 0 and info.outputCount > 0
+
+def _identity(info):
+    """What the cache records about a device, to tell it apart from another at the same index."""
+    return {
+        "name": info.name,
+        "driver": info.driver,
+        "inputCount": info.inputCount,
+        "outputCount": info.outputCount,
+        "defaultSamplesPerSec": info.defaultSamplesPerSec,
+        "caps": info.caps
+    }
+
+def _cached(adm, pattern):
+    """Index from the cache if it still names the same device, else None."""
+    try:
+        cache = config_store.get_store(CACHE_PATH).get()
+    except ValueError:
+        return None
+
+    index = cache.get("index")
+    if cache.get("pattern") != pattern or index is None or index >= adm.getDevCount():
+        return None
+
+    info = adm.getDevInfo(index)
+    if cache.get("device") != _identity(info) or not _usable(info) or not _matches(info, pattern):
+        return None
+    return index
+
+def _remember(pattern, index, info):
+    """Cache the resolved device, writing only when it changed."""
+    store = config_store.get_store(CACHE_PATH)
+    entry = {"pattern": pattern, "index": index, "device": _identity(info)}
+    try:
+        cache = store.get()
+    except ValueError:
+        cache = {}
+    if any(cache.get(key) != value for key, value in entry.items()):
+        store.update(entry)
+
+def scan(adm, pattern, refresh=True):
+    """Enumerate devices and return the index of the first usable match."""
+    if refresh:
+        adm.refreshDevs()
+
+    for index in range(adm.getDevCount()):
+        info = adm.getDevInfo(index)
+        if _usable(info) and _matches(info, pattern):
+            _remember(pattern, index, info)
+            return index
+
+    raise LookupError(f"No audio device with capture and playback matches {pattern!r}")
+
+def resolve(adm, pattern=DEFAULT_PATTERN):
+    """Index of the device for pattern, checking the cache before enumerating."""
+    index = _cached(adm, pattern)
+    if index is not None:
+        logging.debug(f"Audio device {index} from cache")
+        return index
+
+    # libInit just enumerated, so the first scan doesn't need a refresh
+    index = scan(adm, pattern, refresh=False)
+    logging.debug(f"Audio device {index} found by scanning for {pattern!r}")
+    return index
+
+def bind(adm, pattern=DEFAULT_PATTERN, rescan=False):
+    """Point capture and playback at the device for pattern. Returns its index.
+
+    With rescan the device list is refreshed first, for hotplug. Falls back
+    to the system default devices if nothing matches.
+    """
+    try:
+        index = scan(adm, pattern) if rescan else resolve(adm, pattern)
+    except LookupError as e:
+        print(f"{e}, using the default audio devices")
+        adm.setCaptureDev(-1)
+        adm.setPlaybackDev(-2)
+        return None
+
+    if rescan and index in (adm.getCaptureDev(), adm.getPlaybackDev()):
+        # After a refresh the same index may be a different or replugged
+        # device and the open stream is stale, but pjsua ignores a switch to
+        # the device it already has, so close it first
+        adm.setNullDev()
+    if adm.getCaptureDev() != index:
+        adm.setCaptureDev(index)
+    if adm.getPlaybackDev() != index:
+        adm.setPlaybackDev(index)
+    print(f"Using audio device {index}: {adm.getDevInfo(index).name}")
+    return index
+
+def watch_hotplug(callback):
+    """Call callback() from a daemon thread once sound devices settle after a change."""
+    def watch():
+        try:
+            inotify = config_store.Inotify(SOUND_DIR)
+        except (OSError, AttributeError) as e:
+            logging.debug(f"No audio hotplug detection: {e}")
+            return
+
+        while True:
+            inotify.wait()
+            # A card brings several nodes, wait for them all
+            while inotify.wait(HOTPLUG_SETTLE):
+                pass
+            callback()
+
+    threading.Thread(target=watch, daemon=True).start()
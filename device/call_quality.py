@@ -0,0 +1,157 @@
+import time
+import logging
+from collections import deque, namedtuple
+import metrics
+
+# Seconds between samples of an active call
+SAMPLE_INTERVAL = 5
+
+# Samples kept per call, one minute at the default interval
+WINDOW = 12
+
+# Codec and packetization delay added to the network delay, in milliseconds,
+# for the E-model's mouth-to-ear estimate
+CODEC_DELAY = 10
+
+Sample = namedtuple("Sample", ["timestamp", "jitter", "loss", "rtt", "jb_delay", "jb_discards", "mos"])
+
+def mos(delay, jitter, loss):
+    """MOS estimate from the simplified ITU-T G.107 E-model.
+
+    delay and jitter in milliseconds (delay one way), loss in percent.
+    """
+    effective = delay + 2 * jitter + CODEC_DELAY
+    if effective < 160:
+        r = 93.2 - effective / 40
+    else:
+        r = 93.2 - (effective - 120) / 10
+    r -= 2.5 * loss
+
+    if r <= 0:
+        return 1.0
+    return max(1.0, min(4.5, 1 + 0.035 * r + 0.000007 * r * (r - 60) * (100 - r)))
+
+class CallQuality:
+    """Rolling window of samples for one call."""
+
+    def __init__(self, window=WINDOW):
+        self.samples = deque(maxlen=window)
+        self.last_packets = 0
+        self.last_lost = 0
+        self.last_discards = 0
+
+    def add(self, now, jitter, rtt, packets, lost, jb_delay, discards):
+        """Add a sample from cumulative stream counters. Returns it."""
+        if packets < self.last_packets or lost < self.last_lost:
+            # The call id was reused by a new call, its counters start over
+            self.last_packets = self.last_lost = self.last_discards = 0
+
+        # Loss over this interval only, not since the call started
+        received = packets - self.last_packets
+        missing = lost - self.last_lost
+        loss = 100 * missing / (received + missing) if received + missing > 0 else 0.0
+        new_discards = discards - self.last_discards
+        self.last_packets, self.last_lost, self.last_discards = packets, lost, discards
+
+        sample = Sample(now, jitter, loss, rtt, jb_delay, new_discards, mos(rtt / 2 + jb_delay, jitter, loss))
+        self.samples.append(sample)
+        return sample
+
+    def summary(self):
+        """Averages over the window, and the worst MOS in it."""
+        if not self.samples:
+            return None
+        count = len(self.samples)
+        return {
+            "jitter": sum(sample.jitter for sample in self.samples) / count,
+            "loss": sum(sample.loss for sample in self.samples) / count,
+            "rtt": sum(sample.rtt for sample in self.samples) / count,
+            "mos": sum(sample.mos for sample in self.samples) / count,
+            "worstMos": min(sample.mos for sample in self.samples),
+        }
+
+def stream_stats(call, media_index):
+    """Cumulative counters for one audio stream of a pjsua2 call."""
+    stat = call.getStreamStat(media_index)
+    rx = stat.rtcp.rxStat
+    return {
+        "jitter": rx.jitterUsec.mean / 1000,
+        "rtt": stat.rtcp.rttUsec.last / 1000,
+        "packets": rx.pkt,
+        "lost": rx.loss,
+        "jb_delay": stat.jbuf.avgDelayMsec,
+        "discards": stat.jbuf.discard,
+    }
+
+class QualitySampler:
+    """Samples stream stats of active calls every SAMPLE_INTERVAL seconds.
+
+    pjsua2 has to be called from the SIP thread, so the dispatch loop waits
+    until deadline() and then calls sample() with the calls that are up.
+    The newest sample of the current call is published to GlobalState, and
+    from there to the status segment and the metrics.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL, window=WINDOW):
+        self.interval = interval
+        self.window = window
+        self.calls = {}
+        self.next_sample = None
+
+        self.mos = metrics.gauge("call.mos")
+        self.jitter = metrics.gauge("call.jitter_ms")
+        self.loss = metrics.gauge("call.loss_percent")
+        self.rtt = metrics.gauge("call.rtt_ms")
+        self.discards = metrics.counter("call.jb_discards")
+        self.mos_history = metrics.histogram("call.mos_average", buckets=(1, 2, 2.5, 3, 3.5, 4, 4.5))
+
+    def deadline(self):
+        return self.next_sample
+
+    def start(self, now=None):
+        """Begin sampling if it isn't already running."""
+        if self.next_sample is None:
+            self.next_sample = (time.monotonic() if now is None else now) + self.interval
+
+    def sample(self, streams, now=None):
+        """Take a sample of each call, given as {call id: (call, audio media index)}.
+
+        Returns the newest sample of the first call, or None when no call is up.
+        """
+        now = time.monotonic() if now is None else now
+
+        # Calls that ended: log how they went and forget them
+        for call_id in list(self.calls):
+            if call_id not in streams:
+                summary = self.calls.pop(call_id).summary()
+                if summary:
+                    self.mos_history.observe(summary["mos"])
+                    logging.debug(f"Call {call_id} quality: {summary}")
+
+        if not streams:
+            self.next_sample = None
+            for gauge in (self.mos, self.jitter, self.loss, self.rtt):
+                gauge.set(0)
+            return None
+
+        self.next_sample = now + self.interval
+        newest = None
+        for call_id, (call, media_index) in streams.items():
+            try:
+                stats = stream_stats(call, media_index)
+            except Exception as e:
+                logging.debug(f"No stream stats for call {call_id}: {e}")
+                continue
+
+            quality = self.calls.setdefault(call_id, CallQuality(self.window))
+            sample = quality.add(now, **stats)
+            self.discards.inc(sample.jb_discards)
+            if newest is None:
+                newest = sample
+
+        if newest is not None:
+            self.mos.set(round(newest.mos, 2))
+            self.jitter.set(round(newest.jitter, 1))
+            self.loss.set(round(newest.loss, 1))
+            self.rtt.set(round(newest.rtt, 1))
+        return newest
@@ -0,0 +1,109 @@
+import logging
+import threading
+import weakref
+import metrics
+
+# Call states
+RINGING = "ringing"            # incoming, waiting for the handset
+EARLY = "early"                # outgoing, not answered yet
+CONFIRMED = "confirmed"
+HELD = "held"
+DISCONNECTED = "disconnected"
+
+TRANSITIONS = {
+    RINGING: {CONFIRMED, DISCONNECTED},
+    EARLY: {CONFIRMED, DISCONNECTED},
+    CONFIRMED: {HELD, DISCONNECTED},
+    HELD: {CONFIRMED, DISCONNECTED},
+    DISCONNECTED: set(),
+}
+
+# States in which going on-hook ends the call
+IN_PROGRESS = (EARLY, CONFIRMED, HELD)
+
+class Entry:
+    def __init__(self, call_id, call, state):
+        self.call_id = call_id
+        self.call = call
+        self.state = state
+
+class CallRegistry:
+    """Every live pjsua2 call, keyed by call id, with its state.
+
+    pjsua2 callbacks move calls between states. Disconnected calls stay
+    listed until release() drops them from the SIP thread, since freeing a
+    pjsua2 call from inside its own callback is not allowed. Each call
+    object gets a finalizer, so released calls that are never freed show
+    up in the calls.leaked_objects gauge.
+    """
+
+    def __init__(self):
+        # Reentrant because dropping a call can run its finalizer right away
+        self.lock = threading.RLock()
+        self.entries = {}
+        self.retired = set()
+
+        self.size = metrics.gauge("calls.registry_size")
+        self.leaked = metrics.gauge("calls.leaked_objects")
+        self.released = metrics.counter("calls.released")
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, call_id, call, state):
+        with self.lock:
+            previous = self.entries.get(call_id)
+            if previous is not None:
+                # pjsua2 reuses the id of a call that ended but was not released
+                self.retired.add(id(previous.call))
+            self.entries[call_id] = Entry(call_id, call, state)
+            self.size.set(len(self.entries))
+            self.leaked.set(len(self.retired))
+        weakref.finalize(call, self._finalized, id(call))
+
+    def get(self, call_id):
+        entry = self.entries.get(call_id)
+        return entry.call if entry else None
+
+    def state(self, call_id):
+        entry = self.entries.get(call_id)
+        return entry.state if entry else None
+
+    def transition(self, call_id, state):
+        """Move a call to state, returning False for an unknown call or an invalid move."""
+        with self.lock:
+            entry = self.entries.get(call_id)
+            if entry is None:
+                return False
+            if state == entry.state:
+                return True
+            if state not in TRANSITIONS[entry.state]:
+                logging.warning(f"Call {call_id}: ignoring {entry.state} -> {state}")
+                return False
+
+            logging.debug(f"Call {call_id}: {entry.state} -> {state}")
+            entry.state = state
+            return True
+
+    def in_state(self, *states):
+        """Calls currently in any of states."""
+        with self.lock:
+            return [entry.call for entry in self.entries.values() if entry.state in states]
+
+    def release(self):
+        """Drop disconnected calls so pjsua2 can free them. Returns how many."""
+        with self.lock:
+            finished = [entry for entry in self.entries.values() if entry.state == DISCONNECTED]
+            for entry in finished:
+                del self.entries[entry.call_id]
+                self.retired.add(id(entry.call))
+            self.size.set(len(self.entries))
+            self.leaked.set(len(self.retired))
+
+        self.released.inc(len(finished))
+        return len(finished)
+
+    def _finalized(self, object_id):
+        with self.lock:
+            self.retired.discard(object_id)
+            self.leaked.set(len(self.retired))
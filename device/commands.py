@@ -0,0 +1,107 @@
+import os
+import sys
+import logging
+import threading
+from global_state import GlobalState, State, Command, Tone
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import mailbox
+
+# The device gives up watching for a command's effect this long before
+# the sender stops waiting, so its error ack still arrives in time
+ACK_MARGIN = 0.25
+
+def effect_timeout(wait):
+    """How long to watch for a command's effect, strictly less than the sender's wait."""
+    return wait - ACK_MARGIN if wait > 2 * ACK_MARGIN else wait / 2
+
+def apply(command):
+    """Apply one backend command to the global state.
+
+    Returns (error, effect). error is a message for the ack, or None. DIAL
+    and HANGUP are carried out by the SIP thread, so for those effect is a
+    function that waits up to a timeout for them to take effect and
+    returns the ack's error; it is None for everything else.
+    """
+    globals = GlobalState()
+    kind = command["type"]
+    value = command.get("value")
+
+    if kind == mailbox.BUSY:
+        globals.set(State.BUSY, bool(value))
+    elif kind == mailbox.RING:
+        globals.set(State.RINGING, bool(value))
+    elif kind == mailbox.DIAL:
+        number = str(value or "")
+        if not number.isdigit():
+            return f"Invalid number: {number}", None
+        if globals.get(State.ON_THE_HOOK):
+            return "Handset is on the hook", None
+        calls_out = globals.get(State.CALLS_OUT) or 0
+        tone_version = globals.get_version(State.PROGRESS_TONE)
+        globals.addCommand(number)
+
+        def placed(timeout):
+            # The call is placed, or placing it failed and reorder plays
+            failed = lambda: globals.get_version(State.PROGRESS_TONE) > tone_version and globals.get(State.PROGRESS_TONE) == Tone.REORDER
+            if not globals.wait_until(lambda: (globals.get(State.CALLS_OUT) or 0) > calls_out or failed(), timeout):
+                return f"Call to {number} was not placed"
+            return f"Call to {number} failed" if failed() else None
+
+        return None, placed
+    elif kind == mailbox.HANGUP:
+        if not globals.get(State.IN_CALL):
+            return "No call in progress", None
+        globals.addCommand(Command.HANGUP)
+
+        def ended(timeout):
+            return None if globals.wait_for(State.IN_CALL, lambda in_call: not in_call, timeout) else "Call did not end"
+
+        return None, ended
+    return None, None
+
+def commands():
+    # Commands are applied one at a time in the order they arrived. Waiting
+    # for DIAL or HANGUP to take effect happens on a thread of its own, so
+    # it never holds up the commands behind it.
+    box = mailbox.Mailbox()
+
+    def acknowledge(command, address, error):
+        logging.debug(f"Command {command['type']} {command.get('value')}: {error or 'applied'}")
+        box.acknowledge(command, address, error)
+
+    def watch(command, address, effect, timeout):
+        try:
+            error = effect(timeout)
+        except Exception as e:
+            error = str(e)
+        acknowledge(command, address, error)
+
+    try:
+        while True:
+            command, address = box.receive()
+            try:
+                error, effect = apply(command)
+            except Exception as e:
+                error, effect = str(e), None
+
+            # Only watch for the effect when the sender is waiting for the ack
+            wait = command.get("wait") if address else None
+            if error is None and effect is not None and wait:
+                try:
+                    timeout = effect_timeout(float(wait))
+                except (TypeError, ValueError):
+                    acknowledge(command, address, f"Invalid wait: {wait}")
+                    continue
+                threading.Thread(target=watch, args=(command, address, effect, timeout), daemon=True).start()
+            else:
+                acknowledge(command, address, error)
+    finally:
+        box.close()
+
+if __name__ == '__main__':
+    try:
+        commands()
+    except KeyboardInterrupt:
+        print('Exiting...')
+        sys.exit(0)
@@ -0,0 +1,155 @@
+import logging
+
+# Rule types
+EMERGENCY = "emergency"
+SPEED_DIAL = "speedDial"
+EXTENSION = "extension"
+EXTERNAL = "external"
+
+RULE_TYPES = (EMERGENCY, SPEED_DIAL, EXTENSION, EXTERNAL)
+
+# Match results
+COMPLETE = "complete"    # Dial now, no rule can use more digits
+AMBIGUOUS = "ambiguous"  # A rule matches but a longer one still could
+PARTIAL = "partial"      # No rule matches yet but one still could
+INVALID = "invalid"      # No rule can ever match
+
+# Pattern characters
+ANY_DIGIT = "X"
+MORE_DIGITS = "."
+
+# Config key of the speaking clock's number, which gets a rule of its own
+# ahead of the configured plan
+SPEAKING_CLOCK = "speakingClock"
+
+# Matches the old behaviour of only dialing 4 digit extensions
+DEFAULT_DIAL_PLAN = [
+    {"pattern": "XXXX", "type": EXTENSION}
+]
+
+# Inter-digit timeout for ambiguous prefixes, scaled from how quickly the
+# caller has been dialing
+MIN_TIMEOUT = 1.0
+MAX_TIMEOUT = 3.0
+TIMEOUT_FACTOR = 2.0
+INITIAL_GAP = 0.75
+GAP_SMOOTHING = 0.3
+
+# Give up on a number that does not match any rule yet
+PARTIAL_TIMEOUT = 5
+
+class Rule:
+    def __init__(self, pattern, type, number=None):
+        if type not in RULE_TYPES:
+            raise ValueError(f"Unknown dial plan rule type {type}")
+        if not isinstance(pattern, str):
+            raise ValueError(f"Dial plan pattern {pattern!r} is not a string")
+        if not pattern or any(c not in "0123456789" + ANY_DIGIT for c in pattern.rstrip(MORE_DIGITS)) \
+                or pattern.count(MORE_DIGITS) > 1 or pattern == MORE_DIGITS:
+            raise ValueError(f"Invalid dial plan pattern {pattern}")
+
+        self.pattern = pattern
+        self.type = type
+        self.number = number
+
+    def destination(self, digits):
+        """The number to dial, e.g. the target of a speed dial code."""
+        return self.number or digits
+
+    def __repr__(self):
+        return f"Rule({self.pattern!r}, {self.type!r})"
+
+def speaking_clock_rules(config):
+    """A rule for the speaking clock's number, if one is configured."""
+    number = config.get(SPEAKING_CLOCK)
+    if number is None or number == "":
+        return []
+    try:
+        return [Rule(str(number), EXTENSION)]
+    except ValueError:
+        logging.error(f"Invalid speaking clock number {number!r}, ignoring it")
+        return []
+
+class Node:
+    def __init__(self):
+        self.children = {}
+        self.rule = None
+        # Set on the node reached through a trailing '.', which keeps
+        # matching any number of further digits
+        self.loop = False
+
+class DialPlan:
+    """Dial plan rules compiled into a prefix trie.
+
+    Patterns are digits, 'X' for any single digit and an optional trailing
+    '.' for one or more further digits. When several rules match the same
+    number the first one listed wins, and emergency rules complete as soon
+    as they match even if a longer rule could still apply.
+    """
+
+    def __init__(self, rules):
+        self.rules = [rule if isinstance(rule, Rule) else Rule(**rule) for rule in rules]
+        self.root = Node()
+        self.priority = {}
+
+        for index, rule in enumerate(self.rules):
+            self.priority[id(rule)] = index
+            node = self.root
+            for char in rule.pattern:
+                node = node.children.setdefault(char, Node())
+                if char == MORE_DIGITS:
+                    node.loop = True
+            if node.rule is None:
+                node.rule = rule
+
+    @classmethod
+    def from_config(cls, config):
+        rules = config.get("dialPlan") or DEFAULT_DIAL_PLAN
+        clock = speaking_clock_rules(config)
+        try:
+            return cls(clock + list(rules))
+        except (TypeError, ValueError) as e:
+            logging.error(f"Invalid dial plan, using the default: {e}")
+            return cls(clock + DEFAULT_DIAL_PLAN)
+
+    def _step(self, nodes, digit):
+        next_nodes = []
+        for node in nodes:
+            if node.loop:
+                next_nodes.append(node)
+            for key in (digit, ANY_DIGIT, MORE_DIGITS):
+                child = node.children.get(key)
+                if child is not None:
+                    next_nodes.append(child)
+        return next_nodes
+
+    def match(self, digits):
+        """Match a dialed prefix, returning (result, rule)."""
+        nodes = [self.root]
+        for digit in digits:
+            nodes = self._step(nodes, digit)
+            if not nodes:
+                return INVALID, None
+
+        matched = [node.rule for node in nodes if node.rule is not None]
+        if not matched:
+            return PARTIAL, None
+
+        rule = min(matched, key=lambda rule: self.priority[id(rule)])
+        if rule.type == EMERGENCY:
+            return COMPLETE, rule
+
+        more = any(node.loop or node.children for node in nodes)
+        return (AMBIGUOUS if more else COMPLETE), rule
+
+class InterDigitTimer:
+    """Adapts the ambiguous-prefix timeout to the caller's dialing pace."""
+
+    def __init__(self):
+        self.gap = INITIAL_GAP
+
+    def observe(self, gap):
+        self.gap += GAP_SMOOTHING * (gap - self.gap)
+
+    def timeout(self):
+        return min(MAX_TIMEOUT, max(MIN_TIMEOUT, TIMEOUT_FACTOR * self.gap))
@@ -2,63 +2,124 @@ import RPi.GPIO as GPIO
 import time
 import sys
 import logging
-from global_state import GlobalState
+import os
+import threading
+import metrics
+from pulse_decoder import DialDecoder, TraceRecorder, DIGIT, SEQUENCE, REJECTED
+from dial_plan import DialPlan
+from global_state import GlobalState, State, Tone
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import config_store
+
+CONFIG_PATH = "../config.json"
 
 # Pin configuration
 CLICKPIN = 35
 STOPPIN = 37
 
-def dialer():
-    globals = GlobalState()
+# Hardware debounce handed to RPi.GPIO, in milliseconds
+BOUNCE_TIME = 5
 
-    # GPIO setup
-    GPIO.setup(CLICKPIN, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-    GPIO.setup(STOPPIN, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+# Set to a file path to record every edge for offline replay
+TRACE_PATH = os.environ.get("RINGRING_DIAL_TRACE")
 
-    clickPressed = False
-    stopPressed = False
-    clickCounter = 0
+EDGE_BUFFER_SIZE = 1024
 
-    # Sequence starts empty when the program runs
-    sequence = ""
+class EdgeBuffer:
+    """Single-producer/single-consumer ring of (timestamp, pin, level) edges.
 
-    # Track the time of the last recorded number
-    last_recorded_time = time.time()
+    Only the GPIO callback thread advances head and only the dialer thread
+    advances tail, so neither side takes a lock. Edges arriving while the
+    ring is full are dropped and counted.
+    """
 
-    while True:  # Run forever
-        current_time = time.time()
+    def __init__(self, size=EDGE_BUFFER_SIZE):
+        self.size = size
+        self.slots = [None] * size
+        self.head = 0
+        self.tail = 0
+        self.ready = threading.Event()
+        self.dropped = metrics.counter("dialer.dropped_edges")
+
+    def push(self, edge):
+        if self.head - self.tail >= self.size:
+            self.dropped.inc()
+            return
+
+        self.slots[self.head % self.size] = edge
+        self.head += 1
+        self.ready.set()
 
-        # Check if more than 2 seconds have passed since the last recorded number
-        if current_time - last_recorded_time > 2 and sequence:
-            globals.addCommand(sequence)
-            sequence = ""
+    def pop_all(self):
+        edges = []
+        while self.tail != self.head:
+            edges.append(self.slots[self.tail % self.size])
+            self.tail += 1
+        return edges
 
-        # Check CLICKPIN
-        if GPIO.input(CLICKPIN) == GPIO.HIGH and not clickPressed:
-            clickPressed = True
-            clickCounter += 1
-        elif GPIO.input(CLICKPIN) == GPIO.LOW and clickPressed:
-            clickPressed = False
+    def wait(self, timeout=None):
+        self.ready.wait(timeout)
+        self.ready.clear()
 
-        # Check STOPPIN
-        if GPIO.input(STOPPIN) == GPIO.HIGH and not stopPressed:
-            if clickCounter != 0:
-                recorded_value = 0 if clickCounter == 10 else clickCounter
+def load_dial_plan():
+    try:
+        config = config_store.get_store(CONFIG_PATH).get()
+    except ValueError:
+        config = {}
+
+    return DialPlan.from_config(config)
+
+def dialer():
+    globals = GlobalState()
+    buffer = EdgeBuffer()
+    decoder = DialDecoder(CLICKPIN, STOPPIN, plan=load_dial_plan())
+    recorder = TraceRecorder(TRACE_PATH) if TRACE_PATH else None
+    latency = metrics.histogram("dialer.digit_latency")
 
-                if (recorded_value < 10):
-                    sequence += str(recorded_value)
-                    logging.debug(f'Recorded {recorded_value}')
-                else:
-                    logging.debug(f'Ignored {recorded_value}')
+    def on_config(config):
+        # Swapping the attribute is atomic, the next digit matches against it
+        decoder.plan = DialPlan.from_config(config)
+        logging.debug("Dial plan reloaded")
 
-                last_recorded_time = time.time()
+    config_store.get_store(CONFIG_PATH).subscribe(on_config)
 
-            stopPressed = True
-            clickCounter = 0
-        elif GPIO.input(STOPPIN) == GPIO.LOW and stopPressed:
-            stopPressed = False
+    def on_edge(pin):
+        buffer.push((time.monotonic(), pin, GPIO.input(pin)))
 
-        time.sleep(0.005)
+    # GPIO setup
+    GPIO.setup(CLICKPIN, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+    GPIO.setup(STOPPIN, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+    GPIO.add_event_detect(CLICKPIN, GPIO.BOTH, callback=on_edge, bouncetime=BOUNCE_TIME)
+    GPIO.add_event_detect(STOPPIN, GPIO.BOTH, callback=on_edge, bouncetime=BOUNCE_TIME)
+
+    while True:  # Run forever
+        # Sleep until an edge arrives or the next digit/sequence deadline
+        deadline = decoder.deadline()
+        buffer.wait(max(0, deadline - time.monotonic()) if deadline is not None else None)
+
+        events = []
+        for edge in buffer.pop_all():
+            if recorder:
+                recorder.record(*edge)
+            # The first pulse stops the dial tone
+            if edge[1] == CLICKPIN and not globals.get(State.DIALING) and not globals.get(State.ON_THE_HOOK):
+                globals.set(State.DIALING, True)
+            events += decoder.feed(*edge)
+        events += decoder.expire(time.monotonic())
+
+        if recorder:
+            recorder.flush()
+
+        for event in events:
+            if event.kind == DIGIT:
+                latency.observe(time.monotonic() - event.timestamp)
+                logging.debug(f'Recorded {event.value}')
+            elif event.kind == SEQUENCE:
+                globals.addCommand(event.value)
+            elif event.kind == REJECTED:
+                logging.debug(f'No dial plan match for {event.value}')
+                globals.set(State.PROGRESS_TONE, Tone.REORDER)
 
 
 if __name__ == '__main__':
@@ -70,4 +131,4 @@ if __name__ == '__main__':
         logging.error(e)
     finally:
         GPIO.cleanup()
-        sys.exit(0)
+        sys.exit(0)
\ No newline at end of file
@@ -1,5 +1,10 @@
-import queue
+import time
 import logging
+import threading
+import metrics
+from collections import deque
+from contextlib import contextmanager
+from types import MappingProxyType
 import RPi.GPIO as GPIO
 
 logging.basicConfig(
@@ -17,28 +22,193 @@ class SingletonMeta(type):
             cls._instances[cls] = instance
         return cls._instances[cls]
 
+class Snapshot:
+    """Immutable view of every key at a single version."""
+
+    def __init__(self, version, state):
+        self.version = version
+        self.state = MappingProxyType(state)
+
+    def get(self, key):
+        return self.state.get(key, None)
+
+class Transaction:
+    """Pending writes that are applied together when the transaction ends."""
+
+    def __init__(self, global_state):
+        self.global_state = global_state
+        self.changes = {}
+
+    def set(self, key, value):
+        self.changes[key] = value
+
+    def get(self, key):
+        if key in self.changes:
+            return self.changes[key]
+        return self.global_state.get(key)
+
 class GlobalState(metaclass=SingletonMeta):
     def __init__(self):
         self.state = {}
-        self.queue = queue.Queue()
+
+        # Commands are (queued at, command) pairs, guarded by lock so one
+        # condition can cover both new commands and state changes
+        self.commands = deque()
+        self.dispatch_latency = metrics.histogram("commands.dispatch_latency")
+
+        # Bumped once per applied change set; versions holds the version at
+        # which each key last changed
+        self.version = 0
+        self.versions = {}
+        self.changed_at = {}
+        self.snapshot_cache = Snapshot(0, {})
+
+        # Every per-key condition shares one lock, so a waiter can never miss
+        # a change made between its check and its wait
+        self.lock = threading.RLock()
+        self.conditions = {}
+        self.activity = threading.Condition(self.lock)
+        self.observers = {}
+
+    def _condition(self, key):
+        condition = self.conditions.get(key)
+        if condition is None:
+            condition = threading.Condition(self.lock)
+            self.conditions[key] = condition
+        return condition
+
+    def _apply(self, changes):
+        """Apply changes under the lock and return the observer calls to make."""
+        changed = [(key, self.state.get(key), value) for key, value in changes.items() if self.state.get(key) != value]
+        if not changed:
+            return []
+
+        # Copy on write: the state dict is never mutated once published, so
+        # get() and snapshot() need no lock and never see half a transaction
+        state = dict(self.state)
+        self.version += 1
+        now = time.monotonic()
+        calls = []
+        for key, old_value, value in changed:
+            state[key] = value
+            self.versions[key] = self.version
+            self.changed_at[key] = now
+            self._condition(key).notify_all()
+            calls += [(callback, key, old_value, value) for callback in self.observers.get(key, ())]
+
+        self.state = state
+        self.activity.notify_all()
+        return calls
+
+    def _notify(self, calls):
+        # Observers run outside the lock so they are free to call back in
+        for callback, key, old_value, value in calls:
+            try:
+                callback(key, old_value, value)
+            except Exception as e:
+                logging.error(f"Observer for {key} failed: {e}")
 
     def set(self, key, value):
-        old_value = self.state.get(key)
-        if old_value != value:
-            self.state[key] = value
+        with self.lock:
+            calls = self._apply({key: value})
+        self._notify(calls)
+
+    @contextmanager
+    def transaction(self):
+        """Update several keys atomically.
+
+        The lock is held for the whole block, so reads through the
+        transaction see a consistent state, and readers never see only part
+        of the writes:
+
+            with GlobalState().transaction() as state:
+                state.set(State.RINGING, False)
+                state.set(State.IN_CALL, True)
+        """
+        transaction = Transaction(self)
+        with self.lock:
+            yield transaction
+            calls = self._apply(transaction.changes)
+        self._notify(calls)
+
+    def snapshot(self):
+        """Return an immutable Snapshot of every key at the current version."""
+        with self.lock:
+            if self.snapshot_cache.version != self.version:
+                self.snapshot_cache = Snapshot(self.version, self.state)
+            return self.snapshot_cache
+
+    def get_version(self, key=None):
+        """Version at which key last changed, or the global version."""
+        if key is None:
+            return self.version
+        return self.versions.get(key, 0)
 
     def get(self, key):
         return self.state.get(key, None)
-    
+
+    def subscribe(self, key, callback):
+        """Call callback(key, old_value, new_value) whenever key changes."""
+        with self.lock:
+            self.observers.setdefault(key, []).append(callback)
+
+    def unsubscribe(self, key, callback):
+        with self.lock:
+            if callback in self.observers.get(key, ()):
+                self.observers[key].remove(callback)
+
+    def wait_for(self, key, predicate, timeout=None):
+        """Block until predicate(value of key) is true.
+
+        Returns False if the timeout expires first.
+        """
+        with self.lock:
+            return self._condition(key).wait_for(lambda: predicate(self.state.get(key)), timeout)
+
+    def wait_until(self, predicate, timeout=None):
+        """Block until predicate() is true, checking it after every change.
+
+        Returns False if the timeout expires first.
+        """
+        with self.lock:
+            return self.activity.wait_for(predicate, timeout)
+
+    def get_changed_at(self, key):
+        """time.monotonic() of the last change to key, or None."""
+        return self.changed_at.get(key)
+
     def addCommand(self, command):
         logging.debug("addCommand %s", command)
-        self.queue.put(command)
+        with self.lock:
+            self.commands.append((time.monotonic(), command))
+            self.activity.notify_all()
+
+    def _pop_command(self):
+        queued_at, command = self.commands.popleft()
+        self.dispatch_latency.observe(time.monotonic() - queued_at)
+        return command
 
     def getCommand(self):
-        try:
-            return self.queue.get(block=False)
-        except queue.Empty:
-            return None
+        with self.lock:
+            return self._pop_command() if self.commands else None
+
+    def wait_for_command(self, keys=(), since=None, timeout=None):
+        """Block until a command is queued or any of keys changes after version since.
+
+        Returns (command or None, current version); pass the version back as
+        since on the next call so no change is missed in between:
+
+            version = globals.get_version()
+            while True:
+                command, version = globals.wait_for_command([State.ON_THE_HOOK], version)
+        """
+        with self.lock:
+            if since is None:
+                since = self.version
+
+            self.activity.wait_for(lambda: self.commands or any(self.versions.get(key, 0) > since for key in keys), timeout)
+            command = self._pop_command() if self.commands else None
+            return command, self.version
 
 class State:
     REGISTERED_WITH_SIP = "registered_with_sip"
@@ -46,4 +216,36 @@ class State:
     RINGING = "ringing"
     ON_THE_HOOK = "on_the_hook"
     IN_CALL = "in_call"
-    BUSY = "busy"
\ No newline at end of file
+    BUSY = "busy"
+    CALL_PEER = "call_peer"
+    CALL_START = "call_start"
+    REGISTRATION_EXPIRY = "registration_expiry"
+    REGISTRATION_STATUS = "registration_status"
+    REGISTRATION_RETRY = "registration_retry"
+    CALLS_IN = "calls_in"
+    CALLS_OUT = "calls_out"
+    LAST_DIALED = "last_dialed"
+    PENDING_CALLS = "pending_calls"
+    CALL_MOS = "call_mos"
+    CALL_JITTER = "call_jitter"
+    CALL_LOSS = "call_loss"
+    CALL_RTT = "call_rtt"
+    DIALING = "dialing"
+    PROGRESS_TONE = "progress_tone"
+    # time.monotonic() of the GPIO edge that took the handset off the hook
+    LIFTED_AT = "lifted_at"
+
+class Command:
+    """Commands queued for the SIP thread besides a dialed number."""
+    HANGUP = "hangup"
+    RELOAD_CONFIG = "reload_config"
+    RELEASE_CALLS = "release_calls"
+    RESCAN_AUDIO = "rescan_audio"
+    UPDATE_TONE = "update_tone"
+
+class Tone:
+    """Call-progress tones, see tones.py."""
+    DIAL = "dial"
+    RINGBACK = "ringback"
+    BUSY = "busy"
+    REORDER = "reorder"
@@ -1,26 +1,59 @@
 import RPi.GPIO as GPIO
-import time
 import sys
+import time
 import logging
+import threading
 from global_state import GlobalState, State
 
 PIN = 33
 
+# Debounce for the switch hook, in milliseconds
+BOUNCE_TIME = 20
+
+# Re-read the pin this often even without an edge, in seconds, in case the
+# debounce swallowed the last one
+RESYNC_INTERVAL = 1
+
 def hook():
     globals = GlobalState()
 
     GPIO.setup(PIN, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
 
+    # The callback latches every edge, so one between reading the pin and
+    # going back to sleep isn't lost, and the time of the first one since
+    # the last read, which dial tone latency is measured from
+    edge = threading.Event()
+    edge_times = []
+
+    def on_edge(pin):
+        if not edge_times:
+            edge_times.append(time.monotonic())
+        edge.set()
+
+    GPIO.add_event_detect(PIN, GPIO.BOTH, callback=on_edge, bouncetime=BOUNCE_TIME)
+
     while True:
+        # Cleared before the read: a later edge wakes us to read again
+        edge.clear()
+        edge_at = edge_times.pop() if edge_times else None
         current_state = GPIO.input(PIN)
         if current_state == GPIO.HIGH and globals.get(State.ON_THE_HOOK):
             logging.debug("Hook is Disconnected!")
-            globals.set(State.ON_THE_HOOK, False)
+            with globals.transaction() as state:
+                state.set(State.ON_THE_HOOK, False)
+                # Found by a resync, without an edge, it is now
+                state.set(State.LIFTED_AT, edge_at or time.monotonic())
         elif current_state == GPIO.LOW and not globals.get(State.ON_THE_HOOK):
             logging.debug("Hook is Connected!")
-            globals.set(State.ON_THE_HOOK, True)
+            # Hanging up ends whatever the last attempt left behind, in the
+            # same change so nobody sees the handset down with a stale tone
+            with globals.transaction() as state:
+                state.set(State.ON_THE_HOOK, True)
+                state.set(State.DIALING, False)
+                state.set(State.PROGRESS_TONE, None)
 
-        time.sleep(0.2)
+        # Sleep until the switch hook moves
+        edge.wait(RESYNC_INTERVAL)
 
 if __name__ == '__main__':
     try:
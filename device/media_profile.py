@@ -0,0 +1,166 @@
+"""Media profiles: conference bridge clock, codec priorities and ptime.
+
+pjmedia resamples wherever two clock rates meet: between a codec and the
+conference bridge, and between the bridge and the sound device. The old
+code asked for a 44.1 kHz bridge, which would have resampled every call's
+8 or 16 kHz codec audio up and back down, though the setting never
+reached libInit. A profile runs the bridge at the clock rate of the codec
+it prefers, so that codec needs no resampling, and lists codecs in the
+order they should be offered.
+
+The profile is chosen with "mediaProfile" in config.json and applied when
+the endpoint is created, so changing it takes a restart.
+
+The jitter buffer and echo canceller are set up the same way, from
+"jitterBuffer" and "echoCanceller". Each takes either a preset name or an
+object that overrides fields of the default preset, e.g.
+
+    "echoCanceller": {"algorithm": "webrtc", "tailLength": 64, "aggressiveness": "moderate"}
+"""
+from collections import namedtuple
+
+# Config key
+MEDIA_PROFILE = "mediaProfile"
+
+# snd_clock_rate 0 runs the sound device at the bridge rate. codecs are
+# pjsua2 codec id prefixes, most preferred first; codecs not listed are
+# disabled.
+Profile = namedtuple("Profile", ["name", "clock_rate", "snd_clock_rate", "ptime", "codecs"])
+
+PROFILES = {
+    "narrowband": Profile("narrowband", 8000, 0, 20, ["PCMU/8000", "PCMA/8000"]),
+    "wideband": Profile("wideband", 16000, 0, 20, ["G722/16000", "PCMU/8000", "PCMA/8000"]),
+    "opus": Profile("opus", 48000, 0, 20, ["opus/48000", "G722/16000", "PCMU/8000", "PCMA/8000"]),
+    # Bridge and device at the USB card's native rate, pjsua2's default
+    # codec order. The old code asked for this but never applied it, so
+    # the phone actually ran on pjsua2's default media settings.
+    "native": Profile("native", 44100, 44100, 20, []),
+}
+
+DEFAULT_PROFILE = "wideband"
+
+# Config keys
+JITTER_BUFFER = "jitterBuffer"
+ECHO_CANCELLER = "echoCanceller"
+
+# Jitter buffer sizes in milliseconds, -1 leaves the pjsua2 default. init
+# is the prefetch before playout starts, min_prefetch and max_prefetch
+# bound the adaptive prefetch, max is the most audio the buffer holds.
+JitterBuffer = namedtuple("JitterBuffer", ["init", "min_prefetch", "max_prefetch", "max"])
+JITTER_FIELDS = {"init": "init", "minPrefetch": "min_prefetch", "maxPrefetch": "max_prefetch", "max": "max"}
+
+JITTER_BUFFERS = {
+    "default": JitterBuffer(-1, -1, -1, -1),
+    # LAN or a nearby PBX: little jitter to absorb, keep the delay down
+    "low-latency": JitterBuffer(20, 10, 60, 200),
+    # Wi-Fi or a distant trunk: more prefetch, fewer late-frame discards
+    "stable": JitterBuffer(60, 40, 200, 500),
+}
+
+DEFAULT_JITTER_BUFFER = "default"
+
+# Echo canceller. algorithm and aggressiveness are names from the tables
+# below, tail_length is the longest echo path cancelled in milliseconds,
+# 0 turns the echo canceller off.
+EchoCanceller = namedtuple("EchoCanceller", ["algorithm", "tail_length", "aggressiveness", "noise_suppressor"])
+ECHO_FIELDS = {"algorithm": "algorithm", "tailLength": "tail_length", "aggressiveness": "aggressiveness", "noiseSuppressor": "noise_suppressor"}
+
+# PJMEDIA_ECHO_* option flags from pjmedia/echo.h
+ECHO_ALGORITHMS = {"default": 0, "speex": 1, "simple": 2, "webrtc": 3, "webrtc-aec3": 4}
+ECHO_AGGRESSIVENESS = {"default": 0x000, "conservative": 0x100, "moderate": 0x200, "aggressive": 0x300}
+ECHO_NOISE_SUPPRESSOR = 0x080
+
+ECHO_CANCELLERS = {
+    "off": EchoCanceller("default", 0, "default", False),
+    # pjsua2's own settings
+    "default": EchoCanceller("default", 200, "default", False),
+    # The earpiece couples into the handset microphone over a short path,
+    # the USB card's buffering is most of the delay
+    "handset": EchoCanceller("webrtc", 64, "moderate", True),
+    "aggressive": EchoCanceller("webrtc", 128, "aggressive", True),
+}
+
+DEFAULT_ECHO_CANCELLER = "default"
+
+def get_profile(config):
+    """The profile named in config, or the default one."""
+    name = config.get(MEDIA_PROFILE, DEFAULT_PROFILE)
+    if name not in PROFILES:
+        print(f"Unknown media profile {name!r}, using {DEFAULT_PROFILE}")
+        name = DEFAULT_PROFILE
+    return PROFILES[name]
+
+def _setting(config, key, presets, default, fields):
+    """A preset named in config[key], or the default preset with fields from an object."""
+    value = config.get(key, default)
+    if isinstance(value, str):
+        if value not in presets:
+            print(f"Unknown {key} preset {value!r}, using {default}")
+            value = default
+        return presets[value]
+
+    if not isinstance(value, dict):
+        print(f"{key} should be a preset name or an object, using {default}")
+        return presets[default]
+
+    preset = presets[default]
+    unknown = set(value) - set(fields)
+    if unknown:
+        print(f"Ignoring unknown {key} settings: {', '.join(sorted(unknown))}")
+    return preset._replace(**{fields[name]: setting for name, setting in value.items() if name in fields})
+
+def get_jitter_buffer(config):
+    """The jitter buffer settings in config, or the default ones."""
+    jitter_buffer = _setting(config, JITTER_BUFFER, JITTER_BUFFERS, DEFAULT_JITTER_BUFFER, JITTER_FIELDS)
+    if not all(isinstance(size, int) for size in jitter_buffer):
+        print(f"{JITTER_BUFFER} sizes must be whole milliseconds, using {DEFAULT_JITTER_BUFFER}")
+        return JITTER_BUFFERS[DEFAULT_JITTER_BUFFER]
+    return jitter_buffer
+
+def get_echo_canceller(config):
+    """The echo canceller settings in config, or the default ones."""
+    echo = _setting(config, ECHO_CANCELLER, ECHO_CANCELLERS, DEFAULT_ECHO_CANCELLER, ECHO_FIELDS)
+    if echo.algorithm not in ECHO_ALGORITHMS or echo.aggressiveness not in ECHO_AGGRESSIVENESS \
+            or not isinstance(echo.tail_length, int) or echo.tail_length < 0:
+        print(f"Invalid {ECHO_CANCELLER} settings {echo}, using {DEFAULT_ECHO_CANCELLER}")
+        return ECHO_CANCELLERS[DEFAULT_ECHO_CANCELLER]
+    return echo
+
+def echo_options(echo):
+    """The pjsua2 ecOptions flags for echo."""
+    options = ECHO_ALGORITHMS[echo.algorithm] | ECHO_AGGRESSIVENESS[echo.aggressiveness]
+    if echo.noise_suppressor:
+        options |= ECHO_NOISE_SUPPRESSOR
+    return options
+
+def apply_media_config(med_config, profile, jitter_buffer=JITTER_BUFFERS[DEFAULT_JITTER_BUFFER], echo=ECHO_CANCELLERS[DEFAULT_ECHO_CANCELLER]):
+    """Set up an EpConfig.medConfig for profile before libInit."""
+    med_config.clockRate = profile.clock_rate
+    med_config.sndClockRate = profile.snd_clock_rate
+    med_config.channelCount = 1  # Mono
+    med_config.audioFramePtime = profile.ptime
+    med_config.ptime = profile.ptime
+
+    med_config.jbInit = jitter_buffer.init
+    med_config.jbMinPre = jitter_buffer.min_prefetch
+    med_config.jbMaxPre = jitter_buffer.max_prefetch
+    med_config.jbMax = jitter_buffer.max
+
+    med_config.ecTailLen = echo.tail_length
+    med_config.ecOptions = echo_options(echo)
+
+def apply_codec_priorities(ep, profile):
+    """Order codecs for profile after libInit. Returns the enabled codec ids in order."""
+    if not profile.codecs:
+        return [codec.codecId for codec in ep.codecEnum2() if codec.priority > 0]
+
+    enabled = []
+    for codec in ep.codecEnum2():
+        rank = next((i for i, prefix in enumerate(profile.codecs) if codec.codecId.lower().startswith(prefix.lower())), None)
+        if rank is None:
+            ep.codecSetPriority(codec.codecId, 0)
+        else:
+            ep.codecSetPriority(codec.codecId, 255 - rank)
+            enabled.append((rank, codec.codecId))
+
+    return [codec_id for _, codec_id in sorted(enabled)]
@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+
+METRICS_PATH = "../metrics.json"
+METRICS_INTERVAL = 5
+
+# Latency buckets in seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+_lock = threading.Lock()
+_metrics = {}
+
+class Counter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+class Gauge:
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def snapshot(self):
+        return self.value
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.lock = threading.Lock()
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            self.max = max(self.max, value)
+
+    def snapshot(self):
+        with self.lock:
+            cumulative = 0
+            buckets = {}
+            for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+                cumulative += count
+                buckets[str(bound)] = cumulative
+
+            return {
+                "count": self.count,
+                "sum": self.sum,
+                "max": self.max,
+                "buckets": buckets
+            }
+
+def _get(name, factory):
+    with _lock:
+        metric = _metrics.get(name)
+        if metric is None:
+            metric = factory()
+            _metrics[name] = metric
+        return metric
+
+def counter(name):
+    return _get(name, Counter)
+
+def gauge(name):
+    return _get(name, Gauge)
+
+def histogram(name, buckets=DEFAULT_BUCKETS):
+    return _get(name, lambda: Histogram(buckets))
+
+def snapshot():
+    with _lock:
+        items = list(_metrics.items())
+    return {name: metric.snapshot() for name, metric in items}
+
+def write_metrics(path=METRICS_PATH):
+    """Write the current metrics to disk without exposing a half-written file."""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as file:
+        json.dump({"time": time.time(), "metrics": snapshot()}, file, indent=4)
+    os.replace(temp_path, path)
+
+def metrics():
+    while True:
+        try:
+            write_metrics()
+        except OSError as e:
+            logging.error(f"Unable to write metrics: {e}")
+
+        time.sleep(METRICS_INTERVAL)
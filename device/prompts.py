@@ -0,0 +1,418 @@
+"""Announcement prompts: rendered once, cached on disk, played from memory.
+
+Speech is rendered with espeak, resampled to the conference bridge clock
+rate and stored as a WAV file named after a hash of the text, the voice
+settings and the rate, so the same prompt is never rendered twice and a
+change of voice or media profile can't pick up a stale clip. The least
+recently used clips are deleted once the directory grows past DISK_QUOTA,
+and recently played ones stay memory-mapped up to MEMORY_QUOTA.
+
+Templated prompts such as the time or a number read back are assembled
+from cached fragments ("the time is", "eleven", "forty", "two"), so only
+the fragments are ever rendered. Clips are played into a call through a
+conference bridge port that serves frames straight from memory, which
+needs pjsua2 2.13 or newer for AudioMediaPort.
+
+The SIP thread uses them for the speaking clock: dialing the number in
+"speakingClock" in config.json, with no call up, reads the time to the
+handset. The dial plan gets a rule for that number automatically.
+"""
+import os
+import mmap
+import time
+import array
+import struct
+import hashlib
+import logging
+import tempfile
+import threading
+import subprocess
+from collections import OrderedDict
+import pjsua2 as pj
+import metrics
+from dial_plan import SPEAKING_CLOCK
+
+PROMPT_DIR = "../prompts"
+
+# Owner of prompts played to the handset rather than into a call
+HANDSET = "handset"
+
+# Bytes of rendered clips kept on disk, and mapped in memory
+DISK_QUOTA = 16 * 1024 * 1024
+MEMORY_QUOTA = 2 * 1024 * 1024
+
+# espeak reads the text as its last argument and writes a WAV to stdout.
+# Part of the cache key, so changing it re-renders everything.
+RENDER_COMMAND = ["espeak", "--stdout", "-v", "en", "-s", "100"]
+RENDER_TIMEOUT = 10
+
+# Silence between the fragments of a templated prompt, in seconds
+FRAGMENT_GAP = 0.05
+
+WAV_HEADER = 44
+
+ONES = ["zero", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten",
+        "eleven", "twelve", "thirteen", "fourteen", "fifteen", "sixteen", "seventeen", "eighteen", "nineteen"]
+TENS = ["", "", "twenty", "thirty", "forty", "fifty"]
+
+def number_words(number):
+    """Fragments for a number from 0 to 59."""
+    if number < 20:
+        return [ONES[number]]
+    tens, ones = divmod(number, 10)
+    return [TENS[tens]] + ([ONES[ones]] if ones else [])
+
+def time_fragments(now):
+    """Fragments for "the time is 11 42", now a datetime or time.struct_time."""
+    hour, minute = (now.hour, now.minute) if hasattr(now, "hour") else (now.tm_hour, now.tm_min)
+    fragments = ["the time is"] + number_words(hour)
+    if minute == 0:
+        fragments.append("hundred hours")
+    elif minute < 10:
+        fragments += ["oh", ONES[minute]]
+    else:
+        fragments += number_words(minute)
+    return fragments
+
+def number_fragments(number):
+    """Fragments reading a phone number back digit by digit."""
+    return ["you dialed"] + [ONES[int(digit)] for digit in str(number) if digit.isdigit()]
+
+TEMPLATES = {
+    "time": time_fragments,
+    "number": number_fragments,
+}
+
+def speaking_clock_number(config):
+    """The speaking clock's number as dialed, or None if there isn't one.
+
+    The dial plan adds a rule for it, so it needn't be in "dialPlan".
+    """
+    number = config.get(SPEAKING_CLOCK)
+    return str(number) if number not in (None, "") else None
+
+def template_fragments():
+    """Every fragment the templates can use, for warming the cache."""
+    return ["the time is", "hundred hours", "oh", "you dialed"] + ONES + TENS[2:]
+
+def parse_wav(data):
+    """Samples and rate of mono 16-bit WAV data.
+
+    espeak can't seek on a pipe, so the sizes in its header are bogus; the
+    data chunk runs to the end.
+    """
+    if data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        raise ValueError("Not a WAV file")
+
+    rate = None
+    position = 12
+    while position + 8 <= len(data):
+        chunk, size = struct.unpack_from("<4sI", data, position)
+        body = position + 8
+        if chunk == b"fmt ":
+            _, channels, rate, _, _, bits = struct.unpack_from("<HHIIHH", data, body)
+            if channels != 1 or bits != 16:
+                raise ValueError(f"Expected mono 16-bit audio, got {channels} channels of {bits} bits")
+        elif chunk == b"data":
+            if rate is None:
+                raise ValueError("WAV data before its format")
+            pcm = data[body:body + min(size, len(data) - body)]
+            samples = array.array("h")
+            samples.frombytes(pcm[:len(pcm) - len(pcm) % 2])
+            return samples, rate
+        position = body + size + size % 2
+
+    raise ValueError("WAV file has no data")
+
+def resample(samples, from_rate, to_rate):
+    """Linear interpolation to another rate. Good enough for speech."""
+    if from_rate == to_rate or not samples:
+        return samples
+
+    count = len(samples) * to_rate // from_rate
+    step = from_rate / to_rate
+    last = len(samples) - 1
+    result = array.array("h", bytes(2 * count))
+    for i in range(count):
+        position = i * step
+        index = int(position)
+        if index >= last:
+            result[i] = samples[last]
+        else:
+            fraction = position - index
+            result[i] = int(samples[index] + (samples[index + 1] - samples[index]) * fraction)
+    return result
+
+def render_speech(text, clock_rate):
+    """Speak text with espeak and return mono samples at clock_rate."""
+    output = subprocess.run(RENDER_COMMAND + [text], capture_output=True, check=True, timeout=RENDER_TIMEOUT).stdout
+    samples, rate = parse_wav(output)
+    return resample(samples, rate, clock_rate)
+
+def wav_header(clock_rate, data_size):
+    return struct.pack("<4sI4s4sIHHIIHH4sI", b"RIFF", 36 + data_size, b"WAVE", b"fmt ", 16, 1, 1,
+                       clock_rate, clock_rate * 2, 2, 16, b"data", data_size)
+
+class Clip:
+    """Mono 16-bit PCM at clock_rate, from a memory map or a buffer."""
+
+    def __init__(self, pcm, clock_rate, path=None):
+        self.pcm = memoryview(pcm)
+        self.clock_rate = clock_rate
+        self.path = path
+
+    @classmethod
+    def load(cls, path, clock_rate):
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(memoryview(mapped)[WAV_HEADER:], clock_rate, path)
+
+    @property
+    def size(self):
+        return len(self.pcm)
+
+    @property
+    def duration(self):
+        return len(self.pcm) / (2 * self.clock_rate)
+
+class PromptCache:
+    """Content-addressed cache of rendered prompts, with LRU eviction."""
+
+    def __init__(self, clock_rate, directory=PROMPT_DIR, disk_quota=DISK_QUOTA, memory_quota=MEMORY_QUOTA, render=render_speech):
+        self.clock_rate = clock_rate
+        self.directory = directory
+        self.disk_quota = disk_quota
+        self.memory_quota = memory_quota
+        self.render = render
+
+        self.lock = threading.Lock()
+        self.render_lock = threading.Lock()
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+
+        # Files oldest first. A hit touches the file, so the order
+        # survives restarts even where atime isn't kept.
+        os.makedirs(directory, exist_ok=True)
+        files = []
+        for name in os.listdir(directory):
+            if name.endswith(".tmp"):
+                # Left by a render that didn't finish
+                os.remove(os.path.join(directory, name))
+            elif name.endswith(".wav"):
+                stat = os.stat(os.path.join(directory, name))
+                files.append((stat.st_mtime, name[:-4], stat.st_size))
+        self.disk = OrderedDict((key, size) for _, key, size in sorted(files))
+        self.disk_bytes = sum(self.disk.values())
+
+        self.hits = metrics.counter("prompts.hits")
+        self.misses = metrics.counter("prompts.misses")
+        self.evictions = metrics.counter("prompts.evictions")
+        self.render_time = metrics.histogram("prompts.render_time")
+        self.disk_usage = metrics.gauge("prompts.disk_bytes")
+        self.disk_usage.set(self.disk_bytes)
+
+    def key(self, text):
+        identity = "\0".join(RENDER_COMMAND + [str(self.clock_rate), text])
+        return hashlib.sha256(identity.encode()).hexdigest()[:32]
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".wav")
+
+    def get(self, text):
+        """The clip for text, rendering it if it isn't cached."""
+        key = self.key(text)
+        with self.lock:
+            clip = self.memory.get(key)
+            on_disk = clip is not None and key in self.disk
+            if clip is not None:
+                self.memory.move_to_end(key)
+                if on_disk:
+                    self.disk.move_to_end(key)
+                self.hits.inc()
+
+        if clip is not None:
+            if on_disk:
+                self._touch(key)
+            return clip
+
+        clip = self._load(key)
+        if clip is None:
+            clip = self._render(key, text)
+        else:
+            self.hits.inc()
+
+        with self.lock:
+            if key not in self.memory:
+                self.memory[key] = clip
+                self.memory_bytes += clip.size
+            # Evicted clips that are still playing stay mapped until the
+            # port lets go of them
+            while self.memory_bytes > self.memory_quota and len(self.memory) > 1:
+                _, evicted = self.memory.popitem(last=False)
+                self.memory_bytes -= evicted.size
+        return clip
+
+    def _load(self, key):
+        with self.lock:
+            if key not in self.disk:
+                return None
+            self.disk.move_to_end(key)
+
+        path = self.path(key)
+        try:
+            os.utime(path)
+            return Clip.load(path, self.clock_rate)
+        except (OSError, ValueError) as e:
+            logging.debug(f"Dropping unreadable prompt {path}: {e}")
+            with self.lock:
+                self.disk_bytes -= self.disk.pop(key, 0)
+            return None
+
+    def _touch(self, key):
+        """Mark a file used, so the LRU order on disk survives a restart."""
+        try:
+            os.utime(self.path(key))
+        except FileNotFoundError:
+            # Evicted since, the mapped clip still plays
+            pass
+
+    def _render(self, key, text):
+        # One espeak at a time, and a prompt wanted twice is rendered once
+        with self.render_lock:
+            clip = self._load(key)
+            if clip is not None:
+                return clip
+
+            start = time.monotonic()
+            pcm = self.render(text, self.clock_rate).tobytes()
+            self.render_time.observe(time.monotonic() - start)
+            self.misses.inc()
+
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(wav_header(self.clock_rate, len(pcm)))
+                f.write(pcm)
+            path = self.path(key)
+            os.replace(temp_path, path)
+
+            with self.lock:
+                size = WAV_HEADER + len(pcm)
+                self.disk[key] = size
+                self.disk_bytes += size
+                self._evict(keep=key)
+            logging.debug(f"Rendered prompt {text!r} in {time.monotonic() - start:.2f}s")
+            return Clip(pcm, self.clock_rate, path)
+
+    def _evict(self, keep):
+        """Delete the least recently used files until under quota. Holds lock."""
+        for key in list(self.disk):
+            if self.disk_bytes <= self.disk_quota:
+                break
+            if key == keep:
+                continue
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+            self.disk_bytes -= self.disk.pop(key)
+            self.evictions.inc()
+        self.disk_usage.set(self.disk_bytes)
+
+    def assemble(self, fragments, gap=FRAGMENT_GAP):
+        """One clip of fragments in order, with gap seconds between them."""
+        clips = [self.get(fragment) for fragment in fragments]
+        silence = bytes(2 * int(gap * self.clock_rate))
+        pcm = bytearray()
+        for index, clip in enumerate(clips):
+            if index:
+                pcm += silence
+            pcm += clip.pcm
+        return Clip(pcm, self.clock_rate)
+
+    def template(self, name, value):
+        """A templated prompt, e.g. template("time", datetime.now())."""
+        return self.assemble(TEMPLATES[name](value))
+
+    def warm(self, texts=None):
+        """Render texts, every template fragment by default, in a daemon thread."""
+        texts = template_fragments() if texts is None else texts
+
+        def render_all():
+            for text in texts:
+                try:
+                    self.get(text)
+                except (OSError, ValueError, subprocess.SubprocessError) as e:
+                    logging.warning(f"Couldn't render prompt {text!r}: {e}")
+                    return
+
+        threading.Thread(target=render_all, daemon=True).start()
+
+class ClipPort(pj.AudioMediaPort):
+    """Conference bridge port playing a clip from memory, then silence."""
+
+    def __init__(self, clip, ptime=20):
+        pj.AudioMediaPort.__init__(self)
+        self.clip = clip
+        self.frame_bytes = 2 * clip.clock_rate * ptime // 1000
+        self.ptime = ptime
+        self.position = 0
+        self.started = time.monotonic()
+
+        fmt = pj.MediaFormatAudio()
+        fmt.init(pj.PJMEDIA_FORMAT_PCM, clip.clock_rate, 1, ptime * 1000, 16)
+        self.createPort("prompt", fmt)
+
+    @property
+    def finished(self):
+        return self.position >= self.clip.size
+
+    def deadline(self):
+        # A frame late, so the last one has been served
+        return self.started + self.clip.duration + self.ptime / 1000
+
+    def onFrameRequested(self, frame):
+        # Called from the media thread every ptime
+        chunk = self.clip.pcm[self.position:self.position + self.frame_bytes]
+        self.position += self.frame_bytes
+        if len(chunk) < self.frame_bytes:
+            chunk = bytes(chunk) + bytes(self.frame_bytes - len(chunk))
+        frame.type = pj.PJMEDIA_FRAME_TYPE_AUDIO
+        frame.buf = pj.ByteVector(bytes(chunk))
+        frame.size = self.frame_bytes
+
+class PromptPlayer:
+    """Prompts playing into calls. Like all pjsua2 calls, use from the SIP thread."""
+
+    def __init__(self, ptime=20):
+        self.ptime = ptime
+        self.playing = []
+
+    def play(self, clip, media, owner=None):
+        """Start clip into an AudioMedia, e.g. a call's. Returns the port.
+
+        owner, such as the call id, lets stop() end the prompts of one call.
+        """
+        port = ClipPort(clip, self.ptime)
+        port.startTransmit(media)
+        self.playing.append((port, media, owner))
+        return port
+
+    def deadline(self):
+        """When the next prompt ends, for the dispatch loop's timeout."""
+        return min((port.deadline() for port, _, _ in self.playing), default=None)
+
+    def reap(self):
+        """Disconnect prompts that have finished playing."""
+        now = time.monotonic()
+        for port, _, _ in [entry for entry in self.playing if entry[0].finished or now >= entry[0].deadline()]:
+            self.stop(port=port)
+
+    def stop(self, port=None, owner=None):
+        """Stop prompts: all of them, the one on port, or those of owner."""
+        for entry in list(self.playing):
+            if (port is None or entry[0] is port) and (owner is None or entry[2] == owner):
+                try:
+                    entry[0].stopTransmit(entry[1])
+                except Exception as e:
+                    logging.debug(f"Prompt already disconnected: {e}")
+                self.playing.remove(entry)
@@ -0,0 +1,258 @@
+import struct
+import logging
+from collections import namedtuple
+from dial_plan import InterDigitTimer, AMBIGUOUS, COMPLETE, INVALID, PARTIAL_TIMEOUT
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+HIGH = 1
+LOW = 0
+
+# Rotary dials pulse at ~10 pps, so rising click edges closer together than
+# this are contact bounce rather than a new pulse
+MIN_PULSE_INTERVAL = 0.03
+
+# A digit is complete once no pulse has arrived for this long, even if the
+# stop edge was missed
+DIGIT_GAP = 0.3
+
+# Time after the last digit before the sequence is complete
+SEQUENCE_TIMEOUT = 2
+
+# One recorded edge: monotonic timestamp, pin, level
+TRACE_RECORD = struct.Struct("<dBB")
+
+DIGIT = "digit"
+SEQUENCE = "sequence"
+REJECTED = "rejected"
+
+Event = namedtuple("Event", ["kind", "value", "timestamp"])
+
+class PulseDecoder:
+    """Turns timestamped pin edges into digits using pulse timing.
+
+    The decoder never reads a clock: time only advances through edge
+    timestamps and explicit expire() calls, so recorded traces replay
+    exactly as they were decoded on the device.
+    """
+
+    def __init__(self, click_pin, stop_pin, min_pulse_interval=MIN_PULSE_INTERVAL, digit_gap=DIGIT_GAP):
+        self.click_pin = click_pin
+        self.stop_pin = stop_pin
+        self.min_pulse_interval = min_pulse_interval
+        self.digit_gap = digit_gap
+        self.clicks = 0
+        self.first_click = None
+        self.last_raw_click = None
+        self.last_click = None
+
+    def deadline(self):
+        """Time at which the pending digit completes if no edge arrives."""
+        if self.clicks:
+            return self.last_click + self.digit_gap
+        return None
+
+    def expire(self, now):
+        """Complete the pending digit if the inter-pulse gap has passed."""
+        if self.clicks and now - self.last_click > self.digit_gap:
+            return self.complete(self.last_click + self.digit_gap)
+        return []
+
+    def complete(self, timestamp):
+        clicks = self.clicks
+        self.clicks = 0
+
+        if clicks > 10:
+            logging.debug(f'Ignored {clicks}')
+            return []
+        return [(clicks % 10, self.first_click, timestamp)]
+
+    def feed(self, timestamp, pin, level):
+        """Feed one edge and return any (digit, started, ended) tuples it completes."""
+        digits = self.expire(timestamp)
+
+        if pin == self.click_pin and level == HIGH:
+            bounce = self.last_raw_click is not None and timestamp - self.last_raw_click < self.min_pulse_interval
+            self.last_raw_click = timestamp
+            if not bounce:
+                if not self.clicks:
+                    self.first_click = timestamp
+                self.clicks += 1
+                self.last_click = timestamp
+        elif pin == self.stop_pin and level == HIGH and self.clicks:
+            digits += self.complete(timestamp)
+
+        return digits
+
+class DialDecoder:
+    """Groups decoded digits into dial sequences.
+
+    Without a dial plan a sequence is complete once no new digit has started
+    within sequence_timeout of the last one. With a plan the sequence is sent
+    the moment it matches a rule, and the timeout only applies while the
+    match is still ambiguous or partial.
+    """
+
+    def __init__(self, click_pin, stop_pin, sequence_timeout=SEQUENCE_TIMEOUT, plan=None, timer=None, **kwargs):
+        self.pulses = PulseDecoder(click_pin, stop_pin, **kwargs)
+        self.sequence_timeout = sequence_timeout
+        self.plan = plan
+        self.timer = timer or InterDigitTimer()
+        self.sequence = ""
+        self.last_digit = None
+        self.match = None
+
+    def timeout(self):
+        if self.plan is None:
+            return self.sequence_timeout
+        if self.match[0] == AMBIGUOUS:
+            return self.timer.timeout()
+        return PARTIAL_TIMEOUT
+
+    def deadline(self):
+        # The sequence cannot time out while a digit is still being dialed
+        if self.pulses.clicks:
+            return self.pulses.deadline()
+        if self.sequence:
+            return self.last_digit + self.timeout()
+        return None
+
+    def _finish(self, timestamp):
+        if self.plan is None:
+            event = Event(SEQUENCE, self.sequence, timestamp)
+        else:
+            result, rule = self.match
+            if rule is not None:
+                logging.debug(f"Dial plan {result} {rule} for {self.sequence}")
+                event = Event(SEQUENCE, rule.destination(self.sequence), timestamp)
+            else:
+                event = Event(REJECTED, self.sequence, timestamp)
+
+        self.sequence = ""
+        self.match = None
+        return event
+
+    def _timeout(self, now):
+        if self.sequence and not self.pulses.clicks and now - self.last_digit > self.timeout():
+            return [self._finish(self.last_digit + self.timeout())]
+        return []
+
+    def _digits(self, digits):
+        events = []
+        for digit, started, timestamp in digits:
+            if self.sequence and self.plan is not None:
+                self.timer.observe(started - self.last_digit)
+
+            self.sequence += str(digit)
+            self.last_digit = timestamp
+            events.append(Event(DIGIT, digit, timestamp))
+
+            if self.plan is not None:
+                self.match = self.plan.match(self.sequence)
+                if self.match[0] in (COMPLETE, INVALID):
+                    events.append(self._finish(timestamp))
+
+        return events
+
+    def feed(self, timestamp, pin, level):
+        """Feed one edge and return the digit and sequence events it completes."""
+        events = self._digits(self.pulses.expire(timestamp))
+        events += self._timeout(timestamp)
+        events += self._digits(self.pulses.feed(timestamp, pin, level))
+        return events
+
+    def expire(self, now):
+        """Complete whatever has timed out by now."""
+        events = self._digits(self.pulses.expire(now))
+        events += self._timeout(now)
+        return events
+
+    def flush(self):
+        """Complete everything still pending, e.g. at the end of a trace."""
+        events = self._digits(self.pulses.complete(self.pulses.deadline()) if self.pulses.clicks else [])
+        if self.sequence:
+            events.append(self._finish(self.last_digit + self.timeout()))
+        return events
+
+def decode(edges, click_pin, stop_pin, **kwargs):
+    """Decode an iterable of (timestamp, pin, level) edges into dial sequences."""
+    decoder = DialDecoder(click_pin, stop_pin, **kwargs)
+    events = []
+    for edge in edges:
+        events += decoder.feed(*edge)
+    events += decoder.flush()
+    return [event.value for event in events if event.kind == SEQUENCE]
+
+class TraceRecorder:
+    """Appends raw edges to a binary trace file for offline replay."""
+
+    def __init__(self, path):
+        self.file = open(path, "ab")
+
+    def record(self, timestamp, pin, level):
+        self.file.write(TRACE_RECORD.pack(timestamp, pin, level))
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+def read_trace(path):
+    with open(path, "rb") as file:
+        data = file.read()
+    usable = len(data) - len(data) % TRACE_RECORD.size
+    return list(TRACE_RECORD.iter_unpack(data[:usable]))
+
+def load_trace(path):
+    """Load a trace as NumPy arrays (timestamps, pins, levels)."""
+    dtype = np.dtype([("timestamp", "<f8"), ("pin", "u1"), ("level", "u1")])
+    trace = np.fromfile(path, dtype=dtype)
+    return trace["timestamp"], trace["pin"], trace["level"]
+
+def decode_batch(timestamps, pins, levels, click_pin, stop_pin, min_pulse_interval=MIN_PULSE_INTERVAL, digit_gap=DIGIT_GAP):
+    """Vectorized equivalent of PulseDecoder over a whole trace.
+
+    Returns (digits, started, ended) arrays, matching what feeding the same
+    edges through PulseDecoder and flushing at the end would produce.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    pins = np.asarray(pins)
+    levels = np.asarray(levels)
+
+    rising = levels == HIGH
+    clicks = timestamps[rising & (pins == click_pin)]
+    stops = timestamps[rising & (pins == stop_pin)]
+
+    if len(clicks) == 0:
+        return np.empty(0, dtype=np.int64), clicks, clicks
+
+    # Debounce against the previous raw rising edge, as PulseDecoder does
+    keep = np.empty(len(clicks), dtype=bool)
+    keep[0] = True
+    keep[1:] = np.diff(clicks) >= min_pulse_interval
+    clicks = clicks[keep]
+
+    # A digit ends at a stop edge, or digit_gap after a click that is not
+    # followed by another click within digit_gap
+    gaps = np.append(np.diff(clicks), np.inf)
+    timeouts = clicks[gaps > digit_gap] + digit_gap
+    boundaries = np.union1d(stops, timeouts)
+
+    owner = np.searchsorted(boundaries, clicks, side="left")
+    counts = np.bincount(owner, minlength=len(boundaries))
+    first = np.minimum(np.searchsorted(owner, np.arange(len(boundaries))), len(clicks) - 1)
+
+    valid = (counts > 0) & (counts <= 10)
+    return counts[valid] % 10, clicks[first[valid]], boundaries[valid]
+
+def sequences_from_digits(digits, started, ended, sequence_timeout=SEQUENCE_TIMEOUT):
+    """Split batch-decoded digits into sequences on the inter-digit timeout."""
+    if len(digits) == 0:
+        return []
+
+    splits = np.flatnonzero(started[1:] - ended[:-1] > sequence_timeout) + 1
+    return ["".join(map(str, group)) for group in np.split(np.asarray(digits), splits)]
@@ -0,0 +1,99 @@
+import time
+import random
+import logging
+import threading
+import metrics
+from global_state import GlobalState, State
+
+# Retry delays after a failed registration, in seconds: doubled per failure
+# from the base up to the cap, with up to half of each delay random so a
+# fleet of phones doesn't hammer a registrar that just came back
+RETRY_BASE = 2
+RETRY_CAP = 300
+
+# Kernel TCP keepalive on the SIP transport, in seconds, so a dead registrar
+# connection is noticed between registration refreshes
+KEEPALIVE_IDLE = 30
+KEEPALIVE_INTERVAL = 10
+KEEPALIVE_COUNT = 3
+
+# Start of the device process, for time-to-register
+BOOTED = time.monotonic()
+
+def retry_delay(failures, base=RETRY_BASE, cap=RETRY_CAP):
+    delay = min(cap, base * 2 ** max(0, failures - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+class RegistrationMonitor:
+    """Tracks the account's registration and decides when to retry it.
+
+    The account reports each attempt with sent() and each outcome with
+    result(). Outcomes are published to GlobalState: REGISTERED_WITH_SIP,
+    REGISTRATION_EXPIRY, REGISTRATION_STATUS (the last SIP status code) and
+    REGISTRATION_RETRY (when the next retry is due, 0 if none). After a
+    failure the SIP thread calls retry_due() and renews the registration
+    itself; pjsua2's own fixed-interval retry should be turned off.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.booted = BOOTED
+        self.sent_at = None
+        self.failures = 0
+        self.retry_at = None
+        self.registered_once = False
+
+        self.round_trip = metrics.histogram("sip.registration_time")
+        self.time_to_register = metrics.gauge("sip.time_to_register")
+        self.failed = metrics.counter("sip.registration_failures")
+        self.status = metrics.gauge("sip.registration_status")
+
+    def sent(self, now=None):
+        with self.lock:
+            self.sent_at = time.monotonic() if now is None else now
+            self.retry_at = None
+
+    def result(self, code, reason, active, expires, now=None):
+        """Record the outcome of a registration or unregistration."""
+        now = time.monotonic() if now is None else now
+        registered = bool(active) and code // 100 == 2
+
+        with self.lock:
+            if self.sent_at is not None:
+                self.round_trip.observe(now - self.sent_at)
+                self.sent_at = None
+
+            if registered:
+                self.failures = 0
+                self.retry_at = None
+                if not self.registered_once:
+                    self.registered_once = True
+                    self.time_to_register.set(now - self.booted)
+            elif code // 100 != 2:
+                # A 2xx without an active registration is our own unregister
+                self.failures += 1
+                self.failed.inc()
+                self.retry_at = now + retry_delay(self.failures)
+
+            retry_at = self.retry_at
+            failures = self.failures
+
+        self.status.set(code)
+        if registered:
+            logging.debug(f"Registered: {code} {reason}, expires in {expires} s")
+        elif retry_at is not None:
+            logging.warning(f"Registration failed ({failures} in a row): {code} {reason}, retrying in {retry_at - now:.1f} s")
+
+        with GlobalState().transaction() as state:
+            state.set(State.REGISTERED_WITH_SIP, registered)
+            state.set(State.REGISTRATION_EXPIRY, time.time() + expires if registered else 0.0)
+            state.set(State.REGISTRATION_STATUS, code)
+            state.set(State.REGISTRATION_RETRY, time.time() + (retry_at - now) if retry_at is not None else 0.0)
+
+    def deadline(self):
+        """time.monotonic() of the next retry, or None."""
+        return self.retry_at
+
+    def retry_due(self, now=None):
+        now = time.monotonic() if now is None else now
+        return self.retry_at is not None and now >= self.retry_at
@@ -0,0 +1,114 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+import metrics
+from calls import RINGING, IN_PROGRESS
+from global_state import GlobalState, State
+
+# Seconds an incoming call may ring before it is turned away
+RING_TIMEOUT = 60
+
+# Temporarily Unavailable
+TIMEOUT_STATUS = 480
+
+class RingSupervisor:
+    """Owns every incoming call that is ringing but not answered yet.
+
+    onIncomingCall only hands the call over with offer(). The SIP thread
+    calls step() whenever the hook, call or pending state changes, or the
+    earliest deadline passes, so no thread exists per call. step() answers
+    the oldest call once the handset is lifted, forgets calls the caller
+    gave up on and rejects calls that rang for too long.
+    """
+
+    def __init__(self, registry, ring_timeout=RING_TIMEOUT):
+        self.registry = registry
+        self.ring_timeout = ring_timeout
+
+        # Call id -> deadline, oldest call first. Only ids are kept, the
+        # registry holds the call objects.
+        self.lock = threading.Lock()
+        self.pending = OrderedDict()
+
+        # The call last answered, until pjsua2 confirms or drops it; it
+        # stays RINGING in the registry until then
+        self.answering = None
+
+        self.timeouts = metrics.counter("ringing.timeouts")
+        self.abandoned = metrics.counter("ringing.abandoned")
+        self.answer_latency = metrics.histogram("ringing.answer_latency")
+
+    def __len__(self):
+        return len(self.pending)
+
+    def _publish(self):
+        GlobalState().set(State.PENDING_CALLS, len(self.pending))
+
+    def offer(self, call_id):
+        """Start supervising a ringing incoming call. Safe from any thread."""
+        with self.lock:
+            self.pending[call_id] = time.monotonic() + self.ring_timeout
+            self._publish()
+
+    def deadline(self):
+        """Earliest time.monotonic() at which step() has to run, or None."""
+        with self.lock:
+            return min(self.pending.values(), default=None)
+
+    def step(self, now=None):
+        """Answer, expire or forget pending calls. Call from the SIP thread only."""
+        globals = GlobalState()
+        now = time.monotonic() if now is None else now
+
+        with self.lock:
+            pending = list(self.pending.items())
+
+        finished = []
+        answer = None
+        for call_id, deadline in pending:
+            call = self.registry.get(call_id)
+            if call is None or self.registry.state(call_id) != RINGING:
+                # The caller hung up or the call was already dealt with
+                self.abandoned.inc()
+                finished.append(call_id)
+            elif now >= deadline:
+                logging.debug(f"Call {call_id} rang for {self.ring_timeout} s, rejecting")
+                self.timeouts.inc()
+                call.reject(TIMEOUT_STATUS)
+                finished.append(call_id)
+            elif answer is None:
+                answer = (call_id, call, deadline)
+
+        if self.answering is not None and self.registry.state(self.answering) != RINGING:
+            self.answering = None
+        in_call = self.answering is not None or globals.get(State.IN_CALL) or self.registry.in_state(*IN_PROGRESS)
+
+        # Lifting the handset picks up the oldest call, unless one is already
+        # up or being answered
+        if answer is not None and not globals.get(State.ON_THE_HOOK) and not in_call:
+            call_id, call, deadline = answer
+            call.accept()
+            self.answering = call_id
+            finished.append(call_id)
+
+            # From whichever came last, the call or the handset being lifted
+            offered = deadline - self.ring_timeout
+            lifted = globals.get_changed_at(State.ON_THE_HOOK) or offered
+            self.answer_latency.observe(time.monotonic() - max(lifted, offered))
+
+            with globals.transaction() as state:
+                state.set(State.IN_CALL, True)
+                state.set(State.CALL_START, time.time())
+
+        if not finished:
+            return
+
+        with self.lock:
+            for call_id in finished:
+                self.pending.pop(call_id, None)
+            self._publish()
+            ringing = bool(self.pending)
+
+        if not ringing:
+            globals.set(State.RINGING, False)
@@ -34,6 +34,9 @@ def ringer():
     GPIO.setup(RING2, GPIO.OUT, initial=GPIO.LOW)
     
     while True:
+        # Sleep until RINGING no longer matches whether the bell is running
+        globals.wait_for(State.RINGING, lambda ringing: bool(ringing) != (process is not None))
+
         if globals.get(State.RINGING) and process == None:
             process = Process(target=ringing)
             process.start()
@@ -44,8 +47,6 @@ def ringer():
             GPIO.output(RING2, GPIO.LOW)
             GPIO.output(RING1, GPIO.LOW)
 
-        time.sleep(0.5)
-
 if __name__ == '__main__':
     try:
         ringer()
@@ -6,6 +6,8 @@ from dialer import dialer
 from hook import hook
 from shared_memory import shared_memory
 from sip import sip
+from metrics import metrics
+from commands import commands
 
 GPIO.setwarnings(False)
 GPIO.setmode(GPIO.BOARD)
@@ -17,7 +19,9 @@ if __name__ == '__main__':
         threading.Thread(target=dialer, daemon=True),
         threading.Thread(target=hook, daemon=True),
         threading.Thread(target=shared_memory, daemon=True),
-        threading.Thread(target=sip, daemon=True)
+        threading.Thread(target=sip, daemon=True),
+        threading.Thread(target=metrics, daemon=True),
+        threading.Thread(target=commands, daemon=True)
     ]
 
     for thread in threads:
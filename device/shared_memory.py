@@ -1,73 +1,104 @@
 from multiprocessing.shared_memory import SharedMemory
-import struct
-import time
+import os
+import threading
 import sys
 import logging
 from global_state import GlobalState, State
 
-SHARED_MEMORY_SIZE = 5
-SHARED_MEMORY_NAME = "ringring"
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import shm_layout, shm_notify
+
+SHARED_MEMORY_NAME = shm_layout.SHARED_MEMORY_NAME
+
+# Which GlobalState key each shared memory field mirrors
+FIELD_STATES = {
+    "registeredWithSIP": State.REGISTERED_WITH_SIP,
+    "onTheHook": State.ON_THE_HOOK,
+    "callActive": State.CALL_ACTIVE,
+    "ringing": State.RINGING,
+    "busy": State.BUSY,
+    "callPeer": State.CALL_PEER,
+    "callStart": State.CALL_START,
+    "registrationExpiry": State.REGISTRATION_EXPIRY,
+    "callsIn": State.CALLS_IN,
+    "callsOut": State.CALLS_OUT,
+    "lastDialed": State.LAST_DIALED,
+    "callMos": State.CALL_MOS,
+    "callJitter": State.CALL_JITTER,
+    "callLoss": State.CALL_LOSS,
+    "callRtt": State.CALL_RTT,
+}
+
+# Safety net in case a change notification is ever missed
+POLL_INTERVAL = 10
 
 def build_shared_memory():
-    globals = GlobalState()
+    # One snapshot so the segment never mixes values from different updates
+    snapshot = GlobalState().snapshot()
+
+    values = shm_layout.defaults()
+    for name, key in FIELD_STATES.items():
+        value = snapshot.get(key)
+        if value is not None:
+            values[name] = value
+    return values
 
-    registered_with_sip = globals.get(State.REGISTERED_WITH_SIP) or False
-    call_active = globals.get(State.CALL_ACTIVE) or False
-    ringing = globals.get(State.RINGING) or False
-    on_the_hook = globals.get(State.ON_THE_HOOK) or False
-    busy = globals.get(State.BUSY) or False
+def create_shared_memory(writer, values):
+    try:
+        shm = SharedMemory(name=SHARED_MEMORY_NAME, create=True, size=shm_layout.SIZE)
+    except FileExistsError:
+        # Left behind by a previous run, possibly with an older schema
+        stale = SharedMemory(name=SHARED_MEMORY_NAME, create=False)
+        stale.close()
+        stale.unlink()
+        shm = SharedMemory(name=SHARED_MEMORY_NAME, create=True, size=shm_layout.SIZE)
 
-    # Pack the data into shared memory
-    return struct.pack("?" * SHARED_MEMORY_SIZE, registered_with_sip, on_the_hook, call_active, ringing, busy)
+    writer.initialize(shm.buf, values)
+    return shm
 
 def shared_memory():
     shm = None
     globals = GlobalState()
 
-    # Store previous to watch for changes
-    previous = None
+    # Fails if another process is already writing the segment
+    writer = shm_layout.Writer()
+
+    # Wake up as soon as any published state changes. The device is the
+    # only writer, the backend sends changes through the command mailbox
+    changed = threading.Event()
+    for key in FIELD_STATES.values():
+        globals.subscribe(key, lambda *args: changed.set())
+
+    # What was last published, so only changed fields are written
+    published = None
 
     try:
         while True:
             if shm is None:
                 # First time through, write out the global state
-                try:
-                    shm = SharedMemory(name=SHARED_MEMORY_NAME, create=True, size=SHARED_MEMORY_SIZE)
-                    previous = build_shared_memory()
-                    shm.buf[:SHARED_MEMORY_SIZE] = previous
-                except FileNotFoundError:
-                    # Do nothing
-                    pass
-
-            if shm is not None:
-                current_globals = build_shared_memory()
-                current_shared = bytes(shm.buf[:SHARED_MEMORY_SIZE])
-
-                if current_globals != previous:
-                    previous = build_shared_memory()
-                    shm.buf[:SHARED_MEMORY_SIZE] = previous
-                    logging.debug(f"Shared memory updated: {globals.get(State.REGISTERED_WITH_SIP)}, {globals.get(State.ON_THE_HOOK)}, {globals.get(State.CALL_ACTIVE)}, {globals.get(State.RINGING)}, {globals.get(State.BUSY)}")
-                elif current_shared != previous:
-                    current = struct.unpack("?" * SHARED_MEMORY_SIZE, current_shared)
-
-                    globals.set(State.REGISTERED_WITH_SIP, current[0])
-                    globals.set(State.ON_THE_HOOK, current[1])
-                    globals.set(State.CALL_ACTIVE, current[2])
-                    globals.set(State.RINGING, current[3])
-                    globals.set(State.BUSY, current[4])
-
-                    previous = current_shared
-                    logging.debug(f"Globals updated: {globals.get(State.REGISTERED_WITH_SIP)}, {globals.get(State.ON_THE_HOOK)}, {globals.get(State.CALL_ACTIVE)}, {globals.get(State.RINGING)}, {globals.get(State.BUSY)}")
-
-            time.sleep(1)
+                published = build_shared_memory()
+                shm = create_shared_memory(writer, published)
+                shm_notify.notify(shm_notify.BACKEND, shm_layout.read_sequence(shm.buf))
+
+            current = build_shared_memory()
+            updates = {name: value for name, value in current.items() if value != published[name]}
+            if updates:
+                sequence = writer.write(shm.buf, updates)
+                shm_notify.notify(shm_notify.BACKEND, sequence)
+                published = current
+                logging.debug(f"Shared memory updated: {updates}")
+
+            changed.wait(POLL_INTERVAL)
+            changed.clear()
     finally:
         if shm is not None:
             shm.close()
             shm.unlink()
+        writer.close()
 
 if __name__ == '__main__':
     try:
         shared_memory()
     except KeyboardInterrupt:
         print('Exiting...')
-        sys.exit(0)
\ No newline at end of file
+        sys.exit(0)
@@ -1,36 +1,173 @@
+import os
+import sys
 import time
+import socket
 import json
 import logging
 import threading
+from datetime import datetime
 import pjsua2 as pj
-from global_state import GlobalState, State
+import metrics
+import audio_device
+import media_profile
+import tones
+import prompts
+from calls import CallRegistry, RINGING, EARLY, CONFIRMED, HELD, DISCONNECTED, IN_PROGRESS
+from ring_supervisor import RingSupervisor
+from admission import AdmissionPolicy, ACCEPT, source_host
+from call_quality import QualitySampler
+from registration import RegistrationMonitor, KEEPALIVE_IDLE, KEEPALIVE_INTERVAL, KEEPALIVE_COUNT
+from global_state import GlobalState, State, Command, Tone
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import config_store
 
 CONFIG_PATH = "../config.json"
 PHONE_NUMBER = "phoneNumber"
 PASSWORD = "password"
 SIP_IP = "sipIP"
-AUDIO_DEVICE = 6
 
-calls = []
+registry = CallRegistry()
+supervisor = RingSupervisor(registry)
+admission = AdmissionPolicy()
+sampler = QualitySampler()
+
+def publish_quality(sample):
+    """Show the current call's newest quality sample in the status."""
+    with GlobalState().transaction() as state:
+        state.set(State.CALL_MOS, round(sample.mos, 2) if sample else 0.0)
+        state.set(State.CALL_JITTER, round(sample.jitter, 1) if sample else 0.0)
+        state.set(State.CALL_LOSS, round(sample.loss, 1) if sample else 0.0)
+        state.set(State.CALL_RTT, round(sample.rtt, 1) if sample else 0.0)
+
+def read_sip_config(data):
+    """Pick the SIP settings out of the config, raising KeyError if one is missing."""
+    return {
+        PHONE_NUMBER: data[PHONE_NUMBER],
+        PASSWORD: data[PASSWORD],
+        SIP_IP: data[SIP_IP]
+    }
+
+def account_config(config, transport_id):
+    acc_cfg = pj.AccountConfig()
+    acc_cfg.idUri = f"sip:{config[PHONE_NUMBER]}@{config[SIP_IP]}:5060;transport=tcp"
+    acc_cfg.regConfig.registrarUri = f"sip:{config[SIP_IP]}"
+    acc_cfg.sipConfig.authCreds.append(pj.AuthCredInfo("digest", "*", config[PHONE_NUMBER], 0, config[PASSWORD]))
+    acc_cfg.sipConfig.transportId = transport_id
+
+    # RegistrationMonitor retries with backoff instead of pjsua2's fixed interval
+    acc_cfg.regConfig.retryIntervalSec = 0
+    return acc_cfg
+
+def create_endpoint(null_audio=False, audio_pattern=audio_device.DEFAULT_PATTERN, profile=media_profile.PROFILES[media_profile.DEFAULT_PROFILE],
+                    jitter_buffer=media_profile.JITTER_BUFFERS[media_profile.DEFAULT_JITTER_BUFFER],
+                    echo=media_profile.ECHO_CANCELLERS[media_profile.DEFAULT_ECHO_CANCELLER]):
+    """Create, initialize and return the endpoint, with audio on the matching sound card."""
+    ep = pj.Endpoint()
+    ep.libCreate()
+
+    # Configure and initialize the endpoint
+    ep_cfg = pj.EpConfig()
+    ep_cfg.logConfig.level = 1
+    media_profile.apply_media_config(ep_cfg.medConfig, profile, jitter_buffer, echo)
+
+    ep.libInit(ep_cfg)
+    codecs = media_profile.apply_codec_priorities(ep, profile)
+    print(f"Media profile {profile.name}: bridge at {profile.clock_rate} Hz, codecs {', '.join(codecs)}")
+    print(f"Jitter buffer {jitter_buffer}, echo canceller {echo}")
+
+    if null_audio:
+        ep.audDevManager().setNullDev()
+    else:
+        audio_device.bind(ep.audDevManager(), audio_pattern)
+
+    return ep
+
+def create_transport(ep, port=5060):
+    """Create the TCP transport, with kernel keepalives where pjsua2 supports them."""
+    sip_transport_cfg = pj.TransportConfig()
+    sip_transport_cfg.port = port
+
+    if hasattr(sip_transport_cfg, "sockOptParams") and hasattr(socket, "TCP_KEEPIDLE"):
+        for level, name, value in (
+            (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+            (socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, KEEPALIVE_IDLE),
+            (socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, KEEPALIVE_INTERVAL),
+            (socket.IPPROTO_TCP, socket.TCP_KEEPCNT, KEEPALIVE_COUNT),
+        ):
+            # optVal is a void* in pjsua2, so the int has to go in through
+            # the typed constructor, which also sets optLen
+            sip_transport_cfg.sockOptParams.sockOpts.append(pj.SockOpt(level, name, value))
+
+    return ep.transportCreate(pj.PJSIP_TRANSPORT_TCP, sip_transport_cfg)
 
 class MyCall(pj.Call):
-    def __init__(self, acc, call_id, endpoint):
+    def __init__(self, acc, call_id, endpoint, outgoing=False):
         pj.Call.__init__(self, acc, call_id)
         self.endpoint = endpoint
+        self.terminating = False
+        self.media_index = None
+        self.early_media = False
+
+        # An outgoing call has no id until makeCall() assigns one
+        self.placing = outgoing
+        self.registered_id = None
+
+    def add_to_registry(self, call_id):
+        """Add an outgoing call to the registry the first time its id is known."""
+        if self.placing:
+            self.placing = False
+            self.registered_id = call_id
+            registry.add(call_id, self, EARLY)
 
     def onCallState(self, prm):
         call_info = self.getInfo()
-        if call_info.state == pj.PJSIP_INV_STATE_DISCONNECTED:
+        # pjsua2 reports CALLING from inside makeCall(), so the call is
+        # registered before any later state change can arrive
+        self.add_to_registry(call_info.id)
+        if call_info.state == pj.PJSIP_INV_STATE_CONFIRMED:
+            registry.transition(call_info.id, CONFIRMED)
+            with GlobalState().transaction() as state:
+                state.set(State.IN_CALL, True)
+                if not state.get(State.CALL_START):
+                    state.set(State.CALL_START, time.time())
+        elif call_info.state == pj.PJSIP_INV_STATE_DISCONNECTED:
             logging.debug("Call disconnected")
-            self.terminate()
-            GlobalState().set(State.IN_CALL, False)
-            GlobalState().set(State.RINGING, False)
+            previous_state = registry.state(call_info.id)
+            registry.transition(call_info.id, DISCONNECTED)
+
+            # Busy or reorder for a call that failed or was hung up at the far end
+            globals = GlobalState()
+            if not self.terminating and not globals.get(State.ON_THE_HOOK):
+                tone = tones.failure_tone(previous_state, call_info.lastStatusCode)
+                if tone:
+                    globals.set(State.PROGRESS_TONE, tone)
+
+            # Another call may still be up, e.g. when a second INVITE was turned away
+            if not registry.in_state(RINGING, *IN_PROGRESS):
+                with GlobalState().transaction() as state:
+                    state.set(State.IN_CALL, False)
+                    state.set(State.RINGING, False)
+                    state.set(State.CALL_PEER, "")
+                    state.set(State.CALL_START, 0.0)
+
+            # The call object can't be freed inside its own callback
+            GlobalState().addCommand(Command.RELEASE_CALLS)
 
     def onCallMediaState(self, prm):
         call_info = self.getInfo()
         for mi in call_info.media:
-            if mi.type == pj.PJMEDIA_TYPE_AUDIO and mi.status == pj.PJSUA_CALL_MEDIA_ACTIVE:
+            if mi.type == pj.PJMEDIA_TYPE_AUDIO and mi.status in (pj.PJSUA_CALL_MEDIA_LOCAL_HOLD, pj.PJSUA_CALL_MEDIA_REMOTE_HOLD):
+                registry.transition(call_info.id, HELD)
+            elif mi.type == pj.PJMEDIA_TYPE_AUDIO and mi.status == pj.PJSUA_CALL_MEDIA_ACTIVE:
                 logging.debug("Call connected")
+                self.media_index = mi.index
+                if registry.state(call_info.id) == EARLY:
+                    # The far end plays its own ringback or announcement
+                    self.early_media = True
+                    GlobalState().addCommand(Command.UPDATE_TONE)
+                if registry.state(call_info.id) == HELD:
+                    registry.transition(call_info.id, CONFIRMED)
                 m = self.getMedia(mi.index)
                 am = pj.AudioMedia.typecastFromMedia(m)
 
@@ -44,7 +181,21 @@ class MyCall(pj.Call):
                 except Exception as e:
                     print(f"Error connecting to USB sound card: {e}")
 
+    def accept(self):
+        call_prm = pj.CallOpParam()
+        call_prm.statusCode = 200
+        self.answer(call_prm)
+
+    def reject(self, status_code):
+        self.terminating = True
+        call_prm = pj.CallOpParam()
+        call_prm.statusCode = status_code
+        self.hangup(call_prm)
+
     def terminate(self):
+        if self.terminating:
+            return
+        self.terminating = True
         call_prm = pj.CallOpParam()
         call_prm.statusCode = 200
         self.hangup(call_prm)
@@ -54,42 +205,75 @@ class MyAccount(pj.Account):
         pj.Account.__init__(self)
         self.endpoint = endpoint
 
+        self.monitor = RegistrationMonitor()
+
+    def register(self, acc_cfg, modify=False):
+        """Create the account, or apply new settings to it and re-register."""
+        self.monitor.sent()
+        if modify:
+            self.modify(acc_cfg)
+        else:
+            self.create(acc_cfg)
+
+    def renew(self):
+        self.monitor.sent()
+        self.setRegistration(True)
+
+    def onRegState(self, prm):
+        info = self.getInfo()
+        self.monitor.result(prm.code, prm.reason, info.regIsActive, info.regExpiresSec)
+
     def onIncomingCall(self, prm):
         logging.debug(f"Incoming call {prm.callId}")
         globals = GlobalState()
-
         call = MyCall(self, prm.callId, self.endpoint)
+
+        # Turn the call away before it rings if the phone can't take it
+        status = admission.check(
+            source_host(prm.rdata.srcAddress),
+            busy=globals.get(State.BUSY),
+            in_call=globals.get(State.IN_CALL) or bool(registry.in_state(*IN_PROGRESS)),
+            pending=len(supervisor)
+        )
+        if status is not ACCEPT:
+            logging.debug(f"Rejecting call {prm.callId} from {prm.rdata.srcAddress} with {status}")
+            # Listed so the object is released like any other disconnected call
+            registry.add(prm.callId, call, RINGING)
+            call.reject(status)
+            return
+
         call_prm = pj.CallOpParam()
         call_prm.statusCode = 180
         call.answer(call_prm)
-        calls.append(call)
-
-        globals.set(State.RINGING, True)
-
-        def ringing():
-            while globals.get(State.ON_THE_HOOK):
-                time.sleep(0.01)
+        registry.add(prm.callId, call, RINGING)
 
-            globals.set(State.RINGING, False)
-            globals.set(State.IN_CALL, True)
+        with globals.transaction() as state:
+            state.set(State.RINGING, True)
+            state.set(State.CALL_PEER, call.getInfo().remoteUri)
+            state.set(State.CALLS_IN, (state.get(State.CALLS_IN) or 0) + 1)
 
-            call_prm.statusCode = 200
-            call.answer(call_prm)
-        
-        thread = threading.Thread(target=ringing)
-        thread.start()
+        # The SIP thread answers it once the handset is lifted
+        supervisor.offer(prm.callId)
 
     def makeCall(self, dest_uri):
         logging.debug(f"makeCall: {dest_uri}")
+        # A new attempt replaces the last one's busy or reorder
+        GlobalState().set(State.PROGRESS_TONE, None)
+        call = MyCall(self, pj.PJSUA_INVALID_ID, self.endpoint, outgoing=True)
         try:
             call_prm = pj.CallOpParam()
-            call = MyCall(self, pj.PJSUA_INVALID_ID, self.endpoint)
             call.makeCall(dest_uri, call_prm)
+            call.add_to_registry(call.getId())
             print(f"Call initiated to {dest_uri}")
 
-            calls.append(call)
+            with GlobalState().transaction() as state:
+                state.set(State.CALL_PEER, dest_uri)
+                state.set(State.CALLS_OUT, (state.get(State.CALLS_OUT) or 0) + 1)
         except Exception as e:
             print(f"Error making call: {e}")
+            if call.registered_id is not None:
+                registry.transition(call.registered_id, DISCONNECTED)
+            GlobalState().set(State.PROGRESS_TONE, Tone.REORDER)
 
 def sip():
     config = {
@@ -98,75 +282,173 @@ def sip():
         SIP_IP: ""
     }
 
+    # Wait for usable settings, woken as soon as the file changes
+    store = config_store.get_store(CONFIG_PATH)
+    changed = threading.Event()
+    store.subscribe(lambda data: changed.set())
+
     while True:
         try:
-            with open(CONFIG_PATH, "r") as file:
-                data = json.load(file)
+            config.update(read_sip_config(store.get()))
             print("Config file loaded successfully!")
-            config[PHONE_NUMBER] = data[PHONE_NUMBER]
-            config[PASSWORD] = data[PASSWORD]
-            config[SIP_IP] = data[SIP_IP]
             break
-        except FileNotFoundError:
-            print(f"File {CONFIG_PATH} not found. Retrying in 5 seconds...")
+        except KeyError as e:
+            print(f"File {CONFIG_PATH} is missing {e}. Waiting for it to change...")
         except json.JSONDecodeError:
-            print(f"File {CONFIG_PATH} is not a valid JSON file. Retrying in 5 seconds...")
+            print(f"File {CONFIG_PATH} is not a valid JSON file. Waiting for it to change...")
         except Exception as e:
             print(f"An unexpected error occurred: {e}. Retrying in 5 seconds...")
 
-        time.sleep(5)
+        changed.wait(5)
+        changed.clear()
 
     # Initialize the library
-    ep = pj.Endpoint()
-    ep.libCreate()
-
-    # Configure and initialize the endpoint
-    ep_cfg = pj.EpConfig()
-    ep_cfg.logConfig.level = 1
-
-    media_cfg = pj.MediaConfig()
-    media_cfg.clockRate = 44100  # Match sound card sample rate
-    media_cfg.channelCount = 1   # Mono
-    media_cfg.audioFramePtime = 20  # 20 ms frame time (common for VoIP)
-    media_cfg.sndClockRate = 44100  # Align sound device clock rate
-    ep.mediaConfig = media_cfg
-
-    ep.libInit(ep_cfg)
+    data = store.get()
+    audio_pattern = data.get(audio_device.AUDIO_DEVICE, audio_device.DEFAULT_PATTERN)
+    profile = media_profile.get_profile(data)
+    ep = create_endpoint(audio_pattern=audio_pattern, profile=profile,
+                         jitter_buffer=media_profile.get_jitter_buffer(data), echo=media_profile.get_echo_canceller(data))
+    tcp_transport_id = create_transport(ep)
 
-    # Set USB sound card as default (replace dev_id with your USB sound card ID)
-    ep.audDevManager().setCaptureDev(AUDIO_DEVICE)
-    ep.audDevManager().setPlaybackDev(AUDIO_DEVICE)
+    # Connected once, the playback device port stays put across rebinds
+    tone_engine = tones.ToneEngine(profile.clock_rate, tones.get_country(data))
+    tone_engine.connect(ep.audDevManager().getPlaybackDevMedia())
 
-    sip_transport_cfg = pj.TransportConfig()
-    sip_transport_cfg.port = 5060
-    tcp_transport_id = ep.transportCreate(pj.PJSIP_TRANSPORT_TCP, sip_transport_cfg)
+    # Announcements, rendered ahead of time so playing one never waits on espeak
+    prompt_cache = prompts.PromptCache(profile.clock_rate)
+    prompt_player = prompts.PromptPlayer(profile.ptime)
+    speaking_clock = prompts.speaking_clock_number(data)
+    if speaking_clock:
+        prompt_cache.warm()
 
     # Start SIP endpoint
     ep.libStart()
 
-    # Configure account
-    acc_cfg = pj.AccountConfig()
-    acc_cfg.idUri = f"sip:{config[PHONE_NUMBER]}@{config[SIP_IP]}:5060;transport=tcp"
-    acc_cfg.regConfig.registrarUri = f"sip:{config[SIP_IP]}"
-    acc_cfg.sipConfig.authCreds.append(pj.AuthCredInfo("digest", "*", config[PHONE_NUMBER], 0, config[PASSWORD]))
-    acc_cfg.sipConfig.transportId = tcp_transport_id
-
     # Create account
     account = MyAccount(ep)
-    account.create(acc_cfg)
-    
+    account.register(account_config(config, tcp_transport_id))
+
     globals = GlobalState()
+
+    # New credentials are applied to the live account, the endpoint, audio
+    # devices and transport stay up. pjsua2 calls must come from this
+    # thread, so the watcher only queues a command.
+    def on_config(data):
+        nonlocal speaking_clock
+        if data.get(audio_device.AUDIO_DEVICE, audio_device.DEFAULT_PATTERN) != audio_pattern:
+            globals.addCommand(Command.RESCAN_AUDIO)
+        country = tones.get_country(data)
+        if country != tone_engine.country:
+            tone_engine.set_country(country)
+        # The prompt set is fixed, so only a new number needs warming
+        number = prompts.speaking_clock_number(data)
+        if number != speaking_clock:
+            speaking_clock = number
+            if number:
+                prompt_cache.warm()
+        try:
+            if read_sip_config(data) != config:
+                globals.addCommand(Command.RELOAD_CONFIG)
+        except KeyError:
+            pass
+
+    store.subscribe(on_config)
+
+    # Rebind capture and playback when a sound card comes or goes, the
+    # endpoint keeps running
+    audio_device.watch_hotplug(lambda: globals.addCommand(Command.RESCAN_AUDIO))
+    reload_pending = False
+    hangup_latency = metrics.histogram("sip.hangup_latency")
+
+    # Sleep until a command arrives, the hook, dialing, call, ringing or
+    # registration state changes, or a ringing call, retry, tone or prompt
+    # is due
+    wake_keys = [State.ON_THE_HOOK, State.DIALING, State.PROGRESS_TONE, State.IN_CALL, State.PENDING_CALLS, State.REGISTRATION_RETRY]
+    version = globals.get_version()
     while True:
-        command = globals.getCommand()
-        if command != None:
-            if not globals.get(State.ON_THE_HOOK) and len(command) == 4:
+        deadlines = [deadline for deadline in (supervisor.deadline(), account.monitor.deadline(), sampler.deadline(), tone_engine.deadline(), prompt_player.deadline()) if deadline is not None]
+        timeout = max(0, min(deadlines) - time.monotonic()) if deadlines else None
+        command, version = globals.wait_for_command(wake_keys, version, timeout)
+        if command == Command.HANGUP:
+            for call in registry.in_state(*IN_PROGRESS):
+                try:
+                    call.terminate()
+                except Exception as e:
+                    print(f"Error hanging up call: {e}")
+        elif command == Command.RELEASE_CALLS:
+            registry.release()
+        elif command == Command.RELOAD_CONFIG:
+            reload_pending = True
+        elif command == Command.RESCAN_AUDIO:
+            try:
+                audio_pattern = store.get().get(audio_device.AUDIO_DEVICE, audio_device.DEFAULT_PATTERN)
+                audio_device.bind(ep.audDevManager(), audio_pattern, rescan=True)
+            except Exception as e:
+                print(f"Error rebinding audio device: {e}")
+        elif command == Command.UPDATE_TONE:
+            pass  # The tone engine runs every time round
+        elif command != None:
+            if globals.get(State.ON_THE_HOOK):
+                pass
+            elif command == speaking_clock:
+                try:
+                    clip = prompt_cache.template("time", datetime.now())
+                    prompt_player.play(clip, ep.audDevManager().getPlaybackDevMedia(), owner=prompts.HANDSET)
+                except Exception as e:
+                    print(f"Error playing the time: {e}")
+            else:
+                globals.set(State.LAST_DIALED, command)
                 account.makeCall(f"sip:{command}@{config[SIP_IP]}:5060;transport=tcp")
 
-        if globals.get(State.ON_THE_HOOK) and globals.get(State.IN_CALL):
-            calls[0].terminate()
-            calls.pop()
+        in_progress = [call for call in registry.in_state(*IN_PROGRESS) if not call.terminating]
+        if globals.get(State.ON_THE_HOOK) and in_progress:
+            for call in in_progress:
+                try:
+                    call.terminate()
+                except Exception as e:
+                    print(f"Error hanging up call: {e}")
+            hangup_latency.observe(time.monotonic() - globals.get_changed_at(State.ON_THE_HOOK))
+
+        # Hanging up cuts off the handset's prompts, finished ones are let go
+        if globals.get(State.ON_THE_HOOK):
+            prompt_player.stop(owner=prompts.HANDSET)
+        prompt_player.reap()
+
+        supervisor.step()
+
+        try:
+            tone_engine.update(registry)
+        except Exception as e:
+            print(f"Error playing tone: {e}")
+
+        # Sample stream quality while calls are up, and once more after the
+        # last one ends to clear it
+        if registry.in_state(CONFIRMED, HELD):
+            sampler.start()
+        deadline = sampler.deadline()
+        if deadline is not None and time.monotonic() >= deadline:
+            streams = {call.getId(): (call, call.media_index) for call in registry.in_state(CONFIRMED, HELD) if call.media_index is not None}
+            publish_quality(sampler.sample(streams))
+
+        if account.monitor.retry_due():
+            try:
+                account.renew()
+            except Exception as e:
+                print(f"Error renewing registration: {e}")
 
-        time.sleep(0.01)
+        # Re-registering mid-call could drop it, so wait for the call to end
+        if reload_pending and not globals.get(State.IN_CALL):
+            reload_pending = False
+            try:
+                new_config = read_sip_config(store.get())
+                if new_config != config:
+                    config.update(new_config)
+                    account.register(account_config(config, tcp_transport_id), modify=True)
+                    print(f"Re-registering as {config[PHONE_NUMBER]} with {config[SIP_IP]}")
+            except (KeyError, ValueError) as e:
+                print(f"Ignoring incomplete config change: {e}")
+            except Exception as e:
+                print(f"Error re-registering: {e}")
 
 if __name__ == "__main__":
     try:
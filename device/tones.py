@@ -0,0 +1,207 @@
+"""Call-progress tones: dial tone, ringback, busy and reorder.
+
+One pjsua2 ToneGenerator stays connected to the sound card from startup,
+and the tone descriptions for every tone are built once per country, so
+starting a tone is a single play() on the conference bridge. The SIP
+thread calls update() whenever the hook, dialing or call state changes
+and the engine works out what the handset should hear:
+
+    on the hook, or a call up or being answered   silence
+    a call attempt failed                         busy or reorder
+    outgoing call, no early media yet             ringback
+    dialing                                       silence
+    off the hook                                  dial tone, reorder after DIAL_TONE_TIMEOUT
+
+The country comes from "toneCountry" in config.json.
+"""
+import time
+import logging
+import pjsua2 as pj
+import metrics
+from calls import RINGING, EARLY, CONFIRMED, HELD
+from global_state import GlobalState, State, Tone
+
+# Config key
+TONE_COUNTRY = "toneCountry"
+DEFAULT_COUNTRY = "us"
+
+# Off the hook this long without dialing and the dial tone turns to reorder
+DIAL_TONE_TIMEOUT = 30
+
+# Hook edge to dial tone, in seconds
+START_LATENCY_TARGET = 0.05
+
+# pjmedia fades every tone in and out, so a continuous tone is one long
+# tone that repeats, as long as on_msec allows
+CONTINUOUS = 30000
+
+# Each tone is a cadence of (frequency 1, frequency 2, on ms, off ms)
+# steps that repeats. Frequency 2 of 0 is a single frequency.
+COUNTRIES = {
+    "us": {
+        Tone.DIAL: [(350, 440, CONTINUOUS, 0)],
+        Tone.RINGBACK: [(440, 480, 2000, 4000)],
+        Tone.BUSY: [(480, 620, 500, 500)],
+        Tone.REORDER: [(480, 620, 250, 250)],
+    },
+    "uk": {
+        Tone.DIAL: [(350, 450, CONTINUOUS, 0)],
+        Tone.RINGBACK: [(400, 450, 400, 200), (400, 450, 400, 2000)],
+        Tone.BUSY: [(400, 0, 375, 375)],
+        Tone.REORDER: [(400, 0, 400, 350), (400, 0, 225, 525)],
+    },
+    "de": {
+        Tone.DIAL: [(425, 0, CONTINUOUS, 0)],
+        Tone.RINGBACK: [(425, 0, 1000, 4000)],
+        Tone.BUSY: [(425, 0, 480, 480)],
+        Tone.REORDER: [(425, 0, 240, 240)],
+    },
+    "fr": {
+        Tone.DIAL: [(440, 0, CONTINUOUS, 0)],
+        Tone.RINGBACK: [(440, 0, 1500, 3500)],
+        Tone.BUSY: [(440, 0, 500, 500)],
+        Tone.REORDER: [(440, 0, 250, 250)],
+    },
+    "au": {
+        Tone.DIAL: [(413, 438, CONTINUOUS, 0)],
+        Tone.RINGBACK: [(413, 438, 400, 200), (413, 438, 400, 2000)],
+        Tone.BUSY: [(425, 0, 375, 375)],
+        Tone.REORDER: [(425, 0, 375, 375)],
+    },
+    "jp": {
+        Tone.DIAL: [(400, 0, CONTINUOUS, 0)],
+        Tone.RINGBACK: [(384, 416, 1000, 2000)],
+        Tone.BUSY: [(400, 0, 500, 500)],
+        Tone.REORDER: [(400, 0, 500, 500)],
+    },
+}
+
+# Final responses that mean the other end is busy rather than unreachable
+BUSY_STATUS = (486, 600, 603)
+
+# We cancelled the INVITE ourselves
+CANCELLED_STATUS = 487
+
+def get_country(config):
+    """The tone country named in config, or the default one."""
+    country = config.get(TONE_COUNTRY, DEFAULT_COUNTRY)
+    if country not in COUNTRIES:
+        print(f"Unknown tone country {country!r}, using {DEFAULT_COUNTRY}")
+        country = DEFAULT_COUNTRY
+    return country
+
+def failure_tone(previous_state, status_code):
+    """Tone for a call that ended on its own while the handset is off the hook."""
+    if previous_state == EARLY:
+        if status_code == CANCELLED_STATUS:
+            return None
+        return Tone.BUSY if status_code in BUSY_STATUS else Tone.REORDER
+    if previous_state in (CONFIRMED, HELD):
+        # The other end hung up
+        return Tone.BUSY
+    return None
+
+def select(on_hook, connected, result, ringing_out, early_media, dialing, off_hook_for):
+    """The tone the handset should hear, or None for silence."""
+    if on_hook or connected:
+        return None
+    if result:
+        return result
+    if ringing_out:
+        # With early media the far end sends its own ringback or announcement
+        return None if early_media else Tone.RINGBACK
+    if dialing:
+        return None
+    if off_hook_for >= DIAL_TONE_TIMEOUT:
+        return Tone.REORDER
+    return Tone.DIAL
+
+def tone_descriptions(cadence):
+    descriptions = pj.ToneDescVector()
+    for freq1, freq2, on_msec, off_msec in cadence:
+        description = pj.ToneDesc()
+        description.freq1 = freq1
+        description.freq2 = freq2
+        description.on_msec = on_msec
+        description.off_msec = off_msec
+        description.volume = 0  # pjmedia's default level
+        description.flags = 0
+        descriptions.append(description)
+    return descriptions
+
+class ToneEngine:
+    """Plays the call-progress tone for the current state. Use from the SIP thread."""
+
+    def __init__(self, clock_rate, country=DEFAULT_COUNTRY):
+        self.generator = pj.ToneGenerator()
+        self.generator.createToneGenerator(clock_rate, 1)
+        self.set_country(country)
+        self.current = None
+
+        self.start_latency = metrics.histogram("tones.start_latency")
+        self.stop_latency = metrics.histogram("tones.stop_latency")
+        self.started = metrics.counter("tones.started")
+
+    def set_country(self, country):
+        """Build the tones for country. Swapping the dict is atomic, so any thread may call this."""
+        self.tones = {tone: tone_descriptions(cadence) for tone, cadence in COUNTRIES[country].items()}
+        self.country = country
+
+    def connect(self, media):
+        """Send the tones to media, normally the playback device."""
+        self.generator.startTransmit(media)
+
+    def deadline(self):
+        """When the dial tone times out, for the dispatch loop's timeout."""
+        if self.current != Tone.DIAL:
+            return None
+        lifted = GlobalState().get_changed_at(State.ON_THE_HOOK)
+        return lifted + DIAL_TONE_TIMEOUT if lifted is not None else None
+
+    def play(self, tone):
+        """Switch to tone, None for silence. Returns True if it changed."""
+        if tone == self.current:
+            return False
+        if tone is None:
+            self.generator.stop()
+        else:
+            self.generator.play(self.tones[tone], True)
+            self.started.inc()
+        logging.debug(f"Tone {self.current} -> {tone}")
+        self.current = tone
+        return True
+
+    def update(self, registry):
+        """Play what the handset should hear, given the hook and the calls in registry."""
+        globals = GlobalState()
+        state = globals.snapshot()
+        on_hook = state.get(State.ON_THE_HOOK)
+        lifted = globals.get_changed_at(State.ON_THE_HOOK)
+        now = time.monotonic()
+        early = registry.in_state(EARLY)
+        tone = select(
+            on_hook,
+            connected=bool(registry.in_state(RINGING, CONFIRMED, HELD)),
+            result=state.get(State.PROGRESS_TONE),
+            ringing_out=bool(early),
+            early_media=any(call.early_media for call in early),
+            dialing=state.get(State.DIALING),
+            off_hook_for=now - lifted if lifted is not None else 0
+        )
+
+        previous = self.current
+        if not self.play(tone):
+            return
+
+        # Measured to when the tone is queued on the bridge, it is heard
+        # within a frame plus the sound card's output latency
+        done = time.monotonic()
+        # From the off-hook GPIO edge, so the hop through the hook thread counts
+        edge_at = state.get(State.LIFTED_AT) or lifted
+        if tone == Tone.DIAL and previous is None and edge_at is not None:
+            latency = done - edge_at
+            self.start_latency.observe(latency)
+            if latency > START_LATENCY_TARGET:
+                logging.warning(f"Dial tone started {latency * 1000:.0f} ms after the handset was lifted")
+        elif previous == Tone.DIAL and tone is None and state.get(State.DIALING):
+            self.stop_latency.observe(done - globals.get_changed_at(State.DIALING))
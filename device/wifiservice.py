@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import os
+import sys
 import json
 import dbus
 import dbus.mainloop.glib
@@ -21,6 +22,11 @@ GATT_MANAGER_IFACE = "org.bluez.GattManager1"
 GATT_SERVICE_IFACE = "org.bluez.GattService1"
 GATT_CHRC_IFACE = "org.bluez.GattCharacteristic1"
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import config_store
+
+CONFIG_FILE_PATH = "./ringring.conf"
+
 mainloop = None
 
 class Application(dbus.service.Object):
@@ -254,26 +260,9 @@ class WifiService(Service):
                 self.tcp_thread.join(timeout=2.0)
 
     def update_config_file(self, new_data):
-        config_file_path = './ringring.conf'
-        config_data = {}
-
-        # Check if the config file exists
-        if os.path.exists(config_file_path):
-            with open(config_file_path, 'r') as f:
-                try:
-                    config_data = json.load(f)
-                except json.JSONDecodeError:
-                    print("Failed to decode existing JSON config file. Starting fresh.")
-
-        print(f"Config data: {config_data}")
-
-        # Update the config data with new fields
-        config_data.update(new_data)
-
-        # Write the updated config data back to the file
-        with open(config_file_path, 'w') as f:
-            json.dump(config_data, f, indent=4)
-            print(f"Updated configuration written to {config_file_path}")
+        # Merged and replaced atomically, bursts of writes share one fsync
+        config_data = config_store.get_store(CONFIG_FILE_PATH).update(new_data)
+        print(f"Updated configuration written to {CONFIG_FILE_PATH}: {config_data}")
 
     def check_and_write_config(self):
         # Get values from all characteristics
@@ -1,13 +1,17 @@
 import pjsua2 as pj
-import pyttsx3
 import time
-import tempfile
 import os
+import sys
 from datetime import datetime
-from pydub import AudioSegment
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "device"))
+from prompts import PromptCache, ClipPort
 
 calls = []
 
+# The bridge runs at pjsua2's default 16 kHz
+prompt_cache = PromptCache(16000)
+
 class MyCall(pj.Call):
     def __init__(self, account, call_id=pj.PJSUA_INVALID_ID):
         pj.Call.__init__(self, account, call_id)
@@ -41,70 +45,24 @@ class MyCall(pj.Call):
                 print(f"**** RTP audio at port: {port_info.portId}, name: {port_info.name}")
 
     def send_time_message(self):
-        # Generate the current time message using pyttsx3
-        engine = pyttsx3.init(driverName='espeak')
-        engine.setProperty('rate', 100)
-        current_time = datetime.now().strftime("%H:%M")
-        message = f"The current time is {current_time}"
+        # The fragments are rendered once and cached in ../prompts
+        try:
+            clip = prompt_cache.template("time", datetime.now())
+            print(f"Audio duration: {clip.duration * 1000:.0f} ms")
 
-        # Create a temporary file for the WAV output
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_wav_file:
-            temp_file_path = temp_wav_file.name
+            # Play the prompt from memory into the call's media
+            call_media = self.getAudioMedia(0)  # Use the first media stream (index 0)
+            port = ClipPort(clip)
+            port.startTransmit(call_media)
 
-        try:
-            # Save the voice message to the temp file
-            engine.save_to_file(message, temp_file_path)
-
-            # Ensure the file is completely written
-            engine.runAndWait()
-
-            # Wait until the file has a non-zero size
-            timeout = 5  # 5 seconds timeout
-            start_time = time.time()
-            while time.time() - start_time < timeout:
-                if os.path.getsize(temp_file_path) > 0:
-                    break
-                time.sleep(0.1)  # Check every 100 ms
-            
-            # Check if the file has non-zero size before attempting playback
-            if os.path.exists(temp_file_path) and os.path.getsize(temp_file_path) > 0:
-                print(f"Original WAV file created: {temp_file_path}")
-
-                # Load and resample the audio to 16 kHz
-                audio = AudioSegment.from_wav(temp_file_path)
-                audio = audio.set_frame_rate(16000)
-
-                # Save the resampled file
-                resampled_wav_path = temp_file_path.replace(".wav", "_16kHz.wav")
-                audio.export(resampled_wav_path, format="wav")
-                print(f"Resampled WAV file: {resampled_wav_path}")
-
-                # Play the resampled WAV file
-                media = pj.AudioMediaPlayer()
-                media.createPlayer(resampled_wav_path, pj.PJMEDIA_FILE_NO_LOOP)
-
-                # Transmit the audio to the call's media
-                call_media = self.getAudioMedia(0)  # Use the first media stream (index 0)
-                media.startTransmit(call_media)
-
-                # Calculate the duration of the audio in milliseconds
-                duration_ms = len(audio)
-                print(f"Audio duration: {duration_ms} ms")
-
-                # Wait for the duration of the audio to complete playback
-                duration = duration_ms / 1000
-                print("===========================================================")
-                print(f"sleep for {duration}")
-                time.sleep(duration)
-            else:
-                print("Error: Temporary WAV file is empty or not found.")
+            # Wait for the duration of the audio to complete playback
+            print("===========================================================")
+            print(f"sleep for {clip.duration}")
+            time.sleep(clip.duration)
+            port.stopTransmit(call_media)
         except Exception as e:
             print(f"Error playing message: {e}")
         finally:
-            # Clean up the temporary file
-            # if os.path.exists(temp_file_path):
-            #     os.remove(temp_file_path)
-            
             print("===========================================================")
             # Ensure call state is CONFIRMED before hanging up
             call_info = self.getInfo()
@@ -0,0 +1,118 @@
+# Benchmarks the rotary pulse decoder in device/pulse_decoder.py off the Pi.
+#
+# With no arguments it synthesizes labelled traces and reports decode
+# throughput, accuracy, and accuracy under contact bounce and timing jitter.
+#
+# To check a trace recorded on the device (RINGRING_DIAL_TRACE=/tmp/dial.trace)
+# pass the trace and a text file with one expected number per line:
+#
+#   python dial_benchmark.py /tmp/dial.trace /tmp/dial.labels
+
+import os
+import sys
+import time
+import random
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "device"))
+
+import pulse_decoder
+from pulse_decoder import HIGH, LOW, decode, read_trace
+
+CLICKPIN = 35
+STOPPIN = 37
+
+PULSE_PERIOD = 0.1  # 10 pulses per second
+BREAK_RATIO = 0.6   # 60/40 break/make
+
+def synthesize(numbers, rng, bounce=0.0, jitter=0.0):
+    """Generate (timestamp, pin, level) edges for dialing each number in turn.
+
+    bounce is the probability of each rising click edge chattering and jitter
+    is the standard deviation, in seconds, added to every pulse.
+    """
+    edges = []
+    t = 1.0
+
+    def emit(timestamp, pin, level):
+        edges.append((timestamp, pin, level))
+
+    for number in numbers:
+        for digit in number:
+            pulses = int(digit) or 10
+
+            # The off-normal contact opens as the dial leaves rest
+            emit(t, STOPPIN, LOW)
+            t += 0.2
+
+            for _ in range(pulses):
+                rise = t + rng.gauss(0, jitter)
+                emit(rise, CLICKPIN, HIGH)
+                for i in range(rng.randint(1, 3) if rng.random() < bounce else 0):
+                    emit(rise + 0.001 * (2 * i + 1), CLICKPIN, LOW)
+                    emit(rise + 0.001 * (2 * i + 2), CLICKPIN, HIGH)
+                emit(rise + PULSE_PERIOD * BREAK_RATIO, CLICKPIN, LOW)
+                t += PULSE_PERIOD
+
+            emit(t + 0.05, STOPPIN, HIGH)
+            t += rng.uniform(0.3, 0.7)
+
+        t += 3
+
+    edges.sort()
+    return edges
+
+def random_numbers(rng, count):
+    return ["".join(rng.choice("0123456789") for _ in range(rng.choice((3, 4, 4, 4, 11)))) for _ in range(count)]
+
+def accuracy(decoded, labels):
+    correct = sum(1 for a, b in zip(decoded, labels) if a == b)
+    return correct / len(labels) if labels else 1.0
+
+def decode_arrays(timestamps, pins, levels):
+    digits, started, ended = pulse_decoder.decode_batch(timestamps, pins, levels, CLICKPIN, STOPPIN)
+    return pulse_decoder.sequences_from_digits(digits, started, ended)
+
+def throughput(edges, labels):
+    start = time.perf_counter()
+    decoded = decode(edges, CLICKPIN, STOPPIN)
+    elapsed = time.perf_counter() - start
+    print(f"streaming: {len(edges) / elapsed:,.0f} edges/s, accuracy {accuracy(decoded, labels):.2%}")
+
+    if pulse_decoder.np is None:
+        print("batch: skipped, NumPy is not installed")
+        return
+
+    np = pulse_decoder.np
+    timestamps, pins, levels = (np.array(column) for column in zip(*edges))
+    start = time.perf_counter()
+    batch = decode_arrays(timestamps, pins, levels)
+    elapsed = time.perf_counter() - start
+    print(f"batch:     {len(edges) / elapsed:,.0f} edges/s, accuracy {accuracy(batch, labels):.2%}, matches streaming: {batch == decoded}")
+
+def robustness(rng):
+    print("\nbounce probability / jitter (ms) -> accuracy")
+    for bounce in (0.0, 0.1, 0.5, 1.0):
+        for jitter in (0.0, 0.005, 0.02, 0.04):
+            labels = random_numbers(rng, 200)
+            decoded = decode(synthesize(labels, rng, bounce, jitter), CLICKPIN, STOPPIN)
+            print(f"  {bounce:4.0%} / {jitter * 1000:4.1f} -> {accuracy(decoded, labels):.2%}")
+
+def recorded(trace_path, labels_path):
+    with open(labels_path, "r") as file:
+        labels = [line.strip() for line in file if line.strip()]
+
+    edges = read_trace(trace_path)
+    decoded = decode(edges, CLICKPIN, STOPPIN)
+    print(f"{len(edges)} edges, decoded {decoded}")
+    throughput(edges, labels)
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3:
+        recorded(sys.argv[1], sys.argv[2])
+    else:
+        rng = random.Random(1)
+        labels = random_numbers(rng, 20000)
+        edges = synthesize(labels, rng, bounce=0.1, jitter=0.002)
+        print(f"{len(edges):,} synthetic edges for {len(labels):,} numbers")
+        throughput(edges, labels)
+        robustness(rng)
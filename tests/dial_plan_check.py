@@ -0,0 +1,55 @@
+# Checks that device/dial_plan.py falls back to the default plan when
+# config.json holds a dial plan it can't use, rather than raising and
+# taking the dialer thread down with it, and that the speaking clock's
+# number gets a rule of its own:
+#
+#   python dial_plan_check.py
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "device"))
+from dial_plan import DialPlan, DEFAULT_DIAL_PLAN, SPEAKING_CLOCK, COMPLETE, AMBIGUOUS, INVALID
+
+BAD_PLANS = {
+    "non-string pattern": [{"pattern": 911, "type": "emergency"}],
+    "unknown type": [{"pattern": "911", "type": "operator"}],
+    "bad pattern": [{"pattern": "9A1", "type": "extension"}],
+    "missing pattern": [{"type": "extension"}],
+    "rule not an object": [911],
+}
+
+def main():
+    default = [(rule.pattern, rule.type) for rule in DialPlan(DEFAULT_DIAL_PLAN).rules]
+    failures = 0
+    for name, rules in BAD_PLANS.items():
+        try:
+            plan = DialPlan.from_config({"dialPlan": rules})
+        except Exception as e:
+            print(f"FAIL {name}: raised {type(e).__name__}: {e}")
+            failures += 1
+            continue
+        if [(rule.pattern, rule.type) for rule in plan.rules] != default:
+            print(f"FAIL {name}: didn't fall back to the default plan")
+            failures += 1
+        elif plan.match("1234")[0] != COMPLETE or plan.match("12345")[0] != INVALID:
+            print(f"FAIL {name}: default plan doesn't match as expected")
+            failures += 1
+        else:
+            print(f"ok   {name}")
+
+    # A numeric value works too, and a bad one leaves the plan alone
+    for number, expected in (("123", AMBIGUOUS), (12345, COMPLETE), ("12a", None)):
+        plan = DialPlan.from_config({SPEAKING_CLOCK: number})
+        result, rule = plan.match(str(number))
+        if expected is None:
+            ok = len(plan.rules) == len(DEFAULT_DIAL_PLAN)
+        else:
+            ok = result == expected and rule is plan.rules[0] and rule.pattern == str(number)
+        print(f"{'ok  ' if ok else 'FAIL'} speaking clock {number!r}")
+        failures += not ok
+
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
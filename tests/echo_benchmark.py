@@ -0,0 +1,166 @@
+# Measures the latency and CPU each jitter buffer and echo canceller preset
+# adds, by replaying captured audio through pjsua2 file ports:
+#
+#   python echo_benchmark.py --mode jitter --wav captured.wav
+#   python echo_benchmark.py --mode echo --wav captured.wav --device "USB"
+#   python echo_benchmark.py --mode jitter --settings default low-latency
+#
+# The WAV file should be mono 16-bit PCM, e.g. a call recorded off the
+# handset with arecord. Without --wav a test signal of tone bursts is used.
+#
+# jitter: a fresh process per preset creates the endpoint the way sip()
+# does, with the null audio device, and places a call from one local account
+# to another over loopback TCP. The file is played into the caller's side
+# and the callee's side is recorded, so the audio crosses the codec, RTP
+# and the callee's jitter buffer. Latency is when the audio first appears
+# in the recording, less when it starts in the file.
+#
+# echo: pjsua2 only runs the echo canceller on a real sound device, so this
+# mode needs the handset's card. The file is played to the earpiece and the
+# microphone is recorded through the echo canceller. It prints how loud the
+# echo that got through is, and when it first appears. Keep quiet while it
+# runs, anything the microphone hears counts as echo.
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "device"))
+from harness import cpu_percent, wait_until, read_wav, write_test_signal, onset, loudness, loopback_calls
+
+def measure_jitter(name, source, recording, duration):
+    """Runs in the child process for one jitter buffer preset."""
+    import pjsua2 as pj
+    from sip import create_endpoint, create_transport
+    from media_profile import JITTER_BUFFERS
+
+    media = {}
+    streams = {}
+
+    def on_media(side, call, media_index):
+        media[side] = pj.AudioMedia.typecastFromMedia(call.getMedia(media_index))
+        streams[side] = (call, media_index)
+
+    ep = create_endpoint(null_audio=True, jitter_buffer=JITTER_BUFFERS[name])
+    transport = create_transport(ep, port=0)
+    ep.libStart()
+    place_call = loopback_calls(ep, transport, on_media)
+    place_call()
+
+    if not wait_until(lambda: len(media) >= 2):
+        print(f"{name:12s} call has no media", flush=True)
+        ep.libDestroy()
+        return
+
+    # Let RTP settle before the clock starts
+    time.sleep(1)
+
+    recorder = pj.AudioMediaRecorder()
+    recorder.createRecorder(recording)
+    player = pj.AudioMediaPlayer()
+    player.createPlayer(source, pj.PJMEDIA_FILE_NO_LOOP)
+    media["callee"].startTransmit(recorder)
+    player.startTransmit(media["caller"])
+
+    cpu = cpu_percent(duration)
+
+    player.stopTransmit(media["caller"])
+    media["callee"].stopTransmit(recorder)
+    # The callee's jitter buffer is the one the audio went through
+    callee, media_index = streams["callee"]
+    stat = callee.getStreamStat(media_index).jbuf
+    # Closes the WAV file
+    del recorder, player
+    ep.hangupAllCalls()
+    time.sleep(0.5)
+    ep.libDestroy()
+
+    samples, rate = read_wav(source)
+    recorded, recorded_rate = read_wav(recording)
+    start, heard = onset(samples, rate), onset(recorded, recorded_rate)
+    latency = f"{(heard - start) * 1000:10.0f}" if start is not None and heard is not None else "  not heard"
+    print(f"{name:12s} {latency} {stat.avgDelayMsec:10d} {stat.discard:9d} {cpu:8.1f}", flush=True)
+
+def measure_echo(name, source, recording, duration, device):
+    """Runs in the child process for one echo canceller preset."""
+    import pjsua2 as pj
+    from sip import create_endpoint
+    from media_profile import ECHO_CANCELLERS
+
+    ep = create_endpoint(audio_pattern=device, echo=ECHO_CANCELLERS[name])
+    ep.libStart()
+    manager = ep.audDevManager()
+
+    # Let the sound device and echo canceller start up
+    time.sleep(1)
+
+    recorder = pj.AudioMediaRecorder()
+    recorder.createRecorder(recording)
+    player = pj.AudioMediaPlayer()
+    player.createPlayer(source, pj.PJMEDIA_FILE_NO_LOOP)
+    manager.getCaptureDevMedia().startTransmit(recorder)
+    player.startTransmit(manager.getPlaybackDevMedia())
+
+    cpu = cpu_percent(duration)
+
+    player.stopTransmit(manager.getPlaybackDevMedia())
+    manager.getCaptureDevMedia().stopTransmit(recorder)
+    del recorder, player
+    ep.libDestroy()
+
+    samples, rate = read_wav(source)
+    recorded, recorded_rate = read_wav(recording)
+    start, heard = onset(samples, rate), onset(recorded, recorded_rate, floor=-60)
+    latency = f"{(heard - start) * 1000:10.0f}" if start is not None and heard is not None else "  no echo"
+    print(f"{name:12s} {loudness(samples, rate):9.1f} {loudness(recorded, recorded_rate):9.1f} {latency} {cpu:8.1f}", flush=True)
+
+def main():
+    from media_profile import JITTER_BUFFERS, ECHO_CANCELLERS
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=["jitter", "echo"], default="jitter")
+    parser.add_argument("--settings", nargs="+", help="presets to compare, all of them by default")
+    parser.add_argument("--wav", help="captured audio, mono 16-bit PCM")
+    parser.add_argument("--device", default="USB", help="sound card pattern for --mode echo")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--recording", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    presets = JITTER_BUFFERS if args.mode == "jitter" else ECHO_CANCELLERS
+
+    if args.child:
+        samples, rate = read_wav(args.wav)
+        # Room for the tail of the audio to come through
+        duration = len(samples) / rate + 1
+        if args.mode == "jitter":
+            measure_jitter(args.child, args.wav, args.recording, duration)
+        else:
+            measure_echo(args.child, args.wav, args.recording, duration, args.device)
+        return
+
+    for name in args.settings or []:
+        if name not in presets:
+            parser.error(f"unknown {args.mode} preset {name!r}, choose from {', '.join(presets)}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = args.wav
+        if source is None:
+            source = os.path.join(directory, "signal.wav")
+            write_test_signal(source)
+
+        if args.mode == "jitter":
+            print("preset       latency ms  jb avg ms  discards    CPU %")
+        else:
+            print("preset       played dB   echo dB  echo ms       CPU %")
+
+        for name in args.settings or list(presets):
+            # A fresh process per preset, pjsua2 can only be initialized once
+            recording = os.path.join(directory, f"{name}.wav")
+            subprocess.run([sys.executable, __file__, "--child", name, "--mode", args.mode, "--wav", source,
+                            "--recording", recording, "--device", args.device])
+
+if __name__ == "__main__":
+    main()
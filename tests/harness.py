@@ -0,0 +1,129 @@
+# Shared pieces of the media benchmarks: CPU measurement, WAV helpers for
+# finding when audio starts and how loud it is, and loopback calls between
+# two local accounts, so no SIP server is needed. pjsua2 is only imported
+# by loopback_calls(), the rest works without it.
+
+import os
+import math
+import time
+import wave
+import array
+
+# Window for the level and onset detection, in seconds
+WINDOW = 0.01
+
+# Audio starts where a window first comes within this many dB of the loudest
+ONSET_DB = 30
+
+def cpu_percent(duration):
+    """CPU this process used over the next duration seconds, in % of one core."""
+    start = os.times()
+    wall = time.monotonic()
+    time.sleep(duration)
+    end = os.times()
+    return ((end.user - start.user) + (end.system - start.system)) / (time.monotonic() - wall) * 100
+
+def wait_until(predicate, timeout=10):
+    """Poll predicate() until it is true, returning False after timeout seconds."""
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.1)
+    return True
+
+def read_wav(path):
+    """Samples and sample rate of a mono 16-bit WAV file."""
+    with wave.open(path) as wav:
+        if wav.getnchannels() != 1 or wav.getsampwidth() != 2:
+            raise SystemExit(f"{path} must be mono 16-bit PCM")
+        samples = array.array("h", wav.readframes(wav.getnframes()))
+        return samples, wav.getframerate()
+
+def write_test_signal(path, rate=16000):
+    """Half a second of silence, then one second bursts of tones and silence."""
+    samples = array.array("h", bytes(rate))
+    for burst in range(4):
+        frequency = 440 * (burst + 1)
+        samples.extend(int(8000 * math.sin(2 * math.pi * frequency * i / rate)) for i in range(rate // 2))
+        samples.extend([0] * (rate // 2))
+
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(samples.tobytes())
+
+def levels(samples, rate):
+    """RMS level of each window, in dBFS."""
+    size = max(1, int(rate * WINDOW))
+    result = []
+    for start in range(0, len(samples) - size + 1, size):
+        power = sum(sample * sample for sample in samples[start:start + size]) / size
+        result.append(10 * math.log10(power / 32768 ** 2) if power else -120.0)
+    return result
+
+def onset(samples, rate, floor=None):
+    """Seconds until the audio starts, or None if it never rises above floor."""
+    window_levels = levels(samples, rate)
+    if not window_levels:
+        return None
+    threshold = max(window_levels) - ONSET_DB
+    if floor is not None:
+        threshold = max(threshold, floor)
+    for index, level in enumerate(window_levels):
+        if level >= threshold:
+            return index * WINDOW
+    return None
+
+def loudness(samples, rate):
+    """Mean level of the windows that aren't silent, in dBFS."""
+    audible = [level for level in levels(samples, rate) if level > -90]
+    return sum(audible) / len(audible) if audible else -120.0
+
+def loopback_calls(ep, transport, on_media):
+    """Create a caller and a callee account on transport, which call each other over loopback.
+
+    on_media(side, call, media_index) runs for each end, side "caller" or
+    "callee", once its audio is active. Returns a function that places one
+    call. The callee answers every call, and the accounts and calls are
+    kept alive until the endpoint is destroyed.
+    """
+    import pjsua2 as pj
+
+    address = ep.transportGetInfo(transport).localName
+    held = []
+
+    class LoopbackCall(pj.Call):
+        def __init__(self, account, side, call_id=pj.PJSUA_INVALID_ID):
+            pj.Call.__init__(self, account, call_id)
+            self.side = side
+
+        def onCallMediaState(self, prm):
+            for mi in self.getInfo().media:
+                if mi.type == pj.PJMEDIA_TYPE_AUDIO and mi.status == pj.PJSUA_CALL_MEDIA_ACTIVE:
+                    on_media(self.side, self, mi.index)
+
+    class Callee(pj.Account):
+        def onIncomingCall(self, prm):
+            call = LoopbackCall(self, "callee", prm.callId)
+            call_prm = pj.CallOpParam()
+            call_prm.statusCode = 200
+            call.answer(call_prm)
+            held.append(call)
+
+    accounts = {}
+    for user in ("caller", "callee"):
+        acc_cfg = pj.AccountConfig()
+        acc_cfg.idUri = f"sip:{user}@{address};transport=tcp"
+        acc_cfg.sipConfig.transportId = transport
+        accounts[user] = Callee() if user == "callee" else pj.Account()
+        accounts[user].create(acc_cfg)
+
+    def place_call():
+        call = LoopbackCall(accounts["caller"], "caller")
+        call.makeCall(f"sip:callee@{address};transport=tcp", pj.CallOpParam(True))
+        held.append(call)
+        return call
+
+    return place_call
@@ -0,0 +1,96 @@
+# Measures backend throughput and latency, to compare the development server
+# (python main.py) with the production one (python serve.py).
+#
+# Start the device (or at least device/shared_memory.py) so /api/status has
+# something to read, start one of the servers, then run for example:
+#
+#   python http_benchmark.py --clients 16 --streams 8 --duration 20
+#
+# --clients hammer GET /api/status over keep-alive connections while
+# --streams hold /api/status/stream open the way browser tabs do, which is
+# what starves the single-threaded development server. It prints requests
+# per second, latency percentiles and errors for one run; run it once per
+# server mode on the same hardware to compare them.
+
+import time
+import socket
+import argparse
+import threading
+import http.client
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def client(host, port, path, deadline, latencies, errors):
+    connection = http.client.HTTPConnection(host, port, timeout=10)
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            connection.request("GET", path)
+            response = connection.getresponse()
+            response.read()
+            if response.status >= 500:
+                errors.append(response.status)
+            else:
+                latencies.append(time.perf_counter() - start)
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(str(e))
+            connection.close()
+            connection = http.client.HTTPConnection(host, port, timeout=10)
+    connection.close()
+
+def stream(host, port, deadline, events, turned_away):
+    try:
+        sock = socket.create_connection((host, port), timeout=2)
+        sock.sendall(f"GET /api/status/stream HTTP/1.1\r\nHost: {host}\r\nAccept: text/event-stream\r\n\r\n".encode())
+        while time.monotonic() < deadline:
+            try:
+                data = sock.recv(4096)
+            except socket.timeout:
+                continue
+            if not data:
+                break
+            events.append(data.count(b"\ndata: "))
+            if b"\nretry: " in data:
+                # Over the worker's stream limit, the server closes it
+                turned_away.append(1)
+        sock.close()
+    except OSError as e:
+        print(f"Stream failed: {e}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--path", default="/api/status")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--streams", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args()
+
+    deadline = time.monotonic() + args.duration
+    latencies = []
+    errors = []
+    events = []
+    turned_away = []
+
+    threads = [threading.Thread(target=stream, args=(args.host, args.port, deadline, events, turned_away)) for _ in range(args.streams)]
+    threads += [threading.Thread(target=client, args=(args.host, args.port, args.path, deadline, latencies, errors)) for _ in range(args.clients)]
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    print(f"{args.clients} clients, {args.streams} open streams, {args.duration:.0f} s")
+    print(f"requests/s: {len(latencies) / args.duration:,.1f}")
+    print(f"latency ms: p50 {percentile(latencies, 0.5) * 1000:.1f}, p95 {percentile(latencies, 0.95) * 1000:.1f}, p99 {percentile(latencies, 0.99) * 1000:.1f}")
+    print(f"errors: {len(errors)}")
+    print(f"stream events received: {sum(events)}")
+    print(f"streams turned away: {len(turned_away)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# Floods the device with incoming calls to check that ringing them costs
+# no extra threads or CPU. Run it on the Pi next to ringring.py:
+#
+#   python invite_storm.py --pid $(pgrep -f ringring.py) --rate 20 --duration 30
+#
+# It sends INVITEs straight to the device's SIP port over TCP, the way a
+# SIP scanner or a burst of spam calls would, and cancels a share of them
+# after a moment, like callers who give up. Once a second it prints the
+# thread count and CPU use of the device process, which should stay flat
+# for the whole run, and at the end the responses the device sent back.
+
+import os
+import time
+import uuid
+import random
+import socket
+import argparse
+import threading
+from collections import Counter
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+SDP = (
+    "v=0\r\n"
+    "o=- 0 0 IN IP4 {host}\r\n"
+    "s=storm\r\n"
+    "c=IN IP4 {host}\r\n"
+    "t=0 0\r\n"
+    "m=audio 40000 RTP/AVP 0\r\n"
+    "a=rtpmap:0 PCMU/8000\r\n"
+)
+
+def request(method, target, local, call_id, branch, tag, body=""):
+    return (
+        f"{method} sip:{target} SIP/2.0\r\n"
+        f"Via: SIP/2.0/TCP {local};branch=z9hG4bK{branch}\r\n"
+        f"Max-Forwards: 70\r\n"
+        f"From: <sip:storm@{local}>;tag={tag}\r\n"
+        f"To: <sip:{target}>\r\n"
+        f"Call-ID: {call_id}\r\n"
+        f"CSeq: 1 {method}\r\n"
+        f"Contact: <sip:storm@{local};transport=tcp>\r\n"
+        + (f"Content-Type: application/sdp\r\n" if body else "")
+        + f"Content-Length: {len(body)}\r\n\r\n{body}"
+    ).encode()
+
+def sample(pid):
+    """Return (threads, cpu seconds) for pid."""
+    with open(f"/proc/{pid}/status") as file:
+        threads = next(int(line.split()[1]) for line in file if line.startswith("Threads:"))
+    with open(f"/proc/{pid}/stat") as file:
+        fields = file.read().rsplit(")", 1)[1].split()
+    return threads, (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+def monitor(pid, stop):
+    previous = None
+    print("  time  threads  cpu %")
+    start = time.monotonic()
+    while not stop.wait(1):
+        threads, cpu = sample(pid)
+        now = time.monotonic()
+        if previous:
+            usage = (cpu - previous[1]) / (now - previous[0]) * 100
+            print(f"{now - start:6.0f} {threads:8d} {usage:6.1f}")
+        previous = (now, cpu)
+
+def receive(sock, responses, stop):
+    buffer = b""
+    while not stop.is_set():
+        try:
+            data = sock.recv(65536)
+        except socket.timeout:
+            continue
+        except OSError:
+            break
+        if not data:
+            break
+        buffer += data
+        while b"\r\n\r\n" in buffer:
+            head, buffer = buffer.split(b"\r\n\r\n", 1)
+            lines = head.decode(errors="replace").split("\r\n")
+            length = next((int(line.split(":", 1)[1]) for line in lines if line.lower().startswith("content-length:")), 0)
+            buffer = buffer[length:]
+            if lines[0].startswith("SIP/2.0"):
+                responses[lines[0].split(" ", 2)[1]] += 1
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5060)
+    parser.add_argument("--number", default="1000", help="user part of the request URI")
+    parser.add_argument("--pid", type=int, help="device process to watch")
+    parser.add_argument("--rate", type=float, default=10, help="INVITEs per second")
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--abandon", type=float, default=0.5, help="share of calls cancelled after a moment")
+    args = parser.parse_args()
+
+    sock = socket.create_connection((args.host, args.port))
+    sock.settimeout(0.5)
+    local = "%s:%d" % sock.getsockname()
+    target = f"{args.number}@{args.host}:{args.port};transport=tcp"
+    lock = threading.Lock()
+
+    stop = threading.Event()
+    responses = Counter()
+    threading.Thread(target=receive, args=(sock, responses, stop), daemon=True).start()
+    if args.pid:
+        threading.Thread(target=monitor, args=(args.pid, stop), daemon=True).start()
+
+    def cancel(call_id, branch, tag):
+        try:
+            with lock:
+                sock.sendall(request("CANCEL", target, local, call_id, branch, tag))
+        except OSError:
+            # The run already ended
+            pass
+
+    sent = 0
+    deadline = time.monotonic() + args.duration
+    while time.monotonic() < deadline:
+        call_id, branch, tag = uuid.uuid4().hex, uuid.uuid4().hex, uuid.uuid4().hex[:8]
+        with lock:
+            sock.sendall(request("INVITE", target, local, call_id, branch, tag, SDP.format(host=args.host)))
+        sent += 1
+
+        if random.random() < args.abandon:
+            threading.Timer(random.uniform(0.5, 3), cancel, args=(call_id, branch, tag)).start()
+
+        time.sleep(1 / args.rate)
+
+    # Give the device time to time out or answer what is left
+    time.sleep(2)
+    stop.set()
+    sock.close()
+
+    print(f"sent {sent} INVITEs")
+    for status, count in sorted(responses.items()):
+        print(f"  {status}: {count}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# Measures CPU per call for each media profile, with pjsua2's null audio
+# device so no sound card or SIP server is needed:
+#
+#   python media_benchmark.py --calls 2 --duration 20
+#   python media_benchmark.py --profiles native wideband
+#
+# For every profile it starts a fresh process that creates the endpoint the
+# way sip() does, measures idle CPU, then places calls from one local
+# account to another over the loopback TCP transport and measures CPU again
+# with audio flowing through the bridge, codecs and resamplers. It prints
+# the negotiated codec and the CPU each call costs.
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "device"))
+from harness import cpu_percent, wait_until, loopback_calls
+
+def measure(profile_name, calls, duration):
+    """Runs in the child process for one profile."""
+    import pjsua2 as pj
+    from sip import create_endpoint, create_transport
+    from media_profile import PROFILES
+
+    profile = PROFILES[profile_name]
+    codecs = []
+    active = []
+
+    def on_media(side, call, media_index):
+        media = pj.AudioMedia.typecastFromMedia(call.getMedia(media_index))
+        manager = ep.audDevManager()
+        manager.getCaptureDevMedia().startTransmit(media)
+        media.startTransmit(manager.getPlaybackDevMedia())
+
+        stream = call.getStreamInfo(media_index)
+        codecs.append(f"{stream.codecName}/{stream.codecClockRate}")
+        active.append(call)
+
+    ep = create_endpoint(null_audio=True, profile=profile)
+    transport = create_transport(ep, port=0)
+    ep.libStart()
+    place_call = loopback_calls(ep, transport, on_media)
+
+    idle = cpu_percent(duration / 2)
+
+    for _ in range(calls):
+        place_call()
+
+    # Both ends of every call have media once it's up
+    wait_until(lambda: len(active) >= 2 * calls)
+
+    busy = cpu_percent(duration)
+    codec = codecs[0] if codecs else "no media"
+
+    ep.hangupAllCalls()
+    time.sleep(0.5)
+    ep.libDestroy()
+
+    per_call = (busy - idle) / calls if calls else 0.0
+    print(f"{profile_name:12s} {profile.clock_rate:7d} {codec:18s} {idle:8.1f} {busy:8.1f} {per_call:10.1f}", flush=True)
+
+def main():
+    from media_profile import PROFILES
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profiles", nargs="+", default=list(PROFILES), choices=list(PROFILES))
+    parser.add_argument("--calls", type=int, default=1)
+    parser.add_argument("--duration", type=float, default=10, help="seconds to measure with calls up")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        measure(args.child, args.calls, args.duration)
+        return
+
+    print(f"{args.calls} call(s), CPU % of one core")
+    print("profile      bridge  codec                  idle     busy   per call")
+    for name in args.profiles:
+        # A fresh process per profile, pjsua2 can only be initialized once
+        subprocess.run([sys.executable, __file__, "--child", name, "--calls", str(args.calls), "--duration", str(args.duration)])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+# Measures how long the device takes to register after boot, against a
+# local registrar stand-in instead of the real PBX. Stop ringring.py first,
+# the stand-in listens on 127.0.0.1:5060 like the PBX would, then:
+#
+#   python register_benchmark.py --runs 5
+#   python register_benchmark.py --fail 3        # registrar down at first
+#   python register_benchmark.py --challenge     # digest auth round trip
+#   python register_benchmark.py --delay 200     # slow registrar
+#
+# Each run builds the endpoint, transport and account the way sip() does,
+# with the null audio device, and times from the start of the run until
+# REGISTERED_WITH_SIP is published. --fail answers the first REGISTERs
+# with 503 to show the backoff retries. The last column shows whether the
+# kernel is running a keepalive timer on the device's TCP connection, i.e.
+# whether create_transport()'s socket options took effect, and when the
+# first probe is due; expect about KEEPALIVE_IDLE seconds.
+
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "device"))
+from global_state import GlobalState, State
+from sip import MyAccount, create_endpoint, create_transport, account_config, PHONE_NUMBER, PASSWORD, SIP_IP
+
+class Registrar:
+    """Just enough of a SIP registrar over TCP to answer REGISTER."""
+
+    def __init__(self, port, fail, challenge, delay):
+        self.fail = fail
+        self.challenge = challenge
+        self.delay = delay
+        self.requests = 0
+        self.peers = []
+
+        self.server = socket.socket()
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(("127.0.0.1", port))
+        self.server.listen()
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def accept(self):
+        while True:
+            connection, peer = self.server.accept()
+            self.peers.append(peer)
+            threading.Thread(target=self.serve, args=(connection,), daemon=True).start()
+
+    def serve(self, connection):
+        buffer = b""
+        while True:
+            data = connection.recv(65536)
+            if not data:
+                return
+            buffer += data
+            while b"\r\n\r\n" in buffer:
+                head, buffer = buffer.split(b"\r\n\r\n", 1)
+                lines = head.decode(errors="replace").split("\r\n")
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                buffer = buffer[int(headers.get("content-length", 0)):]
+                if lines[0].startswith("REGISTER"):
+                    connection.sendall(self.respond(headers))
+
+    def respond(self, headers):
+        self.requests += 1
+        time.sleep(self.delay)
+
+        extra = ""
+        if self.requests <= self.fail:
+            status = "503 Service Unavailable"
+        elif self.challenge and "authorization" not in headers:
+            status = "401 Unauthorized"
+            extra = 'WWW-Authenticate: Digest realm="benchmark", nonce="%d", algorithm=MD5\r\n' % self.requests
+        else:
+            status = "200 OK"
+            extra = f"Contact: {headers.get('contact', '')};expires=300\r\nExpires: 300\r\n"
+
+        return (
+            f"SIP/2.0 {status}\r\n"
+            f"Via: {headers.get('via', '')}\r\n"
+            f"From: {headers.get('from', '')}\r\n"
+            f"To: {headers.get('to', '')};tag=registrar\r\n"
+            f"Call-ID: {headers.get('call-id', '')}\r\n"
+            f"CSeq: {headers.get('cseq', '')}\r\n"
+            f"{extra}"
+            f"Content-Length: 0\r\n\r\n"
+        ).encode()
+
+def keepalive_timer(local_port, remote_port):
+    """Seconds until the next keepalive probe on a 127.0.0.1 TCP connection, or None without one."""
+    with open("/proc/net/tcp") as file:
+        next(file)
+        for line in file:
+            fields = line.split()
+            local, remote, timer = fields[1], fields[2], fields[5]
+            if int(local.split(":")[1], 16) == local_port and int(remote.split(":")[1], 16) == remote_port:
+                active, when = timer.split(":")
+                # Timer 2 is the keepalive timer, "when" is in clock ticks
+                if int(active, 16) != 2:
+                    return None
+                return int(when, 16) / os.sysconf("SC_CLK_TCK")
+    return None
+
+def run(timeout, registrar, port):
+    globals = GlobalState()
+    globals.set(State.REGISTERED_WITH_SIP, False)
+
+    start = time.monotonic()
+    ep = create_endpoint(null_audio=True)
+    transport = create_transport(ep, port=0)
+    ep.libStart()
+    ready = time.monotonic()
+
+    account = MyAccount(ep)
+    account.register(account_config({PHONE_NUMBER: "1000", PASSWORD: "secret", SIP_IP: "127.0.0.1"}, transport))
+
+    # The same retry loop sip() runs, without the call handling
+    registered = None
+    version = globals.get_version()
+    while time.monotonic() - start < timeout:
+        if globals.get(State.REGISTERED_WITH_SIP):
+            registered = time.monotonic()
+            break
+        if account.monitor.retry_due():
+            account.renew()
+        deadline = account.monitor.deadline()
+        wait = max(0, deadline - time.monotonic()) if deadline is not None else 1
+        _, version = globals.wait_for_command([State.REGISTERED_WITH_SIP, State.REGISTRATION_RETRY], version, wait)
+
+    keepalive = None
+    if registered and registrar.peers:
+        keepalive = keepalive_timer(registrar.peers[-1][1], port)
+
+    failures = account.monitor.failed.snapshot()
+    account.shutdown()
+    ep.libDestroy()
+    return ready - start, registered - start if registered else None, failures, keepalive
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=5060)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--fail", type=int, default=0, help="REGISTERs answered 503 before the first 200")
+    parser.add_argument("--challenge", action="store_true", help="ask for digest auth first")
+    parser.add_argument("--delay", type=float, default=0, help="registrar response delay in ms")
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    registrar = Registrar(args.port, args.fail, args.challenge, args.delay / 1000)
+
+    print("run  endpoint ms  registered ms  failures so far  keepalive s")
+    for number in range(args.runs):
+        ready, registered, failures, keepalive = run(args.timeout, registrar, args.port)
+        registered = f"{registered * 1000:13.1f}" if registered is not None else "    timed out"
+        keepalive = f"{keepalive:12.1f}" if keepalive is not None else "         off"
+        print(f"{number + 1:3d} {ready * 1000:12.1f} {registered} {failures:16d} {keepalive}")
+    print(f"registrar saw {registrar.requests} REGISTERs")
+
+if __name__ == "__main__":
+    main()
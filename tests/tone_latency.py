@@ -0,0 +1,123 @@
+# Measures how long dial tone takes to start after the handset is lifted,
+# with pjsua2's null audio device so no sound card or SIP server is needed:
+#
+#   python tone_latency.py --runs 20
+#   python tone_latency.py --country uk --clock-rate 8000
+#
+# The tone engine runs in a thread that waits on GlobalState the way sip()
+# does, and plays into a recorder instead of the sound card. A stand-in for
+# hook.py's thread is woken by a simulated GPIO edge and takes the handset
+# off and back on the hook the way hook.py does. Each run prints the time
+# from the edge until the tone was queued on the bridge, and until it first
+# shows up in the recording, so the hop through the hook thread counts. The second includes up to a frame of bridge clock; the
+# real sound card adds its own output latency on top. The target is 50 ms.
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "device"))
+from global_state import GlobalState, State
+from calls import CallRegistry
+from harness import read_wav, onset
+
+def main():
+    import pjsua2 as pj
+    from sip import create_endpoint
+    from media_profile import PROFILES
+    import tones
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--country", default=tones.DEFAULT_COUNTRY, choices=list(tones.COUNTRIES))
+    parser.add_argument("--clock-rate", type=int, default=PROFILES["wideband"].clock_rate)
+    parser.add_argument("--hold", type=float, default=0.5, help="seconds off the hook per run")
+    args = parser.parse_args()
+
+    globals = GlobalState()
+    globals.set(State.ON_THE_HOOK, True)
+
+    ep = create_endpoint(null_audio=True)
+    ep.libStart()
+    engine = tones.ToneEngine(args.clock_rate, args.country)
+    registry = CallRegistry()
+
+    def drive():
+        ep.libRegisterThread("tones")
+        version = globals.get_version()
+        while True:
+            _, version = globals.wait_for_command([State.ON_THE_HOOK], version)
+            engine.update(registry)
+
+    # What hook.py's GPIO callback and loop do, with the edge time from
+    # the callback
+    edge = threading.Event()
+    edge_times = []
+
+    def gpio_edge():
+        edge_at = time.monotonic()
+        edge_times.append(edge_at)
+        edge.set()
+        return edge_at
+
+    def hook():
+        while True:
+            edge.wait()
+            edge.clear()
+            edge_at = edge_times.pop()
+            if globals.get(State.ON_THE_HOOK):
+                with globals.transaction() as state:
+                    state.set(State.ON_THE_HOOK, False)
+                    state.set(State.LIFTED_AT, edge_at)
+            else:
+                with globals.transaction() as state:
+                    state.set(State.ON_THE_HOOK, True)
+                    state.set(State.DIALING, False)
+                    state.set(State.PROGRESS_TONE, None)
+
+    threading.Thread(target=drive, daemon=True).start()
+    threading.Thread(target=hook, daemon=True).start()
+
+    print("run  queued ms  heard ms")
+    heard_latencies = []
+    with tempfile.TemporaryDirectory() as directory:
+        for number in range(args.runs):
+            path = os.path.join(directory, f"{number}.wav")
+            recorder = pj.AudioMediaRecorder()
+            recorder.createRecorder(path)
+            engine.connect(recorder)
+            recording_started = time.monotonic()
+
+            time.sleep(0.2)
+            queued = engine.start_latency.snapshot()["sum"]
+            lifted = gpio_edge()
+            time.sleep(args.hold)
+            queued = engine.start_latency.snapshot()["sum"] - queued
+            gpio_edge()
+            time.sleep(0.1)
+
+            engine.generator.stopTransmit(recorder)
+            # Closes the WAV file
+            del recorder
+
+            samples, rate = read_wav(path)
+            start = onset(samples, rate, floor=-60)
+            if start is None:
+                print(f"{number + 1:3d} {queued * 1000:10.1f}  not heard")
+                continue
+            heard = recording_started + start - lifted
+            heard_latencies.append(heard)
+            print(f"{number + 1:3d} {queued * 1000:10.1f} {heard * 1000:9.1f}")
+
+    snapshot = engine.start_latency.snapshot()
+    if snapshot["count"]:
+        print(f"queued: mean {snapshot['sum'] / snapshot['count'] * 1000:.1f} ms, max {snapshot['max'] * 1000:.1f} ms")
+    if heard_latencies:
+        print(f"heard: mean {sum(heard_latencies) / len(heard_latencies) * 1000:.1f} ms, max {max(heard_latencies) * 1000:.1f} ms")
+    ep.libDestroy()
+
+if __name__ == "__main__":
+    main()
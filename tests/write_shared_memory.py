@@ -1,41 +1,26 @@
-# This message will appear if the resource_tracker isn't patched.
-#
-# /usr/lib/python3.11/multiprocessing/resource_tracker.py:224: UserWarning:
-# resource_tracker: There appear to be 1 leaked shared_memory objects to clean
-# up at shutdown warnings.warn('resource_tracker: There appear to be %d '
-# 
+# Sets the ringing and busy states the way the backend does, through the
+# device's command mailbox. The device owns the shared memory segment and
+# publishes the new values there once it has applied the commands; the
+# hook, call and registration states come from the hardware and SIP, so
+# they can't be set from here.
 
-from multiprocessing import resource_tracker
+import os
+import sys
 
-def patched_register(name, rtype):
-    if rtype == 'shared_memory':
-        print(f"Register ignored for {name} ({rtype})")
-        return
-    original_register(name, rtype)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import mailbox
 
-original_register = resource_tracker.register
-resource_tracker.register = patched_register
+# Seconds to wait for the device to apply each command
+WAIT = 2
 
-from multiprocessing.shared_memory import SharedMemory
-import struct
+def write_shared_memory(ringing, busy):
+    mailbox.send(mailbox.BUSY, busy, wait=WAIT)
+    mailbox.send(mailbox.RING, ringing, wait=WAIT)
 
-def write_shared_memory(registered_with_sip, on_the_hook, call_active, ringing, busy):
-    # Attempt to connect to an existing shared memory block first
-    shm = SharedMemory(name="ringring", create=False)
-    print("Connected to existing shared memory block.")
-
-    # Pack the booleans into two bytes
-    data = struct.pack("?????", registered_with_sip, on_the_hook, call_active, ringing, busy)
-    shm.buf[:5] = data  # Write to shared memory
-    shm.close()
-
-    print(f"Written to shared memory: registeredWithSIP={registered_with_sip}, onTheHook={on_the_hook}, callActive={call_active}, ringing={ringing}, busy={busy}")
+    print(f"Device applied: ringing={ringing}, busy={busy}")
 
 if __name__ == "__main__":
     # Example usage
-    registered_with_sip = True
-    on_the_hook = True
-    call_active = False
     ringing = True
     busy = False
-    write_shared_memory(registered_with_sip, on_the_hook, call_active, ringing, busy)
\ No newline at end of file
+    write_shared_memory(ringing, busy)